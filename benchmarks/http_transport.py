@@ -0,0 +1,50 @@
+"""
+Bytes on the wire and wall time for each HTTP backend, with the synthetic web serving pages plain
+and compressed, so the transport options can be compared on the same crawl. Any other options are
+passed on to `benchmarks.scan_e2e`, which runs each variant in a process of its own.
+
+    python -m benchmarks.http_transport --articles 200 --latency-ms 20
+
+The synthetic web only speaks HTTP/1.1 in the clear, so the http2 backend falls back to HTTP/1.1
+here: this measures what compression saves and what httpx costs, not multiplexing.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from typing import Any
+
+from benchmarks.synthetic_web import ENCODERS
+from webmentions.scanner import request_utils
+
+
+def run_variant(scan_args: list[str], backend: str, compress: bool) -> dict[str, Any]:
+    command = [sys.executable, '-m', 'benchmarks.scan_e2e', *scan_args, '--http-backend', backend]
+    if compress:
+        command.append('--compress')
+    result: dict[str, Any] = json.loads(subprocess.run(command, stdout=subprocess.PIPE, text=True).stdout)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='HTTP transport benchmark', description=__doc__)
+    parser.add_argument(
+        '--backends', nargs='+', choices=request_utils.HTTP_BACKENDS, default=list(request_utils.HTTP_BACKENDS),
+    )
+    args, scan_args = parser.parse_known_args()
+
+    print(f'Accept-Encoding: {request_utils.ACCEPT_ENCODING} (server can send {", ".join(ENCODERS)})')
+    for backend in args.backends:
+        for compress in (False, True):
+            result = run_variant(scan_args, backend, compress)
+            print(
+                f"{backend:<8} {'compressed' if compress else 'plain':<10} "
+                f"{result['bytes_served'] / 1024 / 1024:>8.2f} MiB {result['elapsed_seconds']:>6.2f}s "
+                f"{result['pages_per_second']:>7.1f} pages/s {result['connections_opened']:>4} connections "
+                f"{result['peak_rss_kib'] / 1024:>6.1f} MiB peak RSS",
+                flush=True,
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Throws a burst of webmentions at the receiver (see `webmentions.receiver.server`) and reports how
+fast it accepted them and how the verification backlog grew and drained. The sources are the
+synthetic web's articles (see `benchmarks.synthetic_web`), so verifying them takes real fetches.
+
+    python -m benchmarks.receiver_load --requests 20000 --clients 32 --workers 8 --latency-ms 20
+
+Some of the mentions are repeats, as in a spam burst, and some are of targets the source doesn't
+link to.
+"""
+import argparse
+import concurrent.futures
+import functools
+import http.client
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+from urllib import parse
+
+import requests
+
+from benchmarks.synthetic_web import SyntheticWebProcess, add_web_arguments, params_from_args
+from webmentions.receiver.server import Receiver
+from webmentions.receiver.store import ReceivedMentionStore
+from webmentions.scanner import html_backend
+
+
+class Submission(NamedTuple):
+    source: str
+    target: str
+
+
+def article_links(site_url: str, articles: int) -> dict[str, list[str]]:
+    """What each of the synthetic web's articles links to, read off the articles themselves"""
+    links = {}
+    with requests.Session() as session:
+        for article in range(articles):
+            url = f'{site_url}posts/{article}'
+            links[url] = html_backend.parse(session.get(url).text).article_hrefs() or []
+    return links
+
+
+def submissions(
+    links: dict[str, list[str]], count: int, repeat_fraction: float, seed: int,
+) -> list[Submission]:
+    """A mix of mentions of targets the articles link to, targets they don't, and repeats of earlier ones"""
+    rng = random.Random(seed)
+    sources = sorted(links)
+    made: list[Submission] = []
+    for _ in range(count):
+        if made and rng.random() < repeat_fraction:
+            made.append(rng.choice(made))
+            continue
+        source = rng.choice(sources)
+        targets = links[source]
+        # One in every (links + 1) isn't linked from the source
+        index = rng.randrange(len(targets) + 1)
+        target = targets[index] if index < len(targets) else f'{targets[0]}-unlinked-{rng.randrange(1 << 30)}'
+        made.append(Submission(source, target))
+    return made
+
+
+class BacklogSampler:
+    """Samples the verification backlog in the background"""
+
+    def __init__(self, store: ReceivedMentionStore, interval_seconds: float = 0.1) -> None:
+        self._store = store
+        self._interval_seconds = interval_seconds
+        self._stopping = threading.Event()
+        self.samples: list[tuple[float, int]] = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._started = time.perf_counter()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self.samples.append((time.perf_counter() - self._started, self._store.backlog()))
+            self._stopping.wait(self._interval_seconds)
+
+    def __enter__(self) -> 'BacklogSampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._stopping.set()
+        self._thread.join()
+
+    @property
+    def peak(self) -> int:
+        return max((backlog for _, backlog in self.samples), default=0)
+
+
+def fire(url: str, batch: list[Submission]) -> int:
+    """
+    Posts each of `batch` over one keep-alive connection, and returns how many got a 202. This uses
+    http.client rather than requests, which costs more per request than the receiver does.
+    """
+    parsed = parse.urlsplit(url)
+    assert parsed.hostname is not None
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port)
+    accepted = 0
+    try:
+        for submission in batch:
+            body = parse.urlencode({'source': submission.source, 'target': submission.target})
+            connection.request('POST', parsed.path, body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            response = connection.getresponse()
+            response.read()
+            accepted += response.status == 202
+    finally:
+        connection.close()
+    return accepted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='Receiver load test', description=__doc__)
+    add_web_arguments(parser)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=16, help='How many senders post at once')
+    parser.add_argument('--workers', type=int, default=8, help="The receiver's verification workers")
+    parser.add_argument('--repeat-fraction', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--drain-timeout', type=float, default=120.0)
+    args = parser.parse_args()
+    params = params_from_args(args)
+
+    with SyntheticWebProcess(params) as web, tempfile.TemporaryDirectory() as tmp:
+        store = ReceivedMentionStore(os.path.join(tmp, 'received.sqlite3'))
+        made = submissions(article_links(web.site_url, params.articles), args.requests, args.repeat_fraction, args.seed)
+        # The synthetic web's target pages are on localhost, so that's whose mentions we're accepting
+        receiver = Receiver(store, ['127.0.0.1'], workers=args.workers)
+        with receiver, BacklogSampler(store) as sampler:
+            batches = [made[i::args.clients] for i in range(args.clients)]
+            # Senders in processes of their own, so that they're not competing with the receiver for the GIL
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.clients, mp_context=multiprocessing.get_context('spawn'),
+            ) as executor:
+                # Started up before the clock starts
+                list(executor.map(time.sleep, [0.1] * args.clients))
+                started = time.perf_counter()
+                accepted = sum(executor.map(functools.partial(fire, receiver.url), batches))
+            accept_seconds = time.perf_counter() - started
+            backlog_after_burst = store.backlog()
+
+            deadline = time.monotonic() + args.drain_timeout
+            while store.backlog() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            drain_seconds = time.perf_counter() - started
+        backlog = store.backlog()
+        store.close()
+        web.stop()
+
+    stats = receiver.workers.stats()
+    print(f'accepted {accepted}/{args.requests} in {accept_seconds:.2f}s ({accepted / accept_seconds:.0f}/s), '
+          f'{receiver.queued} queued, the rest repeats')
+    print(f'backlog {backlog_after_burst} after the burst, peaking at {sampler.peak}; '
+          f'{"drained" if not backlog else f"still {backlog}"} after {drain_seconds:.2f}s '
+          f'({(stats.verified + stats.rejected) / drain_seconds:.0f} checked/s)')
+    print(f'verified {stats.verified}, rejected {stats.rejected}, retried {stats.retried}, failed {stats.failed}')
+
+
+if __name__ == '__main__':
+    main()
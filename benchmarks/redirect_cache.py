@@ -0,0 +1,56 @@
+"""
+What the redirect cache (see `webmentions.scanner.redirects`) saves on a synthetic web (see
+`benchmarks.synthetic_web`) whose articles link to their targets through redirects: the same crawl
+is run without the cache, then with an empty one, then again with what the first run cached.
+
+    python -m benchmarks.redirect_cache --articles 100 --latency-ms 20 --redirect-hops 2
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from typing import Optional
+
+from benchmarks.synthetic_web import SyntheticWebProcess, add_web_arguments, params_from_args
+from webmentions.scanner import main as scanner, redirects, request_utils
+from webmentions.scanner.crawler import DEFAULT_CONCURRENCY
+from webmentions.scanner.redirects import RedirectCache
+
+
+def crawl(web: SyntheticWebProcess, concurrency: int, cache: Optional[RedirectCache]) -> tuple[float, int, int]:
+    """Returns how long the crawl took, how many requests it made, and how many candidates it found"""
+    redirects.set_cache(cache)
+    # Counted by the server, because redirects that requests follows itself don't go through our client
+    served_before = web.stats().requests_served
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            candidates = sum(1 for _ in scanner.generate_webmention_candidates(web.site_url, False, concurrency))
+    finally:
+        redirects.set_cache(None)
+    return time.perf_counter() - started, web.stats().requests_served - served_before, candidates
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='Redirect cache benchmark', description=__doc__)
+    add_web_arguments(parser)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+    request_utils.configure_client(pool_maxsize=args.concurrency)
+
+    with SyntheticWebProcess(params_from_args(args)) as web, tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'redirects.sqlite3')
+        runs = [('no cache', None), ('cold cache', RedirectCache(path)), ('warm cache', RedirectCache(path))]
+        for name, cache in runs:
+            elapsed, requests_sent, candidates = crawl(web, args.concurrency, cache)
+            skipped = f', {cache.stats().hops_skipped} redirects skipped' if cache is not None else ''
+            print(f'{name}: {requests_sent} requests in {elapsed:.2f}s, {candidates} candidates{skipped}')
+            if cache is not None:
+                cache.close()
+        web.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Scans a synthetic web (see `benchmarks.synthetic_web`) end to end and reports throughput, per-stage
+latencies and peak memory as JSON, so that runs from different commits can be compared.
+
+    python -m benchmarks.scan_e2e --articles 200 --latency-ms 20 --output before.json
+    python -m benchmarks.scan_e2e --articles 200 --latency-ms 20 --compare before.json
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional, TypeVar
+
+from benchmarks.synthetic_web import SyntheticWebProcess, add_web_arguments, params_from_args
+from webmentions.scanner import crawler, html_backend, main as scanner, metrics, request_utils
+from webmentions.scanner.crawler import DEFAULT_CONCURRENCY
+
+T = TypeVar('T')
+
+STAGES = ('feed', 'article', 'capabilities')
+
+
+class StageTimer:
+    """Collects how long each call to the wrapped stage functions took."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {stage: [] for stage in STAGES}
+
+    def wrap(self, stage: str, fn: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(fn)
+        def timed(*args: Any, **kwargs: Any) -> T:
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.samples[stage].append(elapsed)
+        return timed
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {stage: _summarize(samples) for stage, samples in self.samples.items()}
+
+
+def _percentile(sorted_samples: list[float], fraction: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(fraction * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+def _summarize(samples: list[float]) -> dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'total_seconds': sum(ordered),
+        'p50_ms': _percentile(ordered, 0.50) * 1000,
+        'p99_ms': _percentile(ordered, 0.99) * 1000,
+    }
+
+
+@contextlib.contextmanager
+def _instrumented(timer: StageTimer) -> Any:
+    """Times the scanner's stages by swapping its functions for timed ones, for the duration"""
+    patches = [
+        (crawler, 'scan_site_for_feed', 'feed'),
+        (scanner, 'find_article_links', 'article'),
+        (scanner, 'stream_page_check_mention_capabilities', 'capabilities'),
+        (scanner, 'fetch_page_check_mention_capabilities', 'capabilities'),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    try:
+        for module, name, stage in patches:
+            setattr(module, name, timer.wrap(stage, getattr(module, name)))
+        yield
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _peak_rss_kib() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    html_backend.set_default_backend(args.html_backend)
+    request_utils.configure_client(
+        pool_connections=args.pool_size, pool_maxsize=args.pool_size, backend=args.http_backend,
+    )
+    params = params_from_args(args)
+    timer = StageTimer()
+    # The scanner's own per-stage metrics, which split fetching from parsing
+    collected = metrics.enable()
+
+    with SyntheticWebProcess(params) as web, _instrumented(timer):
+        candidates = 0
+        started = time.perf_counter()
+        if args.mode == 'scan':
+            # scan() reports what it found by printing it
+            with contextlib.redirect_stdout(io.StringIO()):
+                scanner.scan(
+                    web.site_url, notify=False, single_page=False, concurrency=args.concurrency,
+                    full_page_discovery=args.full_page_discovery,
+                )
+        else:
+            resolve = (
+                scanner.fetch_page_check_mention_capabilities if args.full_page_discovery
+                else scanner.stream_page_check_mention_capabilities
+            )
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in scanner.generate_webmention_candidates(
+                    web.site_url, single_page=False, concurrency=args.concurrency, resolve_capabilities=resolve,
+                ):
+                    candidates += 1
+        elapsed = time.perf_counter() - started
+        web_stats = web.stop()
+    metrics.disable()
+
+    client_stats = request_utils.client().stats()
+    return {
+        'commit': _git_commit(),
+        'mode': args.mode,
+        'params': {
+            **params._asdict(),
+            'concurrency': args.concurrency,
+            'pool_size': args.pool_size,
+            'http_backend': args.http_backend,
+            'html_backend': args.html_backend,
+            'full_page_discovery': args.full_page_discovery,
+        },
+        'elapsed_seconds': elapsed,
+        'pages_fetched': web_stats.requests_served,
+        'pages_per_second': web_stats.requests_served / elapsed if elapsed else 0.0,
+        'bytes_served': web_stats.bytes_served,
+        'articles_per_second': len(timer.samples['article']) / elapsed if elapsed else 0.0,
+        'candidates': candidates if args.mode == 'generate' else None,
+        'connections_opened': client_stats.connections_opened,
+        'stages': timer.summary(),
+        'scanner_metrics': collected.to_json()['stages'],
+        'peak_rss_kib': _peak_rss_kib(),
+    }
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any]) -> list[str]:
+    """Human-readable ratios of `result` against `baseline`; above 1 is better for throughput."""
+
+    def ratio(new: float, old: float) -> str:
+        return f'{new / old:.2f}x' if old else 'n/a'
+
+    lines = [
+        f"pages/sec: {baseline['pages_per_second']:.1f} -> {result['pages_per_second']:.1f} "
+        f"({ratio(result['pages_per_second'], baseline['pages_per_second'])})",
+        f"peak RSS: {baseline['peak_rss_kib']} -> {result['peak_rss_kib']} KiB",
+    ]
+    for stage in STAGES:
+        old = baseline['stages'].get(stage)
+        new = result['stages'].get(stage)
+        if not old or not new:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            lines.append(f'{stage} {key}: {old[key]:.2f} -> {new[key]:.2f} ({ratio(new[key], old[key])})')
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='Scanner benchmark', description=__doc__)
+    add_web_arguments(parser)
+    parser.add_argument('--mode', choices=['generate', 'scan'], default='generate')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--pool-size', type=int, default=request_utils.DEFAULT_POOL_MAXSIZE)
+    parser.add_argument('--http-backend', choices=request_utils.HTTP_BACKENDS, default=request_utils.URLLIB3)
+    parser.add_argument('--html-backend', choices=sorted(html_backend.BACKENDS), default='lxml')
+    parser.add_argument('--full-page-discovery', action='store_true')
+    parser.add_argument('--output', type=argparse.FileType('w'), default='-', help='Where to write the JSON')
+    parser.add_argument('--compare', type=argparse.FileType('r'), help='An earlier result to compare against')
+    args = parser.parse_args()
+
+    result = run(args)
+    json.dump(result, args.output, indent=2)
+    args.output.write('\n')
+    if args.compare:
+        for line in compare(result, json.load(args.compare)):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+How much memory the per-run target memo (`coalesce.SingleFlight`) takes over a big crawl, with the
+exact memo and with a Bloom filter for the targets that have no endpoints.
+
+    python -m benchmarks.seen_memory --links 1000000 --targets 500000
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable
+
+from webmentions.scanner.coalesce import SingleFlight
+from webmentions.scanner.mention_detector import MentionCapabilities, NO_CAPABILITIES
+from webmentions.scanner.urls import BloomSeenSet, already_normalized
+
+# Roughly how many targets on a real crawl advertise an endpoint
+CAPABLE_EVERY = 20
+
+
+def _resolve(url: str) -> MentionCapabilities:
+    target = int(url.rsplit('/', 1)[1])
+    if target % CAPABLE_EVERY:
+        return NO_CAPABILITIES
+    return MentionCapabilities(webmention_url=f'https://host-{target % 1000}.example/webmention', pingback_url=None)
+
+
+def crawl(single_flight: SingleFlight[MentionCapabilities], links: int, targets: int) -> int:
+    """Returns how many of the links had endpoints"""
+    lookup = single_flight.wrap(_resolve)
+    capable = 0
+    for link in range(links):
+        # A fresh string each time, like parsing every article makes
+        target = link * 7919 % targets
+        capable += lookup(f'https://host-{target % 1000}.example/posts/{target}') != NO_CAPABILITIES
+    return capable
+
+
+def run(make: Callable[[], SingleFlight[MentionCapabilities]], links: int, targets: int) -> tuple[float, int, int]:
+    """Returns the time the crawl took, how much memory the memo kept hold of, and how many links had endpoints"""
+    # Timed without tracemalloc, which slows everything down a lot
+    started = time.perf_counter()
+    crawl(make(), links, targets)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    single_flight = make()
+    capable = crawl(single_flight, links, targets)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, retained, capable
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='Seen-set memory', description=__doc__)
+    parser.add_argument('--links', type=int, default=1_000_000)
+    parser.add_argument('--targets', type=int, default=500_000)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    args = parser.parse_args()
+
+    def bloom() -> SingleFlight[MentionCapabilities]:
+        seen = BloomSeenSet(args.error_rate, capacity=args.targets, normalize=already_normalized)
+        return SingleFlight(empty=NO_CAPABILITIES, seen=seen)
+
+    variants: dict[str, Callable[[], SingleFlight[MentionCapabilities]]] = {
+        'exact': SingleFlight[MentionCapabilities],
+        f'bloom ({args.error_rate:g})': bloom,
+    }
+    for name, make in variants.items():
+        elapsed, retained, capable = run(make, args.links, args.targets)
+        print(f'{name:<16} {retained / 1024 / 1024:>8.1f} MiB retained {elapsed:>6.2f}s {capable} capable links')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+How a crawl of the synthetic web (see `benchmarks.synthetic_web`) speeds up when it's shared out
+between more shard processes (see `webmentions.scanner.shard`). Each count of processes gets a
+fresh work queue, and the site is added once: everything past that is the processes pulling
+articles and links from the queue.
+
+    python -m benchmarks.shard_scaling --articles 200 --latency-ms 20 --processes 1 2 4 8
+
+Past the first few processes, what limits it is usually the CPU (the synthetic web shares the
+machine), so the more of the time the network would take, the closer to linear it gets. Keep
+`--threads` low for a fair comparison: a single process with plenty of threads is already
+quick at waiting on slow servers, and the point is to see what adding processes does.
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import multiprocessing.synchronize
+import os
+import tempfile
+import time
+from typing import Any
+
+from benchmarks.synthetic_web import SyntheticWebProcess, add_web_arguments, params_from_args
+from webmentions.scanner.shard import ShardStats, ShardWorker, site_unit
+from webmentions.scanner.work_queue import SqliteWorkQueue
+
+
+def _shard(queue_path: str, threads: int, go: multiprocessing.synchronize.Event, results: Any) -> None:
+    queue = SqliteWorkQueue(queue_path)
+    worker = ShardWorker(queue, on_candidate=lambda candidate: None, threads=threads)
+    go.wait()
+    # The scanner's progress output
+    with contextlib.redirect_stdout(io.StringIO()):
+        results.put(worker.run())
+    queue.close()
+
+
+def crawl(site_url: str, processes: int, threads: int) -> tuple[float, list[ShardStats]]:
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        queue_path = os.path.join(tmp, 'work.sqlite3')
+        queue = SqliteWorkQueue(queue_path)
+        queue.add([site_unit(site_url)])
+        go = context.Event()
+        results = context.Queue()
+        shards = [context.Process(target=_shard, args=(queue_path, threads, go, results)) for _ in range(processes)]
+        for shard in shards:
+            shard.start()
+        # Give them time to import everything, so that that's not what's being measured
+        time.sleep(1.0 + 0.1 * processes)
+        started = time.perf_counter()
+        go.set()
+        stats = [results.get() for _ in shards]
+        elapsed = time.perf_counter() - started
+        for shard in shards:
+            shard.join()
+        assert not queue.outstanding()
+        queue.close()
+    return elapsed, stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='Shard scaling benchmark', description=__doc__)
+    add_web_arguments(parser)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=1, help='Threads per shard process')
+    args = parser.parse_args()
+
+    with SyntheticWebProcess(params_from_args(args)) as web:
+        baseline = None
+        for processes in args.processes:
+            elapsed, stats = crawl(web.site_url, processes, args.threads)
+            units = sum(s.sites + s.articles + s.targets for s in stats)
+            rate = units / elapsed
+            baseline = baseline or rate / processes
+            print(
+                f'{processes:3} processes: {units} units in {elapsed:.2f}s ({rate:.0f}/s), '
+                f'{rate / baseline:.2f}x one process, {sum(s.candidates for s in stats)} candidates, '
+                f'split {"/".join(str(s.articles + s.targets) for s in stats)}'
+            )
+        web.stop()
+
+
+if __name__ == '__main__':
+    main()
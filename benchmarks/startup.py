@@ -0,0 +1,113 @@
+"""
+How long the scanner takes to start, going by `python -X importtime`, against a budget. The CLI
+gets run from cron and hooks a lot, so this adds up.
+
+    python -m benchmarks.startup --runs 5
+
+With --check (as `tasks/startup` runs it), it fails if startup's over budget. That's not part of the
+tests, because how long anything takes depends on what else the machine is doing.
+
+Most of the time goes on requests and lxml, which every scan needs. What the budget's about is the
+rest: our own modules, and the heavy dependencies that only some code paths need, which should be
+imported by those code paths rather than up front.
+"""
+import argparse
+import subprocess
+import sys
+from typing import NamedTuple
+
+ENTRY_POINT = 'webmentions.scanner.main'
+
+# Only needed by some runs: the bs4 HTML backend, feeds lxml can't parse, sending pingbacks, and the
+# HTTP/2 backend. None of them should be imported just by starting up.
+DEFERRED_MODULES = (
+    'bs4',
+    'feedparser',
+    'httpx',
+    'webmentions.scanner.bs4_utils',
+    'webmentions.scanner.http2',
+    'webmentions.scanner.xmlrpc',
+)
+
+# For the import time of our own modules (not counting what they import), best of a few runs. There's
+# a lot of headroom here for slow CI machines; anything close to it means something's doing real work
+# at import time.
+OWN_MODULES_BUDGET_MS = 100.0
+
+
+class ImportedModule(NamedTuple):
+    name: str
+    self_us: int
+    cumulative_us: int
+
+
+class ImportProfile(NamedTuple):
+    modules: list[ImportedModule]
+
+    @property
+    def total_ms(self) -> float:
+        return sum(module.self_us for module in self.modules) / 1000
+
+    @property
+    def own_modules_ms(self) -> float:
+        """How long importing `webmentions` itself took, without its dependencies"""
+        return sum(
+            module.self_us for module in self.modules
+            if module.name == 'webmentions' or module.name.startswith('webmentions.')
+        ) / 1000
+
+    def imported(self, name: str) -> bool:
+        """Whether `name` or any of its submodules was imported"""
+        return any(module.name == name or module.name.startswith(f'{name}.') for module in self.modules)
+
+
+def parse_importtime(output: str) -> ImportProfile:
+    """Parses what `-X importtime` writes to stderr"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line.removeprefix('import time:').split('|')
+        if not self_us.strip().isdigit():
+            # The header
+            continue
+        modules.append(ImportedModule(name.strip(), int(self_us), int(cumulative_us)))
+    return ImportProfile(modules)
+
+
+def profile_startup(module: str = ENTRY_POINT) -> ImportProfile:
+    """Imports `module` in a fresh interpreter and returns where the time went"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def best_of(runs: int, module: str = ENTRY_POINT) -> ImportProfile:
+    """The fastest of `runs` startups, so that a noisy neighbour doesn't count against us"""
+    return min((profile_startup(module) for _ in range(runs)), key=lambda profile: profile.total_ms)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='Startup time', description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='How many of the slowest imports to show')
+    parser.add_argument('--module', default=ENTRY_POINT)
+    parser.add_argument('--check', action='store_true', help='Exit non-zero if startup is over budget')
+    args = parser.parse_args()
+
+    profile = best_of(args.runs, args.module)
+    print(f'total {profile.total_ms:.1f}ms, own modules {profile.own_modules_ms:.1f}ms '
+          f'(budget {OWN_MODULES_BUDGET_MS:.0f}ms)')
+    eager = [name for name in DEFERRED_MODULES if profile.imported(name)]
+    if eager:
+        print(f'imported eagerly, but should not be: {", ".join(eager)}')
+    for module in sorted(profile.modules, key=lambda module: module.self_us, reverse=True)[:args.top]:
+        print(f'{module.self_us / 1000:>8.1f}ms {module.cumulative_us / 1000:>8.1f}ms cumulative  {module.name}')
+    if args.check and (eager or profile.own_modules_ms >= OWN_MODULES_BUDGET_MS):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
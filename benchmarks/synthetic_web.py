@@ -0,0 +1,430 @@
+"""
+A made-up web to point the scanner at, served from localhost so benchmarks don't depend on (or
+bother) the real internet.
+
+The site has a homepage linking to a feed, a feed of `articles` entries, and articles that each
+link out to `links_per_article` target pages. The targets live on `target_hosts` other servers
+(the scanner ignores links to the site's own host) and advertise their endpoints every way the
+scanner knows about, plus not at all. With `compress`, pages are served in whichever of gzip, brotli
+and zstd (the latter two if their packages are installed) the client asks for. With
+`redirect_hops`, articles link to their targets through a chain of redirects. The first
+`tarpit_targets` targets trickle their pages out a byte at a time, for as long as anyone's listening.
+
+    python -m benchmarks.synthetic_web --articles 50
+
+serves one until interrupted and prints its URL.
+"""
+import argparse
+import gzip
+import http.server
+import multiprocessing
+import multiprocessing.connection
+import socketserver
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+from xml.sax.saxutils import escape
+
+# Preferred first, like most CDNs
+ENCODERS: dict[str, Callable[[bytes], bytes]] = {}
+try:
+    import zstandard
+    # Not ZstdCompressor().compress, which can't be shared between the server's threads
+    ENCODERS['zstd'] = zstandard.compress
+except ImportError:
+    pass
+try:
+    import brotli
+    ENCODERS['br'] = brotli.compress
+except ImportError:
+    pass
+ENCODERS['gzip'] = gzip.compress
+
+# How long a tarpit target waits between bytes: well inside any read timeout
+TARPIT_BYTE_INTERVAL_SECONDS = 0.1
+# Each target's number picks how it advertises itself
+TARGET_KINDS = ('webmention-header', 'webmention-link', 'webmention-a', 'pingback-header', 'pingback-link', 'none')
+
+
+class WebParams(NamedTuple):
+    articles: int = 50
+    links_per_article: int = 10
+    # Distinct target pages; articles share them, like real blogs linking to the same places
+    targets: int = 200
+    target_hosts: int = 4
+    feed_format: str = 'rss'
+    latency_ms: float = 0.0
+    # Filler added to every HTML page, so that parsing costs something
+    body_kib: int = 8
+    compress: bool = False
+    # Articles link to each target through this many permanent redirects, like an http->https upgrade
+    # followed by a shortener
+    redirect_hops: int = 0
+    tarpit_targets: int = 0
+
+
+class WebStats(NamedTuple):
+    requests_served: int
+    # Response bodies as sent, i.e. after compression
+    bytes_served: int
+
+
+def _filler(kib: int) -> str:
+    paragraph = '<p>' + 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 16 + '</p>\n'
+    return paragraph * max(0, (kib * 1024) // len(paragraph))
+
+
+class _Counter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def increment(self, by: int = 1) -> None:
+        with self._lock:
+            self.value += by
+
+
+def _accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """Our favourite of the encodings the client will take (ignoring q-values, which nobody sends)"""
+    accepted = {coding.split(';')[0].strip().lower() for coding in accept_encoding.split(',')}
+    return next((coding for coding in ENCODERS if coding in accepted), None)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Set on the per-server subclass
+    web: 'SyntheticWeb'
+    target_host_index: Optional[int] = None
+
+    protocol_version = 'HTTP/1.1'
+    # Otherwise the headers and body go out in separate segments and delayed ACKs add 40ms to everything
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.web.counter.increment()
+        if self.web.params.latency_ms:
+            time.sleep(self.web.params.latency_ms / 1000)
+        if self.target_host_index is None:
+            page = self.web.site_page(self.path)
+        elif self.web.is_tarpit(self.path):
+            self._trickle()
+            return
+        else:
+            page = self.web.target_page(self.path)
+        if page is None:
+            self._respond(404, 'text/plain', b'not found')
+            return
+        content_type, body, headers = page
+        status = 301 if 'Location' in headers else 200
+        encoded = body.encode('utf-8')
+        coding = _accepted_encoding(self.headers.get('Accept-Encoding', '')) if self.web.params.compress else None
+        if coding is not None:
+            encoded = ENCODERS[coding](encoded)
+            headers = {**headers, 'Content-Encoding': coding, 'Vary': 'Accept-Encoding'}
+        self._respond(status, content_type, encoded, headers)
+
+    def do_POST(self) -> None:
+        self.web.counter.increment()
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        self._respond(202, 'text/plain', b'accepted')
+
+    def _trickle(self) -> None:
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.end_headers()
+        try:
+            self.wfile.flush()
+            # Never gets as far as saying anything useful
+            for byte in ('<html><head>' + _filler(self.web.params.body_kib)).encode('utf-8'):
+                self.wfile.write(bytes([byte]))
+                self.wfile.flush()
+                self.web.bytes_counter.increment()
+                time.sleep(TARPIT_BYTE_INTERVAL_SECONDS)
+        except OSError:
+            # They gave up on us, which is the idea
+            pass
+
+    def _respond(self, status: int, content_type: str, body: bytes, headers: Optional[dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.web.bytes_counter.increment(len(body))
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    # Benchmarks open plenty of connections at once
+    request_queue_size = 128
+
+    def handle_error(self, request: object, client_address: object) -> None:
+        # Streamed discovery hangs up as soon as it's seen enough, which is fine
+        pass
+
+
+Page = tuple[str, str, dict[str, str]]
+
+
+class SyntheticWeb:
+    def __init__(self, params: WebParams = WebParams()) -> None:
+        self.params = params
+        self.counter = _Counter()
+        self.bytes_counter = _Counter()
+        self._filler = _filler(params.body_kib)
+        self._site = self._make_server(None)
+        self._target_servers = [self._make_server(i) for i in range(params.target_hosts)]
+        self._threads: list[threading.Thread] = []
+
+    def _make_server(self, target_host_index: Optional[int]) -> _Server:
+        handler = type('Handler', (_Handler,), {'web': self, 'target_host_index': target_host_index})
+        return _Server(('127.0.0.1', 0), handler)
+
+    @property
+    def site_url(self) -> str:
+        return f'http://127.0.0.1:{self._site.server_address[1]}/'
+
+    def target_url(self, target: int) -> str:
+        server = self._target_servers[target % len(self._target_servers)]
+        return f'http://127.0.0.1:{server.server_address[1]}/targets/{target}'
+
+    def linked_url(self, target: int) -> str:
+        """How articles link to `target`"""
+        if not self.params.redirect_hops:
+            return self.target_url(target)
+        server = self._target_servers[target % len(self._target_servers)]
+        return f'http://127.0.0.1:{server.server_address[1]}/go/{self.params.redirect_hops}/{target}'
+
+    def article_url(self, article: int) -> str:
+        return f'{self.site_url}posts/{article}'
+
+    def start(self) -> None:
+        for server in [self._site, *self._target_servers]:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        for server in [self._site, *self._target_servers]:
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self) -> 'SyntheticWeb':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def site_page(self, path: str) -> Optional[Page]:
+        if path == '/':
+            return self._homepage()
+        if path == '/feed.xml':
+            return self._feed()
+        if path.startswith('/posts/'):
+            try:
+                article = int(path.removeprefix('/posts/'))
+            except ValueError:
+                return None
+            if 0 <= article < self.params.articles:
+                return self._article(article)
+        return None
+
+    def _homepage(self) -> Page:
+        feed_type = 'application/rss+xml' if self.params.feed_format == 'rss' else 'application/atom+xml'
+        body = f"""<!DOCTYPE html>
+<html><head><title>Synthetic blog</title>
+<link rel="alternate" type="{feed_type}" href="/feed.xml">
+</head><body><h1>Synthetic blog</h1>{self._filler}</body></html>"""
+        return 'text/html; charset=utf-8', body, {}
+
+    def _feed(self) -> Page:
+        if self.params.feed_format == 'rss':
+            items = ''.join(
+                f'<item><title>Post {i}</title><link>{self.article_url(i)}</link>'
+                f'<pubDate>Mon, 01 Jan 2024 00:00:00 GMT</pubDate></item>'
+                for i in range(self.params.articles)
+            )
+            body = f"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Synthetic blog</title><link>{self.site_url}</link>
+<description>Benchmarks</description>{items}</channel></rss>"""
+            return 'application/rss+xml', body, {}
+
+        entries = ''.join(
+            f'<entry><title>Post {i}</title><link href="{self.article_url(i)}"/><id>{self.article_url(i)}</id>'
+            f'<updated>2024-01-01T00:00:00Z</updated></entry>'
+            for i in range(self.params.articles)
+        )
+        body = f"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>Synthetic blog</title><id>{self.site_url}</id>
+<updated>2024-01-01T00:00:00Z</updated>{entries}</feed>"""
+        return 'application/atom+xml', body, {}
+
+    def article_targets(self, article: int) -> list[int]:
+        first = article * self.params.links_per_article
+        return [(first + i) % self.params.targets for i in range(self.params.links_per_article)]
+
+    def _article(self, article: int) -> Page:
+        links = ''.join(
+            f'<p>See <a href="{escape(self.linked_url(target))}">this</a>.</p>'
+            for target in self.article_targets(article)
+        )
+        # Alternate between the two ways the scanner finds the article in the page
+        if article % 2:
+            content = f"""<div itemscope itemtype="https://schema.org/Article">
+<h1 itemprop="headline">Post {article}</h1>
+<div itemprop="articleBody">{links}{self._filler}</div></div>"""
+        else:
+            content = f'<article><h1>Post {article}</h1>{links}{self._filler}</article>'
+        body = f"""<!DOCTYPE html>
+<html><head><title>Post {article}</title></head>
+<body><nav><a href="/">Home</a></nav>{content}<footer><a href="https://example.com/">Elsewhere</a></footer>
+</body></html>"""
+        return 'text/html; charset=utf-8', body, {}
+
+    def is_tarpit(self, path: str) -> bool:
+        if not path.startswith('/targets/'):
+            return False
+        try:
+            return int(path.removeprefix('/targets/')) < self.params.tarpit_targets
+        except ValueError:
+            return False
+
+    def target_page(self, path: str) -> Optional[Page]:
+        if path.startswith('/go/'):
+            try:
+                hops, target = (int(part) for part in path.removeprefix('/go/').split('/'))
+            except ValueError:
+                return None
+            location = f'/go/{hops - 1}/{target}' if hops > 1 else f'/targets/{target}'
+            return 'text/plain', '', {'Location': location}
+        if not path.startswith('/targets/'):
+            return None
+        try:
+            target = int(path.removeprefix('/targets/'))
+        except ValueError:
+            return None
+        kind = TARGET_KINDS[target % len(TARGET_KINDS)]
+        headers: dict[str, str] = {}
+        head = ''
+        body = ''
+        if kind == 'webmention-header':
+            headers['Link'] = '</webmention>; rel="webmention"'
+        elif kind == 'webmention-link':
+            head = '<link rel="webmention" href="/webmention">'
+        elif kind == 'webmention-a':
+            body = '<a rel="webmention" href="/webmention">Webmentions</a>'
+        elif kind == 'pingback-header':
+            headers['X-Pingback'] = '/xmlrpc.php'
+        elif kind == 'pingback-link':
+            head = '<link rel="pingback" href="/xmlrpc.php">'
+        page = f"""<!DOCTYPE html>
+<html><head><title>Target {target}</title>{head}</head>
+<body><h1>Target {target}</h1>{self._filler}{body}</body></html>"""
+        return 'text/html; charset=utf-8', page, headers
+
+    def stats(self) -> WebStats:
+        return WebStats(requests_served=self.counter.value, bytes_served=self.bytes_counter.value)
+
+
+def _serve_in_child(params: WebParams, conn: multiprocessing.connection.Connection) -> None:
+    with SyntheticWeb(params) as web:
+        conn.send(web.site_url)
+        # Any other message means stop; reply with the stats first
+        while conn.recv() == 'stats':
+            conn.send(web.stats())
+        conn.send(web.stats())
+
+
+class SyntheticWebProcess:
+    """
+    Runs a SyntheticWeb in a child process, so that serving it doesn't count towards the
+    scanner's CPU time, memory or GIL contention.
+    """
+
+    def __init__(self, params: WebParams = WebParams()) -> None:
+        self.params = params
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.get_context('spawn').Process(
+            target=_serve_in_child, args=(params, child_conn), daemon=True,
+        )
+        self.site_url = ''
+
+    def __enter__(self) -> 'SyntheticWebProcess':
+        self._process.start()
+        self.site_url = self._conn.recv()
+        return self
+
+    def stats(self) -> WebStats:
+        """What's been served so far"""
+        self._conn.send('stats')
+        stats: WebStats = self._conn.recv()
+        return stats
+
+    def stop(self) -> WebStats:
+        self._conn.send('stop')
+        stats: WebStats = self._conn.recv()
+        self._process.join()
+        return stats
+
+    def __exit__(self, *exc_info: object) -> None:
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+
+
+def add_web_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = WebParams()
+    parser.add_argument('--articles', type=int, default=defaults.articles)
+    parser.add_argument('--links-per-article', type=int, default=defaults.links_per_article)
+    parser.add_argument('--targets', type=int, default=defaults.targets)
+    parser.add_argument('--target-hosts', type=int, default=defaults.target_hosts)
+    parser.add_argument('--feed-format', choices=['rss', 'atom'], default=defaults.feed_format)
+    parser.add_argument('--latency-ms', type=float, default=defaults.latency_ms)
+    parser.add_argument('--body-kib', type=int, default=defaults.body_kib)
+    parser.add_argument('--compress', action='store_true', help='Compress pages for clients that ask for it')
+    parser.add_argument(
+        '--redirect-hops', type=int, default=defaults.redirect_hops,
+        help='How many permanent redirects articles link to targets through',
+    )
+    parser.add_argument(
+        '--tarpit-targets', type=int, default=defaults.tarpit_targets,
+        help='How many of the targets trickle their pages out a byte at a time',
+    )
+
+
+def params_from_args(args: argparse.Namespace) -> WebParams:
+    return WebParams(
+        articles=args.articles,
+        links_per_article=args.links_per_article,
+        targets=args.targets,
+        target_hosts=args.target_hosts,
+        feed_format=args.feed_format,
+        latency_ms=args.latency_ms,
+        body_kib=args.body_kib,
+        compress=args.compress,
+        redirect_hops=args.redirect_hops,
+        tarpit_targets=args.tarpit_targets,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='Synthetic web', description='Serves a made-up site to scan')
+    add_web_arguments(parser)
+    args = parser.parse_args()
+    with SyntheticWeb(params_from_args(args)) as web:
+        print(web.site_url, flush=True)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+How long a crawl of a synthetic web (see `benchmarks.synthetic_web`) takes when some of the targets
+are tarpits that trickle their pages out a byte at a time: once with the default request deadline,
+and once with a tight one and per-article and per-scan budgets.
+
+    python -m benchmarks.tail_latency --articles 50 --tarpit-targets 2 --scan-budget 10
+"""
+import argparse
+import contextlib
+import io
+import time
+from typing import Optional
+
+from benchmarks.synthetic_web import SyntheticWebProcess, add_web_arguments, params_from_args
+from webmentions.scanner import main as scanner, request_utils
+from webmentions.scanner.crawler import DEFAULT_CONCURRENCY, TimedOut
+
+
+def crawl(
+    web: SyntheticWebProcess, concurrency: int, timeouts: request_utils.Timeouts,
+    article_budget_seconds: Optional[float], scan_budget_seconds: Optional[float],
+) -> tuple[float, int, int]:
+    """Returns how long the crawl took, how many candidates it found, and how many lookups timed out"""
+    request_utils.set_timeouts(timeouts)
+    timed_out: list[TimedOut] = []
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            candidates = sum(1 for _ in scanner.generate_webmention_candidates(
+                web.site_url, False, concurrency, article_budget_seconds=article_budget_seconds,
+                scan_budget_seconds=scan_budget_seconds, on_timeout=timed_out.append,
+            ))
+    finally:
+        request_utils.set_timeouts(request_utils.DEFAULT_TIMEOUTS)
+    return time.perf_counter() - started, candidates, len(timed_out)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='Tail latency benchmark', description=__doc__)
+    add_web_arguments(parser)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--request-deadline', type=float, default=2.0)
+    parser.add_argument('--article-budget', type=float, default=5.0)
+    parser.add_argument('--scan-budget', type=float, default=None)
+    args = parser.parse_args()
+    request_utils.configure_client(pool_maxsize=args.concurrency)
+
+    tight = request_utils.DEFAULT_TIMEOUTS._replace(deadline_seconds=args.request_deadline)
+    runs = [
+        ('default deadline', request_utils.DEFAULT_TIMEOUTS, None, None),
+        ('with budgets', tight, args.article_budget, args.scan_budget),
+    ]
+    with SyntheticWebProcess(params_from_args(args)) as web:
+        for name, timeouts, article_budget_seconds, scan_budget_seconds in runs:
+            elapsed, candidates, timed_out = crawl(
+                web, args.concurrency, timeouts, article_budget_seconds, scan_budget_seconds,
+            )
+            print(f'{name}: {elapsed:.2f}s, {candidates} candidates, {timed_out} lookups timed out', flush=True)
+        web.stop()
+
+
+if __name__ == '__main__':
+    main()
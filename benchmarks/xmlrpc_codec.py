@@ -0,0 +1,104 @@
+"""
+Compares the XML-RPC codec in `webmentions.scanner.xmlrpc` with the bs4/etree.Element code that
+the pingback sender used before it.
+
+    python -m benchmarks.xmlrpc_codec
+"""
+import timeit
+import tracemalloc
+from typing import Callable, Optional
+
+import bs4
+from lxml import etree
+
+from webmentions.scanner import xmlrpc
+
+SOURCE = 'https://my.home.page/have-you-heard-about-potatos'
+TARGET = 'https://yolo.potato/blog-post?with=a&query=string'
+
+FAULT_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<methodResponse>
+  <fault>
+    <value>
+      <struct>
+        <member>
+          <name>faultCode</name>
+          <value><int>48</int></value>
+        </member>
+        <member>
+          <name>faultString</name>
+          <value><string>The pingback has already been registered.</string></value>
+        </member>
+      </struct>
+    </value>
+  </fault>
+</methodResponse>
+"""
+
+SUCCESS_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<methodResponse>
+  <params>
+    <param>
+      <value><string>Pingback registered. Keep the web talking! :-)</string></value>
+    </param>
+  </params>
+</methodResponse>
+"""
+
+
+def legacy_encode(source: str, target: str) -> str:
+    method_call = etree.Element('methodCall')
+    method_name = etree.Element('methodName')
+    method_name.text = 'pingback.ping'
+    method_call.append(method_name)
+    params = etree.Element('params')
+    method_call.append(params)
+    for uri in (source, target):
+        param = etree.Element('param')
+        value = etree.Element('value')
+        string = etree.Element('string')
+        string.text = uri
+        value.append(string)
+        param.append(value)
+        params.append(param)
+    return etree.tostring(
+        etree.ElementTree(method_call), pretty_print=True, xml_declaration=True, encoding='utf-8'
+    ).decode('utf-8')
+
+
+def legacy_decode(body: bytes) -> tuple[Optional[str], Optional[str]]:
+    """Returns (fault string, result) the way the bs4 code found them"""
+    parsed = bs4.BeautifulSoup(body.decode('utf-8'), features='lxml-xml')
+    fault_struct = parsed.select('methodResponse>fault>value>struct')
+    if fault_struct:
+        members = fault_struct[0].find_all('member')
+        for member in members:
+            name = member.find('name')
+            if name and name.text == 'faultString':
+                return member.find('value').find('string').text, None
+    parsed = bs4.BeautifulSoup(body.decode('utf-8'), features='lxml-xml')
+    result = parsed.select('methodResponse>params>param:first-child>value>string')
+    return None, result[0].text if result else None
+
+
+def measure(name: str, fn: Callable[[], object], number: int) -> None:
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<28} {seconds * 1e6:>9.1f} µs/op {peak / 1024:>9.1f} KiB peak')
+
+
+def main() -> None:
+    assert legacy_encode(SOURCE, TARGET) == xmlrpc.encode_pingback_request(SOURCE, TARGET)
+
+    measure('encode (etree.Element)', lambda: legacy_encode(SOURCE, TARGET), 5_000)
+    measure('encode (xmlrpc)', lambda: xmlrpc.encode_pingback_request(SOURCE, TARGET), 5_000)
+    for label, body in (('fault', FAULT_RESPONSE), ('success', SUCCESS_RESPONSE)):
+        measure(f'decode {label} (bs4)', lambda: legacy_decode(body), 500)
+        measure(f'decode {label} (xmlrpc)', lambda: xmlrpc.decode_response(body), 5_000)
+
+
+if __name__ == '__main__':
+    main()
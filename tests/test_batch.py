@@ -0,0 +1,87 @@
+import argparse
+import io
+import json
+
+import requests_mock
+
+from webmentions.scanner import batch
+from webmentions.scanner import main as scanner
+
+
+def _args(*argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--single-page', action='store_true')
+    scanner.add_scan_arguments(parser)
+    return parser.parse_args(['--no-cache', *argv])
+
+
+def test_batch_writes_jsonl_and_survives_failures():
+    out = io.StringIO()
+    args = _args('--single-page')
+    with requests_mock.Mocker() as m, scanner.open_stores(args) as stores:
+        m.get('https://good.blog/post', text='<article><a href="https://target.example/">t</a></article>')
+        m.get('https://bad.blog/post', status_code=500)
+        m.get('https://target.example/', headers={'Link': '<https://target.example/wm>; rel="webmention"'})
+        sites = batch.read_site_urls(['https://good.blog/post\n', '\n', '# comment\n', 'https://bad.blog/post\n'])
+        failures = batch.run_batch(sites, args, stores, batch.JsonlWriter(out))
+
+    assert failures == 1
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    candidates = [r for r in records if r['type'] == 'candidate']
+    assert candidates == [{
+        'type': 'candidate',
+        'site': 'https://good.blog/post',
+        'source': 'https://good.blog/post',
+        'target': 'https://target.example/',
+        'webmention_url': 'https://target.example/wm',
+        'pingback_url': None,
+    }]
+    assert {r['site']: r['ok'] for r in records if r['type'] == 'site'} == {
+        'https://good.blog/post': True,
+        'https://bad.blog/post': False,
+    }
+    assert [r['site'] for r in records if r['type'] == 'error'] == ['https://bad.blog/post']
+    assert records[-1]['type'] == 'batch'
+    assert records[-1]['sites'] == 2
+
+
+HOMEPAGE = '<html><head><link rel="alternate" type="application/rss+xml" href="/index.xml"></head></html>'
+
+
+def _feed(site):
+    return f"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>blog</title>
+  <item><title>one</title><link>https://{site}/one</link></item>
+</channel></rss>
+"""
+
+
+def _etagged(body, etag):
+    def respond(request, context):
+        if request.headers.get('If-None-Match') == etag:
+            context.status_code = 304
+            return ''
+        context.headers['ETag'] = etag
+        return body
+    return respond
+
+
+def test_a_failed_site_is_scanned_again(tmp_path):
+    args = _args('--incremental', '--state-path', str(tmp_path / 'state.sqlite3'), '--workers', '1')
+    with scanner.open_stores(args) as stores:
+        for b_article_status in (500, 200):
+            with requests_mock.Mocker() as m:
+                for site in ('a.blog', 'b.blog'):
+                    m.get(f'https://{site}/', text=_etagged(HOMEPAGE, f'"{site}"'))
+                    m.get(f'https://{site}/index.xml', text=_etagged(_feed(site), f'"{site} feed"'))
+                m.get('https://a.blog/one', text='<article></article>')
+                m.get('https://b.blog/one', text='<article></article>', status_code=b_article_status)
+                # b.blog fails first, and a.blog finishing afterwards mustn't save b.blog's validators
+                sites = ['https://b.blog/', 'https://a.blog/']
+                failures = batch.run_batch(sites, args, stores, batch.JsonlWriter(io.StringIO()))
+                fetched = [r.url for r in m.request_history]
+
+    assert failures == 0
+    assert 'https://b.blog/one' in fetched
+    assert 'https://a.blog/one' not in fetched
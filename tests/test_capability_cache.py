@@ -0,0 +1,99 @@
+import socket
+
+import pytest
+import requests
+import requests_mock
+
+from webmentions.scanner import request_utils
+from webmentions.scanner.capability_cache import CapabilityCache
+from webmentions.scanner.mention_detector import (
+    CapabilityCheckFailed, MentionCapabilities, NO_CAPABILITIES, stream_page_check_mention_capabilities,
+)
+
+
+def test_caches_results():
+    cache = CapabilityCache(':memory:')
+    fetched = []
+
+    def resolve(url):
+        fetched.append(url)
+        return MentionCapabilities(webmention_url='https://wm.example/endpoint', pingback_url=None)
+
+    cached_resolve = cache.wrap(resolve)
+    for _ in range(2):
+        assert cached_resolve('https://blog.example/a').webmention_url == 'https://wm.example/endpoint'
+    assert fetched == ['https://blog.example/a']
+    assert cache.stats().hits == 1
+    assert cache.stats().misses == 1
+
+
+def test_skips_hosts_without_capabilities():
+    cache = CapabilityCache(':memory:', host_miss_threshold=2)
+    fetched = []
+
+    def resolve(url):
+        fetched.append(url)
+        return NO_CAPABILITIES
+
+    cached_resolve = cache.wrap(resolve)
+    for page in ('a', 'b', 'c', 'd'):
+        assert cached_resolve(f'https://wiki.example/{page}') == NO_CAPABILITIES
+
+    assert fetched == ['https://wiki.example/a', 'https://wiki.example/b']
+    assert cache.stats().host_hits == 2
+
+
+def test_expired_entries_are_refetched():
+    cache = CapabilityCache(':memory:', ttl_seconds=-1)
+    cache.put('https://blog.example/a', MentionCapabilities(None, 'https://blog.example/xmlrpc'))
+    assert cache.get('https://blog.example/a') is None
+
+
+def test_purge():
+    cache = CapabilityCache(':memory:')
+    cache.put('https://blog.example/a', MentionCapabilities(None, 'https://blog.example/xmlrpc'))
+    cache.purge()
+    assert cache.get('https://blog.example/a') is None
+
+
+def test_failed_checks_are_not_cached():
+    cache = CapabilityCache(':memory:', host_miss_threshold=2)
+    cached_resolve = cache.wrap(stream_page_check_mention_capabilities)
+    with requests_mock.Mocker() as m:
+        m.get('https://blog.example/down', status_code=503)
+        m.get('https://blog.example/slow', exc=requests.ConnectTimeout)
+        m.get('https://blog.example/gone', status_code=404)
+        m.get('https://blog.example/post', headers={'Link': '</wm>; rel="webmention"'})
+        for page in ('down', 'slow'):
+            with pytest.raises(CapabilityCheckFailed):
+                cached_resolve(f'https://blog.example/{page}')
+        assert cached_resolve('https://blog.example/gone') == NO_CAPABILITIES
+        assert cached_resolve('https://blog.example/post').webmention_url == 'https://blog.example/wm'
+
+        m.get('https://blog.example/down', headers={'Link': '</wm>; rel="webmention"'})
+        assert cached_resolve('https://blog.example/down').webmention_url == 'https://blog.example/wm'
+    assert cache.stats().host_hits == 0
+
+
+def test_hosts_that_dont_resolve_are_not_cached_as_local(monkeypatch):
+    def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        if host == 'local.example':
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+        raise socket.gaierror(socket.EAI_AGAIN, 'Temporary failure in name resolution')
+
+    monkeypatch.setattr(socket, 'getaddrinfo', socket.getaddrinfo)
+    monkeypatch.setattr(request_utils, '_resolver', None)
+    monkeypatch.setattr(request_utils, '_system_getaddrinfo', getaddrinfo)
+    request_utils.extra_spooky_monkey_patch_to_block_local_traffic()
+
+    cache = CapabilityCache(':memory:')
+    cached_resolve = cache.wrap(stream_page_check_mention_capabilities)
+    with requests_mock.Mocker() as m:
+        m.get('https://local.example/', exc=requests.ConnectionError)
+        m.get('https://dns-outage.example/', exc=requests.ConnectionError)
+        # The guard won't ever let us there
+        assert cached_resolve('https://local.example/') == NO_CAPABILITIES
+        # But there's no knowing where this one goes until its DNS comes back
+        with pytest.raises(CapabilityCheckFailed):
+            cached_resolve('https://dns-outage.example/')
+    assert cache.get('https://dns-outage.example/') is None
@@ -0,0 +1,83 @@
+import concurrent.futures
+import threading
+
+from webmentions import util
+from webmentions.scanner.coalesce import SingleFlight
+from webmentions.scanner.urls import ExactSeenSet
+
+
+def test_concurrent_calls_share_one_fetch():
+    release = threading.Event()
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        release.wait(timeout=5)
+        return url.upper()
+
+    single_flight: SingleFlight[str] = SingleFlight()
+    lookup = single_flight.wrap(fetch)
+    urls = ['https://Blog.example/a', 'https://blog.example:443/a#comments', 'https://blog.example/a']
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(lookup, url) for url in urls]
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert len(fetched) == 1
+    assert len(set(results)) == 1
+    assert single_flight.saved == 2
+    assert single_flight.calls == 3
+
+
+def test_failures_are_not_memoized():
+    attempts = []
+
+    def fetch(url):
+        attempts.append(url)
+        if len(attempts) == 1:
+            raise IOError('nope')
+        return 'ok'
+
+    lookup = SingleFlight[str]().wrap(fetch)
+    try:
+        lookup('https://blog.example/')
+        assert False, 'expected exception'
+    except IOError:
+        pass
+    assert lookup('https://blog.example/') == 'ok'
+    assert lookup('https://blog.example') == 'ok'
+    assert len(attempts) == 2
+
+
+def test_normalize_url():
+    assert util.normalize_url('HTTPS://Example.COM:443') == 'https://example.com/'
+    assert util.normalize_url('http://example.com:8080/a?b=c#d') == 'http://example.com:8080/a?b=c'
+    assert util.normalize_url('https://example.com/a/./b/../c/') == 'https://example.com/a/c/'
+    assert util.normalize_url('https://example.com/a/..') == 'https://example.com/'
+    assert (
+        util.normalize_url('https://example.com/%7euser/a%2fb?q=%e2%9c%93')
+        == 'https://example.com/~user/a%2Fb?q=%E2%9C%93'
+    )
+    # Typos in other people's pages
+    assert util.normalize_url('HTTP://Typo.example:8o80/a/../b') == 'http://typo.example:8o80/b'
+    assert util.normalize_url('http://x:99999/') == 'http://x:99999/'
+    assert util.normalize_url('http://[::1/') == 'http://[::1/'
+
+
+def test_empty_results_only_go_in_the_seen_set():
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return 'endpoint' if url.endswith('/capable') else ''
+
+    seen = ExactSeenSet()
+    single_flight: SingleFlight[str] = SingleFlight(empty='', seen=seen)
+    lookup = single_flight.wrap(fetch)
+    for _ in range(2):
+        assert lookup('https://blog.example/capable') == 'endpoint'
+        assert lookup('https://blog.example/nothing') == ''
+
+    assert len(fetched) == 2
+    assert 'https://blog.example/nothing' in seen
+    assert 'https://blog.example/capable' not in seen
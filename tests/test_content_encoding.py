@@ -0,0 +1,51 @@
+import gzip
+import os
+import zlib
+
+import pytest
+import requests
+
+from benchmarks.synthetic_web import ENCODERS
+from webmentions.scanner import content_encoding
+
+BODY = os.urandom(64 * 1024) * 4 + b'\0' * (1024 * 1024)
+
+
+def _deflate_raw(data):
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+CODINGS = {
+    **ENCODERS,
+    'deflate': zlib.compress,
+    # Not what the spec says, but what plenty of servers send anyway
+    'deflate-raw': _deflate_raw,
+}
+
+
+def _chunked(data, size=10_000):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+@pytest.mark.parametrize('coding', CODINGS)
+def test_decodes_a_bounded_chunk_at_a_time(coding):
+    content_encoding_header = coding.removesuffix('-raw')
+    if content_encoding_header not in content_encoding.ACCEPT_ENCODING:
+        pytest.skip(f"{coding} isn't installed")
+    chunks = list(content_encoding.decoded(_chunked(CODINGS[coding](BODY)), content_encoding_header, 4096))
+    assert b''.join(chunks) == BODY
+    # brotli only stops growing its output buffer once it's past the limit
+    assert max(len(chunk) for chunk in chunks) <= (64 * 1024 if coding == 'br' else 4096)
+
+
+def test_decodes_stacked_encodings_last_one_first():
+    body = zlib.compress(gzip.compress(BODY))
+    assert b''.join(content_encoding.decoded(_chunked(body), 'gzip, deflate', 4096)) == BODY
+
+
+def test_passes_through_what_it_cant_decode():
+    assert list(content_encoding.decoded([b'abc'], 'identity', 10)) == [b'abc']
+    assert list(content_encoding.decoded([b'abc'], 'compress', 10)) == [b'abc']
+    with pytest.raises(requests.exceptions.ContentDecodingError):
+        list(content_encoding.decoded([b'not gzip'], 'gzip', 10))
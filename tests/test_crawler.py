@@ -0,0 +1,150 @@
+import threading
+import time
+
+import requests_mock
+
+from webmentions.scanner import main
+from webmentions.scanner.crawler import Crawler, TimedOut
+from webmentions.scanner.feed import RssItem
+from webmentions.scanner.ledger import SentMentionLedger
+from webmentions.scanner.mention_detector import CapabilityCheckFailed, MentionCapabilities
+from webmentions.scanner.site_state import SiteStateStore
+
+ARTICLE = """
+<html><body>
+  <article>
+    <a href="https://a.example/post">a</a>
+    <a href="https://b.example/post">b</a>
+    <a href="https://c.example/post">c</a>
+    <a href="/internal">internal</a>
+  </article>
+</body></html>
+"""
+
+
+def test_crawl_single_page_concurrently():
+    with requests_mock.Mocker() as m:
+        m.get('https://my.blog/post', text=ARTICLE)
+        m.get('https://a.example/post', text='<link rel="webmention" href="/wm">')
+        m.get('https://b.example/post', text='nothing to see here')
+        m.get('https://c.example/post', text='<link rel="pingback" href="https://c.example/xmlrpc">')
+
+        candidates = list(main.generate_webmention_candidates('https://my.blog/post', single_page=True, concurrency=4))
+
+    assert sorted(c.mentioned_url for c in candidates) == ['https://a.example/post', 'https://c.example/post']
+    by_target = {c.mentioned_url: c.capabilities for c in candidates}
+    assert by_target['https://a.example/post'] == MentionCapabilities('https://a.example/wm', None)
+    assert by_target['https://c.example/post'] == MentionCapabilities(None, 'https://c.example/xmlrpc')
+    assert all(c.mentioner_url == 'https://my.blog/post' for c in candidates)
+
+
+def test_crawl_propagates_errors():
+    with requests_mock.Mocker() as m:
+        m.get('https://my.blog/post', status_code=500)
+        try:
+            list(main.generate_webmention_candidates('https://my.blog/post', single_page=True, concurrency=2))
+            assert False, 'expected exception'
+        except AssertionError as err:
+            assert str(err) != 'expected exception'
+
+
+def test_article_budget_leaves_slow_lookups_for_next_time():
+    state = SiteStateStore(':memory:')
+    ledger = SentMentionLedger(':memory:')
+    article = RssItem(title='post', absolute_url='https://my.blog/post')
+    links = ['https://fast.example/', 'https://slow.example/', 'https://slow.example/#again']
+    gave_up = threading.Event()
+    timed_out: list[TimedOut] = []
+
+    def resolve(link):
+        if 'slow' in link:
+            gave_up.wait(5)
+        return MentionCapabilities(f'{link}wm', None)
+
+    def on_timeout(lookup):
+        timed_out.append(lookup)
+        gave_up.set()
+
+    crawler = Crawler(
+        find_links=lambda _: links, resolve_capabilities=resolve, concurrency=4, state=state, ledger=ledger,
+        list_articles=lambda url, _: iter([article]), article_budget_seconds=0.3, on_timeout=on_timeout,
+    )
+    candidates = list(crawler.iter_webmention_candidates('https://my.blog/', single_page=False))
+
+    assert [c.mentioned_url for c in candidates] == ['https://fast.example/']
+    assert timed_out == [TimedOut('https://my.blog/post', 'https://slow.example/')]
+    # Only what we didn't get to is left to do
+    assert not state.is_processed('https://my.blog/', article)
+    assert ledger.diff_links(article.absolute_url, links).added == ['https://slow.example/']
+
+
+def test_links_that_couldnt_be_checked_are_left_for_next_time():
+    state = SiteStateStore(':memory:')
+    ledger = SentMentionLedger(':memory:')
+    article = RssItem(title='post', absolute_url='https://my.blog/post')
+    links = ['https://up.example/', 'https://down.example/']
+
+    def resolve(link):
+        if 'down' in link:
+            raise CapabilityCheckFailed(link, 'HTTP 503')
+        return MentionCapabilities(f'{link}wm', None)
+
+    crawler = Crawler(
+        find_links=lambda _: links, resolve_capabilities=resolve, state=state, ledger=ledger,
+        list_articles=lambda url, _: iter([article]),
+    )
+    candidates = list(crawler.iter_webmention_candidates('https://my.blog/', single_page=False))
+
+    assert [c.mentioned_url for c in candidates] == ['https://up.example/']
+    assert not state.is_processed('https://my.blog/', article)
+    assert ledger.diff_links(article.absolute_url, links).added == ['https://down.example/']
+
+
+def test_scan_budget_stops_starting_articles():
+    state = SiteStateStore(':memory:')
+    articles = [RssItem(title=str(i), absolute_url=f'https://my.blog/{i}') for i in range(20)]
+
+    def find_links(_):
+        time.sleep(0.1)
+        return []
+
+    def crawl(scan_budget_seconds):
+        crawler = Crawler(
+            find_links=find_links, concurrency=1, state=state, list_articles=lambda url, _: iter(articles),
+            scan_budget_seconds=scan_budget_seconds,
+        )
+        return list(crawler.iter_webmention_candidates('https://my.blog/', single_page=False))
+
+    crawl(scan_budget_seconds=0.5)
+    assert 0 < state.processed_count('https://my.blog/') < len(articles)
+    crawl(scan_budget_seconds=None)
+    assert state.processed_count('https://my.blog/') == len(articles)
+
+
+def test_article_budget_starts_once_the_article_does():
+    articles = [RssItem(title=str(i), absolute_url=f'https://my.blog/{i}') for i in range(10)]
+    timed_out: list[TimedOut] = []
+
+    def find_links(_):
+        time.sleep(0.1)
+        return []
+
+    crawler = Crawler(
+        find_links=find_links, concurrency=1, list_articles=lambda url, _: iter(articles),
+        article_budget_seconds=0.5, on_timeout=timed_out.append,
+    )
+    list(crawler.iter_webmention_candidates('https://my.blog/', single_page=False))
+    # Waiting for the others doesn't count against an article's budget
+    assert timed_out == []
+
+
+def test_malformed_links_dont_abort_the_crawl():
+    with requests_mock.Mocker() as m:
+        m.get('https://my.blog/post', text='<article><a href="http://x:99999/">x</a><a href="http://y:8o80/">y</a>'
+                                           '<a href="http://[::1/">z</a><a href="https://a.example/post">a</a></article>')
+        m.get('https://a.example/post', text='<link rel="webmention" href="/wm">')
+        resolve_capabilities, _ = main.build_capability_resolver(cache=None)
+        candidates = list(main.generate_webmention_candidates(
+            'https://my.blog/post', single_page=True, concurrency=2, resolve_capabilities=resolve_capabilities,
+        ))
+    assert [c.mentioned_url for c in candidates] == ['https://a.example/post']
@@ -0,0 +1,81 @@
+import io
+
+import feedparser  # type: ignore
+import requests_mock
+
+from webmentions.scanner import feed
+from webmentions.scanner.feed import Feed, RssItem
+
+RSS = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom"><channel>
+  <title>blog</title>
+  <item><title>One</title><link>https://my.blog/one</link><pubDate>Mon, 01 Jan 2024 00:00:00 GMT</pubDate></item>
+  <item><guid>https://my.blog/two</guid><description>No title or link</description></item>
+  <item><guid isPermaLink="false">tag:my.blog,2024:3</guid><title>No link</title></item>
+  <item><title>Relative</title><link>/four</link></item>
+</channel></rss>
+"""
+
+ATOM_PAGE_1 = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>blog</title>
+  <link rel="next" href="/feed?page=2"/>
+  <entry>
+    <title type="html">One &amp;amp; only</title>
+    <link rel="edit" href="https://my.blog/edit/1"/>
+    <link href="https://my.blog/one"/>
+    <updated>2024-01-01T00:00:00Z</updated>
+  </entry>
+</feed>
+"""
+
+ATOM_PAGE_2 = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>blog</title>
+  <link rel="next" href="https://my.blog/feed"/>
+  <entry><title>Two</title><link rel="alternate" href="https://my.blog/two"/></entry>
+</feed>
+"""
+
+
+def test_rss_items():
+    items = list(feed.link_generator_from_feed(Feed('https://my.blog/feed', RSS)))
+    assert items == [
+        RssItem(title='One', absolute_url='https://my.blog/one', updated='Mon, 01 Jan 2024 00:00:00 GMT'),
+        RssItem(title='https://my.blog/two', absolute_url='https://my.blog/two'),
+        RssItem(title='Relative', absolute_url='https://my.blog/four'),
+    ]
+
+
+def test_agrees_with_feedparser_on_well_formed_feeds():
+    items = list(feed.link_generator_from_feed(Feed('https://my.blog/feed', RSS)))
+    from_feedparser = list(feed._items_from_feedparser('https://my.blog/feed', feedparser.parse(io.BytesIO(RSS))))
+    assert items == from_feedparser
+
+
+def test_items_come_out_before_the_rest_is_parsed():
+    # The second item is broken, so if the first one comes out, it came out before lxml got there
+    body = RSS.replace(b'<guid>https://my.blog/two</guid>', b'<guid>https://my.blog/two</guid><broken & >')
+    items = feed.link_generator_from_feed(Feed('https://my.blog/feed', body))
+    assert next(items).absolute_url == 'https://my.blog/one'
+    # feedparser takes over from there, without repeating the first item
+    assert [item.absolute_url for item in items] == ['https://my.blog/two', 'https://my.blog/four']
+
+
+def test_follows_next_pages_once():
+    with requests_mock.Mocker() as m:
+        m.get('https://my.blog/feed', content=ATOM_PAGE_1)
+        # Registered last so that it wins: requests_mock ignores the query string otherwise
+        m.get('https://my.blog/feed?page=2', content=ATOM_PAGE_2)
+        items = list(feed.link_generator_from_feed(Feed('https://my.blog/feed', ATOM_PAGE_1)))
+
+    assert items == [
+        RssItem(title='One &amp; only', absolute_url='https://my.blog/one', updated='2024-01-01T00:00:00Z'),
+        RssItem(title='Two', absolute_url='https://my.blog/two'),
+    ]
+    # Page 2 points back at page 1, which we've already seen
+    assert [r.url for r in m.request_history] == ['https://my.blog/feed?page=2']
+
+
+def test_unchanged_feed_has_no_items():
+    assert list(feed.link_generator_from_feed(feed._empty_feed('https://my.blog/feed'))) == []
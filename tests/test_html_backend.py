@@ -0,0 +1,33 @@
+import pathlib
+
+import pytest
+
+from webmentions.scanner import html_backend
+
+FIXTURES = sorted((pathlib.Path(__file__).parent / 'fixtures' / 'html').glob('*.html'))
+
+QUERIES = [
+    ('webmention', ('link', 'a'), None),
+    ('pingback', ('link',), None),
+    ('alternate', ('link',), 'application/rss+xml'),
+    ('alternate', ('link',), 'application/atom+xml'),
+]
+
+
+@pytest.mark.parametrize('fixture', FIXTURES, ids=lambda p: p.name)
+def test_backends_agree(fixture):
+    text = fixture.read_text()
+    lxml_document = html_backend.parse(text, 'lxml')
+    bs4_document = html_backend.parse(text, 'bs4')
+
+    assert lxml_document.article_hrefs() == bs4_document.article_hrefs()
+    assert lxml_document.link_hrefs() == bs4_document.link_hrefs()
+    for rel, tags, type in QUERIES:
+        assert lxml_document.rel_hrefs(rel, tags, type) == bs4_document.rel_hrefs(rel, tags, type)
+
+
+def test_schema_org_article_body_wins():
+    text = (pathlib.Path(__file__).parent / 'fixtures' / 'html' / 'schema_org_article.html').read_text()
+    document = html_backend.parse(text, 'lxml')
+    assert document.article_hrefs() == ['https://one.example/', 'https://two.example/']
+    assert document.rel_hrefs('webmention', ['link', 'a']) == ['/endpoint']
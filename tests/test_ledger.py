@@ -0,0 +1,38 @@
+import requests_mock
+
+from webmentions.scanner import main
+from webmentions.scanner.ledger import SentMentionLedger, STATUS_SENT
+
+SOURCE = 'https://my.blog/post'
+
+
+def _article(*targets):
+    return '<article>' + ''.join(f'<a href="{t}">link</a>' for t in targets) + '</article>'
+
+
+def _scan(article, ledger):
+    with requests_mock.Mocker() as m:
+        m.get(SOURCE, text=article)
+        for target in ('a', 'b', 'c'):
+            m.get(f'https://{target}.example/', text=f'<link rel="webmention" href="https://{target}.example/wm">')
+            m.post(f'https://{target}.example/wm', status_code=202)
+        main.scan(SOURCE, notify=True, single_page=True, concurrency=2, ledger=ledger)
+        return sorted(r.url for r in m.request_history if r.method == 'POST')
+
+
+def test_only_changed_targets_are_notified():
+    ledger = SentMentionLedger(':memory:')
+
+    assert _scan(_article('https://a.example/', 'https://b.example/'), ledger) == [
+        'https://a.example/wm', 'https://b.example/wm',
+    ]
+    # Same link set: nothing to do
+    assert _scan(_article('https://b.example/', 'https://a.example/#top'), ledger) == []
+    # b removed, c added
+    assert _scan(_article('https://a.example/', 'https://c.example/'), ledger) == [
+        'https://b.example/wm', 'https://c.example/wm',
+    ]
+
+    sends = ledger.sends(SOURCE, 'https://b.example/')
+    assert [s.status for s in sends] == [STATUS_SENT, STATUS_SENT]
+    assert sends[0].endpoint == 'https://b.example/wm'
@@ -0,0 +1,56 @@
+import requests_mock
+
+from webmentions.scanner import mention_detector
+from webmentions.scanner.mention_detector import MentionCapabilities, NO_CAPABILITIES
+
+TARGET = 'https://target.example/posts/1'
+
+
+def _both_ways(**kwargs):
+    with requests_mock.Mocker() as m:
+        m.get(TARGET, **kwargs)
+        full = mention_detector.fetch_page_check_mention_capabilities(TARGET)
+        streamed = mention_detector.stream_page_check_mention_capabilities(TARGET)
+    return full, streamed
+
+
+def test_header_endpoints():
+    full, streamed = _both_ways(
+        text='<html></html>',
+        headers={'Link': '</webmention>; rel="webmention"', 'X-Pingback': 'https://target.example/xmlrpc.php'},
+    )
+    assert full == streamed == MentionCapabilities('https://target.example/webmention', 'https://target.example/xmlrpc.php')
+
+
+def test_head_link_endpoints():
+    full, streamed = _both_ways(
+        text="""<html><head>
+        <link rel="pingback" href="https://target.example/xmlrpc.php">
+        <link rel="me webmention" href="../webmention">
+        </head><body><a rel="webmention" href="/nope">nope</a></body></html>""",
+        headers={'Content-Type': 'text/html; charset=utf-8'},
+    )
+    assert full == streamed == MentionCapabilities('https://target.example/webmention', 'https://target.example/xmlrpc.php')
+
+
+def test_body_anchor_endpoint():
+    full, streamed = _both_ways(
+        text='<html><head><title>hi</title></head><body><p>hello</p><a rel="webmention" href="">me</a></body></html>',
+    )
+    assert full == streamed == MentionCapabilities(TARGET, None)
+
+
+def test_non_html_is_not_read():
+    _, streamed = _both_ways(
+        content=b'<link rel="webmention" href="/webmention">',
+        headers={'Content-Type': 'application/pdf'},
+    )
+    assert streamed == NO_CAPABILITIES
+
+
+def test_gives_up_after_byte_cap():
+    body = '<html><head></head><body>' + '<p>padding</p>' * 10_000 + '<a rel="webmention" href="/wm">x</a></body></html>'
+    with requests_mock.Mocker() as m:
+        m.get(TARGET, text=body)
+        assert mention_detector.stream_page_check_mention_capabilities(TARGET, byte_cap=1024) == NO_CAPABILITIES
+        assert mention_detector.stream_page_check_mention_capabilities(TARGET).webmention_url == 'https://target.example/wm'
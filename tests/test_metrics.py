@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from benchmarks.synthetic_web import SyntheticWeb, WebParams
+from webmentions.scanner import main, metrics
+
+
+@pytest.fixture
+def collected():
+    yield metrics.enable()
+    metrics.disable()
+
+
+def test_disabled_stages_are_shared_no_ops():
+    metrics.disable()
+    with metrics.stage(metrics.ARTICLE_FETCH, 'https://example.com/') as record:
+        record.status = 200
+        record.bytes += 10
+    assert record.status is None
+    assert record.bytes == 0
+    assert metrics.stage(metrics.FEED_FETCH) is metrics.stage(metrics.FEED_PARSE)
+    assert metrics.current() is None
+
+
+def test_records_stages_hosts_and_errors(collected):
+    with metrics.stage(metrics.WEBMENTION_SEND, 'https://Receiver.example/webmention') as record:
+        record.status = 202
+        record.bytes = 8
+    with pytest.raises(IOError):
+        with metrics.stage(metrics.WEBMENTION_SEND, 'https://receiver.example/webmention'):
+            raise IOError('connection reset')
+
+    summary = collected.to_json()
+    send = summary['stages'][metrics.WEBMENTION_SEND]
+    assert (send['count'], send['errors'], send['bytes']) == (2, 1, 8)
+    assert send['status_codes'] == {'202': 1}
+    assert summary['hosts']['receiver.example'][metrics.WEBMENTION_SEND]['count'] == 2
+
+    text = collected.to_prometheus()
+    assert 'webmentions_stage_duration_seconds_bucket{stage="webmention_send",le="+Inf"} 2' in text
+    assert 'webmentions_stage_errors_total{stage="webmention_send"} 1' in text
+    assert 'webmentions_stage_responses_total{stage="webmention_send",code="202"} 1' in text
+    assert 'webmentions_host_duration_seconds_count{stage="webmention_send",host="receiver.example"} 2' in text
+
+
+def test_scan_records_every_stage(collected, tmp_path):
+    params = WebParams(articles=2, links_per_article=3, targets=6, target_hosts=1, body_kib=1)
+    with SyntheticWeb(params) as web:
+        list(main.generate_webmention_candidates(web.site_url, single_page=False))
+
+    collected.write_json(str(tmp_path / 'metrics.json'))
+    stages = json.loads((tmp_path / 'metrics.json').read_text())['stages']
+    assert stages[metrics.FEED_FETCH]['count'] == 2
+    assert stages[metrics.FEED_PARSE]['count'] == 1
+    assert stages[metrics.ARTICLE_FETCH]['count'] == 2
+    assert stages[metrics.ARTICLE_PARSE]['count'] == 2
+    assert stages[metrics.CAPABILITY_FETCH]['count'] == 6
+    assert stages[metrics.CAPABILITY_FETCH]['status_codes'] == {'200': 6}
+    assert all(stages[name]['bytes'] > 0 for name in (metrics.FEED_FETCH, metrics.ARTICLE_FETCH))
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+import requests
+import requests_mock
+
+from webmentions.receiver import store as received
+from webmentions.receiver.server import InvalidMention, Receiver, validate
+from webmentions.receiver.store import ReceivedMentionStore
+from webmentions.receiver.verifier import VERIFIED, Verdict, verify_mention
+
+HOSTS = frozenset({'blog.example'})
+
+
+def test_validate():
+    assert validate(
+        {'source': ['https://other.example/post'], 'target': ['https://blog.example/a']}, HOSTS,
+    ) == ('https://other.example/post', 'https://blog.example/a')
+
+    for fields, message in [
+        ({'target': ['https://blog.example/a']}, 'exactly one source'),
+        ({'source': ['a', 'b'], 'target': ['https://blog.example/a']}, 'exactly one source'),
+        ({'source': ['ftp://other.example/'], 'target': ['https://blog.example/a']}, 'http or https'),
+        ({'source': ['https://blog.example/a#x'], 'target': ['https://BLOG.example/a']}, 'the same'),
+        ({'source': ['https://other.example/'], 'target': ['https://elsewhere.example/a']}, 'elsewhere.example'),
+    ]:
+        with pytest.raises(InvalidMention, match=message):
+            validate(fields, HOSTS)
+
+
+def test_store_deduplicates_submissions():
+    store = ReceivedMentionStore(':memory:', reverify_after_seconds=3600)
+    assert store.submit('https://other.example/post', 'https://blog.example/a')
+    assert not store.submit('https://other.example/post', 'https://blog.example/a')
+    assert store.backlog() == 1
+
+    [mention] = store.claim(limit=10)
+    # Still being verified, so still not queued again
+    assert not store.submit('https://other.example/post', 'https://blog.example/a')
+    store.record(mention, received.STATUS_VERIFIED)
+    # Verified too recently to bother again
+    assert not store.submit('https://other.example/post', 'https://blog.example/a')
+    assert store.verified_sources('https://blog.example/a') == ['https://other.example/post']
+
+    eager = ReceivedMentionStore(':memory:', reverify_after_seconds=0)
+    eager.submit('https://other.example/post', 'https://blog.example/a')
+    [mention] = eager.claim(limit=10)
+    eager.record(mention, received.STATUS_REJECTED, 'nope')
+    assert eager.submit('https://other.example/post', 'https://blog.example/a')
+    stored = eager.get('https://other.example/post', 'https://blog.example/a')
+    assert stored is not None and stored.status == received.STATUS_PENDING and stored.last_error is None
+
+
+ARTICLE = """<html><body>
+<nav><a href="https://blog.example/sidebar">Friends</a></nav>
+<article><p>As <a href="/../a?">someone said</a>, it's fine.</p></article>
+</body></html>"""
+
+
+def test_verify_mention():
+    with requests_mock.Mocker() as m:
+        m.get('https://blog.example/post', text=ARTICLE, headers={'Content-Type': 'text/html'})
+        m.get('https://other.example/no-article', text='<p><a href="https://blog.example/a">a</a></p>')
+        m.get('https://other.example/plain', text='see https://blog.example/a', headers={'Content-Type': 'text/plain'})
+        m.get('https://other.example/gone', status_code=410)
+        m.get('https://other.example/down', status_code=503)
+        m.get('https://other.example/missing', status_code=404)
+        m.get('https://other.example/image', content=b'GIF89a', headers={'Content-Type': 'image/gif'})
+        m.get(
+            'https://other.example/typos',
+            text='<article><a href="http://[::1/">a</a> <a href="http://typo.example:8o80/">b</a> '
+                 '<a href="https://blog.example/a">c</a></article>',
+        )
+
+        assert verify_mention('https://blog.example/post', 'https://blog.example/a') == VERIFIED
+        # Linked, but not from the article
+        assert verify_mention('https://blog.example/post', 'https://blog.example/sidebar').status == (
+            received.STATUS_REJECTED
+        )
+        assert verify_mention('https://other.example/no-article', 'https://blog.example/a') == VERIFIED
+        assert verify_mention('https://other.example/plain', 'https://blog.example/a') == VERIFIED
+        assert verify_mention('https://other.example/typos', 'https://blog.example/a') == VERIFIED
+        assert verify_mention('https://other.example/gone', 'https://blog.example/a').status == received.STATUS_DELETED
+        down = verify_mention('https://other.example/down', 'https://blog.example/a')
+        assert down.status == received.STATUS_FAILED and down.retryable
+        missing = verify_mention('https://other.example/missing', 'https://blog.example/a')
+        assert missing.status == received.STATUS_REJECTED and not missing.retryable
+        assert verify_mention('https://other.example/image', 'https://blog.example/a').status == (
+            received.STATUS_REJECTED
+        )
+
+
+def test_receiver_accepts_then_verifies_in_the_background():
+    store = ReceivedMentionStore(':memory:')
+    release = threading.Event()
+    calls = []
+
+    def verify(source: str, target: str) -> Verdict:
+        release.wait(5)
+        calls.append((source, target))
+        return VERIFIED
+
+    with Receiver(store, ['blog.example'], workers=2, verify=verify) as receiver:
+        form = {'source': 'https://other.example/post', 'target': 'https://blog.example/a'}
+        for _ in range(3):
+            # Answered straight away, even though verification is stuck
+            assert requests.post(receiver.url, data=form, timeout=5).status_code == 202
+        bad = requests.post(receiver.url, data={**form, 'target': 'https://elsewhere.example/'}, timeout=5)
+        assert bad.status_code == 400
+        assert 'elsewhere.example' in bad.text
+        assert requests.post(receiver.url.replace('/webmention', '/nope'), data=form, timeout=5).status_code == 404
+        assert receiver.accepted == 3
+        assert receiver.queued == 1
+        assert store.backlog() == 1
+
+        release.set()
+        deadline = time.monotonic() + 5
+        while store.backlog() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert calls == [('https://other.example/post', 'https://blog.example/a')]
+    assert store.counts() == {received.STATUS_VERIFIED: 1}
+    assert receiver.workers.stats().verified == 1
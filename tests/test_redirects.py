@@ -0,0 +1,107 @@
+import socket
+import time
+
+import pytest
+import requests
+import requests_mock
+
+from webmentions.scanner import redirects, request_utils
+from webmentions.scanner.mention_detector import MentionCapabilities, fetch_page_check_mention_capabilities
+from webmentions.scanner.redirects import RedirectCache
+
+TARGET = """<html><head><link rel="webmention" href="/webmention"></head><body></body></html>"""
+
+
+def test_skips_the_redirects_it_has_seen(monkeypatch):
+    cache = RedirectCache(':memory:', temporary_ttl_seconds=0)
+    with requests_mock.Mocker() as m:
+        m.get('http://short.example/a', status_code=301, headers={'Location': 'https://blog.example/a'})
+        m.get('https://blog.example/a', status_code=308, headers={'Location': '/posts/a'})
+        m.get('https://blog.example/posts/a', text=TARGET)
+        m.get('http://temporary.example/', status_code=302, headers={'Location': 'https://blog.example/posts/a'})
+
+        r = cache.get('http://short.example/a')
+        assert r.url == 'https://blog.example/posts/a'
+        assert m.call_count == 3
+
+        # Relative links on the page are relative to where it ended up
+        monkeypatch.setattr(redirects, '_cache', cache)
+        assert fetch_page_check_mention_capabilities('http://short.example/a') == MentionCapabilities(
+            webmention_url='https://blog.example/webmention', pingback_url=None,
+        )
+        assert m.call_count == 4
+        assert m.request_history[-1].url == 'https://blog.example/posts/a'
+
+        # Temporary redirects are only remembered briefly (here, not at all)
+        cache.get('http://temporary.example/')
+        cache.get('http://temporary.example/')
+        assert [request.url for request in m.request_history[4:]] == [
+            'http://temporary.example/', 'https://blog.example/posts/a',
+        ] * 2
+    assert cache.stats() == redirects.RedirectStats(hops_skipped=2, hops_followed=4, hops_rejected=0)
+
+
+def test_redirect_loops():
+    cache = RedirectCache(':memory:')
+    with requests_mock.Mocker() as m:
+        m.get('https://a.example/', status_code=301, headers={'Location': 'https://b.example/'})
+        m.get('https://b.example/', status_code=301, headers={'Location': 'https://a.example/'})
+        with pytest.raises(requests.TooManyRedirects):
+            cache.get('https://a.example/')
+        # Neither hop came from the cache, so there was nothing to try again without it
+        assert m.call_count == 2
+
+        # b.example has since been fixed, so what we remembered about it is out of date
+        m.get('https://b.example/', text='fixed')
+        assert cache.get('https://a.example/').text == 'fixed'
+        assert cache.location('https://b.example/') is None
+
+
+def test_remembered_redirects_are_checked_against_the_guard(monkeypatch):
+    monkeypatch.setattr(socket, 'getaddrinfo', socket.getaddrinfo)
+    monkeypatch.setattr(request_utils, '_resolver', None)
+    guard = request_utils.extra_spooky_monkey_patch_to_block_local_traffic()
+    monkeypatch.setattr(guard, '_resolve', fake_getaddrinfo)
+
+    cache = RedirectCache(':memory:')
+    # Cached by a run without the guard, or when rebound.example still pointed somewhere public
+    cache.record('https://short.example/x', 'https://rebound.example/x', 301)
+    cache.record('https://short.example/y', 'https://public.example/y', 301)
+    with requests_mock.Mocker() as m:
+        m.get('https://short.example/x', status_code=301, headers={'Location': 'https://public.example/x'})
+        m.get('https://public.example/x', text='x')
+        m.get('https://public.example/y', text='y')
+
+        assert cache.get('https://short.example/x').text == 'x'
+        assert cache.get('https://short.example/y').text == 'y'
+    assert cache.location('https://short.example/x') == 'https://public.example/x'
+    assert cache.stats() == redirects.RedirectStats(hops_skipped=1, hops_followed=1, hops_rejected=1)
+    assert not request_utils.is_allowed_destination('file:///etc/passwd')
+
+
+def fake_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    address = '127.0.0.1' if host == 'rebound.example' else '93.184.215.14'
+    return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port))]
+
+
+
+def test_a_redirect_chain_gets_one_deadline(monkeypatch):
+    monkeypatch.setattr(request_utils, '_timeouts', request_utils.Timeouts(1.0, 1.0, deadline_seconds=0.3))
+    cache = RedirectCache(':memory:')
+
+    def slow_hop(n):
+        def respond(request, context):
+            time.sleep(0.15)
+            context.status_code = 302
+            context.headers['Location'] = f'https://hop.example/{n + 1}'
+            return ''
+        return respond
+
+    with requests_mock.Mocker() as m:
+        for n in range(5):
+            m.get(f'https://hop.example/{n}', text=slow_hop(n))
+        with pytest.raises(request_utils.DeadlineExceeded) as e:
+            cache.get('https://hop.example/0')
+        # Each hop was well within the deadline, but the chain as a whole wasn't
+        assert m.call_count == 2
+    assert e.value.url == 'https://hop.example/0'
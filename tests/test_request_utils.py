@@ -0,0 +1,259 @@
+import gzip
+import http.server
+import socket
+import threading
+import time
+import tracemalloc
+
+import pytest
+import requests
+
+from benchmarks.synthetic_web import ENCODERS, SyntheticWeb, WebParams
+from webmentions import config
+from webmentions.scanner import request_utils
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.headers.get('User-Agent', '').encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_client_reuses_connections_and_sets_user_agent():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = request_utils.HttpClient()
+    try:
+        url = f'http://127.0.0.1:{server.server_port}/'
+        for _ in range(3):
+            r = client.get(url)
+            assert r.text == config.USER_AGENT
+
+        stats = client.stats()
+        assert stats.requests_sent == 3
+        assert stats.connections_opened == 1
+        assert stats.connections_reused == 2
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def _serve():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_local_traffic_guard(monkeypatch):
+    # So that the guard comes back off after the test
+    monkeypatch.setattr(socket, 'getaddrinfo', socket.getaddrinfo)
+    monkeypatch.setattr(request_utils, '_resolver', None)
+    request_utils.extra_spooky_monkey_patch_to_block_local_traffic()
+
+    server = _serve()
+    client = request_utils.HttpClient()
+    try:
+        url = f'http://localhost:{server.server_port}/'
+        with pytest.raises(requests.ConnectionError):
+            client.get(url)
+
+        with request_utils.allow_local_addresses():
+            assert client.get(url).ok
+
+        stats = request_utils.resolver_stats()
+        assert stats is not None
+        assert stats.lookups == 2
+        assert stats.lookups_saved == 1
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_peer_check_catches_addresses_that_skip_the_resolver(monkeypatch):
+    monkeypatch.setattr(socket, 'getaddrinfo', socket.getaddrinfo)
+    monkeypatch.setattr(request_utils, '_resolver', None)
+    system_getaddrinfo = socket.getaddrinfo
+    request_utils.extra_spooky_monkey_patch_to_block_local_traffic()
+    # As if the lookup had been done by something other than the guard
+    monkeypatch.setattr(socket, 'getaddrinfo', system_getaddrinfo)
+
+    server = _serve()
+    client = request_utils.HttpClient()
+    try:
+        with pytest.raises(requests.ConnectionError, match='non-global address'):
+            client.get(f'http://127.0.0.1:{server.server_port}/')
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+class _BigHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 64 MiB of zeroes, which gzip squashes down to about 64 KiB
+    bomb = gzip.compress(b'\0' * (64 * 1024 * 1024))
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        if self.path == '/bomb':
+            body = self.bomb
+            self.send_header('Content-Encoding', 'gzip')
+        elif self.path == '/announced':
+            body = b''
+            self.send_header('Content-Length', str(1024 * 1024 * 1024))
+            self.end_headers()
+            return
+        else:
+            body = b'<p>small</p>'
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.mark.parametrize('backend', request_utils.HTTP_BACKENDS)
+def test_fetch_caps_decompressed_size(backend, monkeypatch):
+    if backend == request_utils.HTTP2:
+        pytest.importorskip('httpx')
+    client = request_utils.HttpClient(backend=backend)
+    monkeypatch.setattr(request_utils, '_client', client)
+    request_utils.set_byte_cap(request_utils.ARTICLE, 1024 * 1024)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _BigHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    try:
+        r = request_utils.fetch(f'{base}/', request_utils.ARTICLE)
+        assert r.text == '<p>small</p>'
+
+        tracemalloc.start()
+        with pytest.raises(request_utils.ResponseTooLarge):
+            request_utils.fetch(f'{base}/bomb', request_utils.ARTICLE)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert peak < 8 * 1024 * 1024
+
+        with pytest.raises(request_utils.ResponseTooLarge):
+            request_utils.fetch(f'{base}/announced', request_utils.ARTICLE)
+    finally:
+        request_utils.set_byte_cap(request_utils.ARTICLE, request_utils.DEFAULT_BYTE_CAPS[request_utils.ARTICLE])
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('backend', request_utils.HTTP_BACKENDS)
+def test_client_decodes_what_it_asks_for(backend):
+    if backend == request_utils.HTTP2:
+        pytest.importorskip('httpx')
+    web = SyntheticWeb(WebParams(articles=1, body_kib=4, compress=True))
+    client = request_utils.HttpClient(backend=backend)
+    try:
+        web.start()
+        r = client.get(web.article_url(0))
+        encoding = r.headers['Content-Encoding']
+        # Whatever the server picked, it was the one it likes best out of what we offered
+        assert encoding in r.request.headers['Accept-Encoding'].split(', ')
+        assert encoding == next(coding for coding in ENCODERS if coding in r.request.headers['Accept-Encoding'])
+        assert '<h1>Post 0</h1>' in r.text
+        assert web.stats().bytes_served < len(r.content)
+    finally:
+        client.close()
+        web.stop()
+
+
+def test_http2_backend_counts_connections_and_checks_peers(monkeypatch):
+    pytest.importorskip('httpx')
+    server = _serve()
+    client = request_utils.HttpClient(backend=request_utils.HTTP2)
+    url = f'http://127.0.0.1:{server.server_port}/'
+    try:
+        for _ in range(3):
+            r = client.get(url)
+            assert r.text == config.USER_AGENT
+        assert client.stats() == request_utils.ClientStats(requests_sent=3, connections_opened=1)
+
+        monkeypatch.setattr(socket, 'getaddrinfo', socket.getaddrinfo)
+        monkeypatch.setattr(request_utils, '_resolver', None)
+        system_getaddrinfo = socket.getaddrinfo
+        request_utils.extra_spooky_monkey_patch_to_block_local_traffic()
+        # So that it's the peer check that has to catch it, not the resolver
+        monkeypatch.setattr(socket, 'getaddrinfo', system_getaddrinfo)
+        guarded = request_utils.HttpClient(backend=request_utils.HTTP2)
+        try:
+            with pytest.raises(requests.ConnectionError, match='non-global address'):
+                guarded.get(url)
+            with request_utils.allow_local_addresses():
+                assert guarded.get(url).ok
+        finally:
+            guarded.close()
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+class _TarpitHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        response = b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n'
+        if self.path == '/body':
+            self.wfile.write(response)
+            response = b'<p>' + b'.' * 1000
+        try:
+            # A byte at a time, each well within the read timeout
+            for byte in response:
+                self.wfile.write(bytes([byte]))
+                self.wfile.flush()
+                time.sleep(0.05)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_deadline_cuts_off_servers_that_trickle(monkeypatch):
+    monkeypatch.setattr(request_utils, '_timeouts', request_utils.Timeouts(1.0, 5.0, deadline_seconds=0.5))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _TarpitHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    try:
+        for path in ('/headers', '/body'):
+            started = time.monotonic()
+            with pytest.raises(request_utils.DeadlineExceeded):
+                request_utils.fetch(f'{base}{path}', request_utils.ARTICLE)
+            assert time.monotonic() - started < 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_deadline_leaves_idle_connections_alone(monkeypatch):
+    monkeypatch.setattr(request_utils, '_timeouts', request_utils.Timeouts(1.0, 1.0, deadline_seconds=0.2))
+    server = _serve()
+    client = request_utils.HttpClient()
+    url = f'http://127.0.0.1:{server.server_port}/'
+    try:
+        assert client.get(url).ok
+        assert request_utils.read_body(client.get(url, stream=True), 1024) == config.USER_AGENT.encode()
+        time.sleep(0.3)
+        assert client.get(url).ok
+        assert client.stats() == request_utils.ClientStats(requests_sent=3, connections_opened=1)
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,67 @@
+import socket
+
+import pytest
+
+from webmentions.scanner import resolver
+
+PUBLIC = (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', 443))
+LOOPBACK = (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 443))
+
+
+class FakeDns:
+    def __init__(self):
+        self.now = 0.0
+        self.calls = 0
+        self.answer = [PUBLIC]
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        self.calls += 1
+        if host == 'nxdomain.example':
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return list(self.answer)
+
+
+def test_caches_until_the_ttl_runs_out():
+    dns = FakeDns()
+    caching = resolver.CachingResolver(dns.getaddrinfo, ttl_seconds=60, clock=lambda: dns.now)
+
+    assert caching.getaddrinfo('example.com', 443) == [PUBLIC]
+    dns.answer = [LOOPBACK]
+    # Rebinding the name doesn't change what we hand out until the entry expires
+    assert caching.getaddrinfo('example.com', 443) == [PUBLIC]
+    assert dns.calls == 1
+
+    dns.now = 61
+    assert caching.getaddrinfo('example.com', 443) == [LOOPBACK]
+    assert dns.calls == 2
+    assert caching.stats().lookups == 3
+    assert caching.stats().lookups_saved == 1
+
+
+def test_caches_failures_briefly():
+    dns = FakeDns()
+    caching = resolver.CachingResolver(dns.getaddrinfo, negative_ttl_seconds=5, clock=lambda: dns.now)
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            caching.getaddrinfo('nxdomain.example', 443)
+    assert dns.calls == 1
+
+    dns.now = 6
+    with pytest.raises(socket.gaierror):
+        caching.getaddrinfo('nxdomain.example', 443)
+    assert dns.calls == 2
+
+
+def test_evicts_when_full():
+    dns = FakeDns()
+    caching = resolver.CachingResolver(dns.getaddrinfo, max_entries=2, clock=lambda: dns.now)
+    for host in ('a.example', 'b.example', 'c.example', 'a.example'):
+        caching.getaddrinfo(host, 443)
+    assert dns.calls == 4
+
+
+def test_addrinfo_is_global():
+    assert resolver.addrinfo_is_global(PUBLIC)
+    assert not resolver.addrinfo_is_global(LOOPBACK)
+    assert not resolver.addrinfo_is_global((socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('::1', 443, 0, 0)))
+    assert not resolver.is_global_ip('not an ip')
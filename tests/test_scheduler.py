@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import requests_mock
+
+from webmentions.scanner import main
+from webmentions.scanner.scheduler import HostScheduler, RobotsCache, parse_crawl_delay
+
+
+def _run_fetches(scheduler: HostScheduler, hosts: list[str], hold_seconds: float = 0.01) -> list[str]:
+    """Requests a slot for each host in order, and returns the order the slots were handed out in"""
+    order: list[str] = []
+
+    async def fetch(host: str) -> None:
+        async with scheduler.slot(host):
+            order.append(host)
+            await asyncio.sleep(hold_seconds)
+
+    async def fetch_all() -> None:
+        await asyncio.gather(*(fetch(host) for host in hosts))
+
+    asyncio.run(fetch_all())
+    return order
+
+
+def test_hosts_take_turns():
+    scheduler = HostScheduler(concurrency=1, per_host_concurrency=1)
+    order = _run_fetches(scheduler, ['busy'] * 4 + ['a', 'b'])
+    # The busy host got there first, but doesn't get to go again until the others have had a turn
+    assert order[:3] == ['busy', 'a', 'b']
+    assert scheduler.stats()['busy'].max_queue_depth == 3
+
+
+def test_per_host_cap():
+    scheduler = HostScheduler(concurrency=8, per_host_concurrency=2)
+    active = 0
+    most_active = 0
+
+    async def fetch() -> None:
+        nonlocal active, most_active
+        async with scheduler.slot('one.example'):
+            active += 1
+            most_active = max(most_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    async def fetch_all() -> None:
+        await asyncio.gather(*(fetch() for _ in range(6)))
+
+    asyncio.run(fetch_all())
+    assert most_active == 2
+    assert scheduler.stats()['one.example'].requests == 6
+
+
+def test_crawl_delay_spaces_out_requests():
+    scheduler = HostScheduler(concurrency=4, per_host_concurrency=4)
+    scheduler.set_crawl_delay('slow.example', 0.05)
+    started = time.monotonic()
+    _run_fetches(scheduler, ['slow.example'] * 3, hold_seconds=0)
+    assert time.monotonic() - started >= 0.1
+    assert scheduler.stats()['slow.example'].wait_seconds >= 0.15
+
+
+def test_robots_fetched_once_and_capped():
+    robots = RobotsCache(max_crawl_delay=5)
+    with requests_mock.Mocker() as m:
+        m.get('https://polite.example/robots.txt', text='User-agent: *\nCrawl-delay: 2\n')
+        m.get('https://greedy.example/robots.txt', text='User-agent: *\nCrawl-delay: 3600\n')
+        m.get('https://none.example/robots.txt', status_code=404)
+
+        assert robots.known_crawl_delay('https://polite.example/a') is None
+        assert robots.crawl_delay('https://polite.example/a') == 2
+        assert robots.crawl_delay('https://POLITE.example/b') == 2
+        assert robots.known_crawl_delay('https://polite.example/c') == 2
+        assert robots.crawl_delay('https://greedy.example/') == 5
+        assert robots.crawl_delay('https://none.example/') == 0
+
+    assert m.call_count == 3
+    assert robots.hosts_fetched == 3
+
+
+def test_crawler_only_asks_for_robots_when_a_host_is_linked_twice():
+    article = """<html><body><article>
+        <a href="https://once.example/">a</a>
+        <a href="https://twice.example/1">b</a>
+        <a href="https://twice.example/2">c</a>
+    </article></body></html>"""
+    with requests_mock.Mocker() as m:
+        m.get('https://my.blog/post', text=article)
+        m.get('https://twice.example/robots.txt', text='User-agent: *\nCrawl-delay: 0.01\n')
+        for target in ('https://once.example/', 'https://twice.example/1', 'https://twice.example/2'):
+            m.get(target, text='<link rel="webmention" href="/wm">')
+
+        scheduler = HostScheduler(concurrency=4, per_host_concurrency=2)
+        candidates = list(main.generate_webmention_candidates(
+            'https://my.blog/post', single_page=True, concurrency=4, scheduler=scheduler, robots=RobotsCache(),
+        ))
+
+    assert len(candidates) == 3
+    requested = [r.url for r in m.request_history]
+    assert 'https://once.example/robots.txt' not in requested
+    assert requested.count('https://twice.example/robots.txt') == 1
+    assert scheduler.stats()['twice.example'].crawl_delay == 0.01
+
+
+def test_crawl_delay_for_our_user_agent():
+    robots = """
+User-agent: googlebot
+Crawl-delay: 1
+
+User-agent: HECK YEAH Webmentions
+Disallow: /private
+Crawl-delay: 0.5
+
+User-agent: *
+Crawl-delay: 30
+"""
+    assert parse_crawl_delay(robots, 'HECK YEAH Webmentions v0.0.1') == 0.5
+    assert parse_crawl_delay(robots, 'SomeOtherBot/1.0') == 30
+    assert parse_crawl_delay('User-agent: *\nDisallow: /\n', 'SomeOtherBot/1.0') is None
@@ -0,0 +1,123 @@
+import time
+
+import requests_mock
+
+from webmentions.scanner import send_queue
+from webmentions.scanner.mention_detector import MentionCapabilities
+from webmentions.scanner.mention_sender import MentionCandidate, RemoteError, SendError
+from webmentions.scanner.send_queue import SendQueue, SendWorkerPool
+
+ENDPOINT = 'https://target.example/webmention'
+
+
+def _candidate(target='https://target.example/post'):
+    return MentionCandidate(
+        mentioner_url='https://my.blog/post',
+        mentioned_url=target,
+        capabilities=MentionCapabilities(webmention_url=ENDPOINT, pingback_url=None),
+    )
+
+
+def test_classify():
+    assert send_queue.classify(SendError(ENDPOINT, 429, '120')) == send_queue.Outcome(
+        sent=False, retryable=True, retry_after=120.0, error=f'{ENDPOINT} returned HTTP 429',
+    )
+    assert not send_queue.classify(SendError(ENDPOINT, 400)).retryable
+    assert send_queue.classify(RemoteError(0x0000, 'generic')).retryable
+    assert send_queue.classify(RemoteError(0x0032, 'upstream')).retryable
+    assert not send_queue.classify(RemoteError(17, 'no link')).retryable
+    assert send_queue.classify(RemoteError(48, 'already registered')).sent
+    assert send_queue.classify(IOError('connection reset')).retryable
+
+
+def test_parse_retry_after():
+    assert send_queue.parse_retry_after('5') == 5.0
+    assert send_queue.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412470.0) == 10.0
+    assert send_queue.parse_retry_after('soon') is None
+
+
+def test_retries_until_sent(monkeypatch):
+    queue = SendQueue(':memory:')
+    assert queue.enqueue(_candidate())
+    assert not queue.enqueue(_candidate())
+    pool = SendWorkerPool(queue, workers=2, max_wait_seconds=5)
+
+    with requests_mock.Mocker() as m:
+        m.post(ENDPOINT, [
+            {'status_code': 503, 'headers': {'Retry-After': '0'}},
+            {'status_code': 202},
+        ])
+        monkeypatch.setattr(send_queue, 'backoff_seconds', lambda attempts: 0.01)
+        stats = pool.drain()
+
+    assert stats == send_queue.DrainStats(sent=1, retried=1, failed=0)
+    assert queue.counts() == {'sent': 1}
+
+
+def test_permanent_failures_are_not_retried():
+    queue = SendQueue(':memory:')
+    queue.enqueue(_candidate())
+    with requests_mock.Mocker() as m:
+        m.post(ENDPOINT, status_code=400)
+        stats = SendWorkerPool(queue).drain()
+
+    assert stats == send_queue.DrainStats(sent=0, retried=0, failed=1)
+    assert queue.counts() == {'failed': 1}
+
+
+def test_token_bucket():
+    bucket = send_queue.TokenBucket(rate=10, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 0.1
+    # Nothing was taken that time
+    assert 0 < bucket.take() <= 0.1
+
+
+def test_a_rate_limited_receiver_doesnt_hold_up_the_others():
+    queue = SendQueue(':memory:')
+    for i in range(4):
+        queue.enqueue(_candidate(f'https://target.example/{i}'))
+    other = MentionCandidate(
+        mentioner_url='https://my.blog/post',
+        mentioned_url='https://other.example/post',
+        capabilities=MentionCapabilities(webmention_url='https://other.example/webmention', pingback_url=None),
+    )
+    queue.enqueue(other)
+    sent_at: dict[str, float] = {}
+
+    def send(candidate):
+        sent_at[candidate.mentioned_url] = time.monotonic()
+
+    pool = SendWorkerPool(
+        queue, workers=1, rate_limiter=send_queue.EndpointRateLimiter(rate=5, burst=1), send=send,
+    )
+
+    started_at = time.monotonic()
+    stats = pool.drain()
+
+    assert stats == send_queue.DrainStats(sent=5, retried=0, failed=0)
+    assert sent_at['https://other.example/post'] - started_at < 0.1
+    assert max(sent_at.values()) - started_at >= 0.55
+
+
+def test_processes_sharing_a_queue_dont_send_each_others_mentions(tmp_path):
+    path = str(tmp_path / 'send_queue.sqlite3')
+    ours = SendQueue(path)
+    ours.enqueue(_candidate())
+    [claimed] = ours.claim(limit=10)
+
+    # Opening the queue elsewhere leaves mentions that are being sent alone
+    theirs = SendQueue(path, lease_seconds=0)
+    assert theirs.claim(limit=10) == []
+    assert ours.complete(claimed)
+    assert theirs.counts() == {'sent': 1}
+
+    # Until whoever's sending them goes quiet for too long
+    theirs.enqueue(_candidate('https://target.example/other'))
+    [abandoned] = theirs.claim(limit=10)
+    [reclaimed] = ours.claim(limit=10)
+    assert reclaimed.id == abandoned.id
+    assert not theirs.retry(abandoned, 'too slow', 0)
+    assert ours.complete(reclaimed)
+    assert ours.counts() == {'sent': 2}
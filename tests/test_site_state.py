@@ -0,0 +1,61 @@
+import requests_mock
+
+from webmentions.scanner import main
+from webmentions.scanner.site_state import SiteStateStore
+
+HOMEPAGE = '<html><head><link rel="alternate" type="application/rss+xml" href="/index.xml"></head></html>'
+FEED = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>blog</title>
+  <item><title>one</title><link>https://my.blog/one</link></item>
+  <item><title>two</title><link>https://my.blog/two</link></item>
+</channel></rss>
+"""
+ARTICLE = '<article><a href="https://target.example/">target</a></article>'
+
+
+def _etagged(body, etag):
+    def respond(request, context):
+        if request.headers.get('If-None-Match') == etag:
+            context.status_code = 304
+            return ''
+        context.headers['ETag'] = etag
+        return body
+    return respond
+
+
+def _scan(m, state):
+    m.get('https://my.blog/', text=_etagged(HOMEPAGE, '"home"'))
+    m.get('https://my.blog/index.xml', text=_etagged(FEED, '"feed"'))
+    m.get('https://my.blog/one', text=_etagged(ARTICLE, '"one"'))
+    m.get('https://my.blog/two', text=_etagged(ARTICLE, '"two"'))
+    m.get('https://target.example/', text='<link rel="webmention" href="/wm">')
+    return list(main.generate_webmention_candidates('https://my.blog/', single_page=False, state=state))
+
+
+def test_unchanged_site_takes_two_requests():
+    state = SiteStateStore(':memory:')
+    with requests_mock.Mocker() as m:
+        assert len(_scan(m, state)) == 2
+
+    with requests_mock.Mocker() as m:
+        assert _scan(m, state) == []
+        assert [r.url for r in m.request_history] == ['https://my.blog/', 'https://my.blog/index.xml']
+
+
+def test_validators_are_not_saved_for_unfinished_runs():
+    state = SiteStateStore(':memory:')
+    with requests_mock.Mocker() as m:
+        candidates = main.generate_webmention_candidates('https://my.blog/', single_page=False, state=state)
+        m.get('https://my.blog/', text=_etagged(HOMEPAGE, '"home"'))
+        m.get('https://my.blog/index.xml', text=_etagged(FEED, '"feed"'))
+        m.get('https://my.blog/one', text=_etagged(ARTICLE, '"one"'))
+        m.get('https://my.blog/two', text=_etagged(ARTICLE, '"two"'))
+        m.get('https://target.example/', text='<link rel="webmention" href="/wm">')
+        next(candidates)
+        # Consumer crashes here, before the second candidate is handled
+        candidates.close()
+
+    with requests_mock.Mocker() as m:
+        assert len(_scan(m, state)) >= 1
+        feed_request = next(r for r in m.request_history if r.url == 'https://my.blog/index.xml')
+        assert 'If-None-Match' not in feed_request.headers
@@ -0,0 +1,104 @@
+import gzip
+
+import requests_mock
+
+from webmentions.scanner import main, sitemap
+from webmentions.scanner.feed import RssItem
+from webmentions.scanner.site_state import SiteStateStore
+
+INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://my.blog/posts.xml.gz</loc></sitemap>
+  <sitemap><loc>/pages.xml</loc></sitemap>
+  <sitemap><loc>https://my.blog/sitemap-index.xml</loc></sitemap>
+</sitemapindex>
+"""
+
+POSTS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://my.blog/one</loc><lastmod>2024-01-01</lastmod></url>
+  <url><loc> https://my.blog/two </loc></url>
+  <url><loc>https://elsewhere.example/three</loc></url>
+</urlset>
+"""
+
+# No namespace, which the protocol doesn't allow but which happens anyway
+PAGES = b"""<urlset><url><loc>https://my.blog/</loc></url><url><loc>https://my.blog/one</loc></url>
+<url><loc>https://my.blog/about</loc></url></urlset>"""
+
+ARTICLE = '<html><body><article><a href="https://target.example/">a link</a></article></body></html>'
+
+
+def test_robots_sitemap_lines():
+    robots = """
+User-agent: *
+Disallow: /admin  # Sitemap: https://my.blog/not-this-one.xml
+SITEMAP: https://my.blog/sitemap-index.xml
+sitemap:/relative.xml
+Sitemap: https://my.blog/sitemap-index.xml
+"""
+    assert sitemap.parse_robots_sitemaps('https://my.blog/robots.txt', robots) == [
+        'https://my.blog/sitemap-index.xml', 'https://my.blog/relative.xml',
+    ]
+
+
+def test_lists_pages_through_index_and_gzip():
+    with requests_mock.Mocker() as m:
+        m.get('https://my.blog/robots.txt', text='Sitemap: https://my.blog/sitemap-index.xml')
+        m.get('https://my.blog/sitemap-index.xml', content=INDEX)
+        m.get('https://my.blog/posts.xml.gz', content=gzip.compress(POSTS))
+        m.get('https://my.blog/pages.xml', content=PAGES)
+
+        items = list(sitemap.list_sitemap_articles('https://my.blog/'))
+
+    assert items == [
+        RssItem(title='https://my.blog/one', absolute_url='https://my.blog/one', updated='2024-01-01'),
+        RssItem(title='https://my.blog/two', absolute_url='https://my.blog/two'),
+        RssItem(title='https://my.blog/about', absolute_url='https://my.blog/about'),
+    ]
+
+
+def test_falls_back_to_sitemap_xml_and_plain_text():
+    with requests_mock.Mocker() as m:
+        m.get('https://my.blog/robots.txt', status_code=404)
+        m.get('https://my.blog/sitemap.xml', text='https://my.blog/one\nnot a url\nhttps://my.blog/two\n')
+
+        urls = [item.absolute_url for item in sitemap.list_sitemap_articles('https://my.blog/')]
+
+    assert urls == ['https://my.blog/one', 'https://my.blog/two']
+
+
+def test_gzip_bomb_is_cut_off():
+    reader = sitemap._CappedReader('https://my.blog/big.xml.gz', gzip.compress(b' ' * 10_000), max_bytes=1000)
+    try:
+        while reader.read(100):
+            pass
+        assert False, 'expected ResponseTooLarge'
+    except sitemap.request_utils.ResponseTooLarge:
+        pass
+
+
+def test_backfill_resumes_without_redoing_articles():
+    state = SiteStateStore(':memory:')
+    first_post_only = POSTS.replace(b'<url><loc> https://my.blog/two </loc></url>', b'')
+    with requests_mock.Mocker() as m:
+        m.get('https://my.blog/robots.txt', status_code=404)
+        m.get('https://my.blog/one', text=ARTICLE)
+        m.get('https://my.blog/two', text=ARTICLE)
+        m.get('https://target.example/', text='<link rel="webmention" href="/wm">')
+
+        # A first run that only got as far as the first article
+        m.get('https://my.blog/sitemap.xml', content=first_post_only)
+        list(main.generate_webmention_candidates(
+            'https://my.blog/', single_page=False, state=state, list_articles=sitemap.list_sitemap_articles,
+        ))
+        assert state.processed_count('https://my.blog/') == 1
+
+        m.get('https://my.blog/sitemap.xml', content=POSTS)
+        candidates = list(main.generate_webmention_candidates(
+            'https://my.blog/', single_page=False, state=state, list_articles=sitemap.list_sitemap_articles,
+        ))
+
+    assert [c.mentioner_url for c in candidates] == ['https://my.blog/two']
+    assert [r.url for r in m.request_history].count('https://my.blog/one') == 1
+    assert state.processed_count('https://my.blog/') == 2
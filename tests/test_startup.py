@@ -0,0 +1,24 @@
+from benchmarks import startup
+
+
+def test_startup_defers_heavy_imports():
+    profile = startup.profile_startup()
+    assert profile.imported('webmentions.scanner.main')
+    assert [name for name in startup.DEFERRED_MODULES if profile.imported(name)] == []
+
+
+def test_parse_importtime():
+    output = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   webmentions.util
+import time:      1000 |       1000 |     lxml.etree
+import time:       300 |       1300 |   webmentions.scanner.feed
+import time:        50 |       1470 | webmentions
+"""
+    profile = startup.parse_importtime(output)
+    assert [module.name for module in profile.modules] == [
+        'webmentions.util', 'lxml.etree', 'webmentions.scanner.feed', 'webmentions',
+    ]
+    assert profile.total_ms == 1.47
+    assert profile.own_modules_ms == 0.47
+    assert profile.imported('lxml')
+    assert not profile.imported('webmentions.scanner.xmlrpc')
@@ -0,0 +1,18 @@
+from benchmarks.synthetic_web import TARGET_KINDS, SyntheticWeb, WebParams
+from webmentions.scanner import main
+
+
+def test_scans_synthetic_web_end_to_end():
+    params = WebParams(articles=6, links_per_article=4, targets=12, target_hosts=2, body_kib=1, feed_format='atom')
+    with SyntheticWeb(params) as web:
+        candidates = list(main.generate_webmention_candidates(web.site_url, single_page=False, concurrency=4))
+
+    linked_targets = {target for article in range(params.articles) for target in web.article_targets(article)}
+    expected = {
+        web.target_url(target) for target in linked_targets if TARGET_KINDS[target % len(TARGET_KINDS)] != 'none'
+    }
+    assert {candidate.mentioned_url for candidate in candidates} == expected
+    assert len(candidates) == sum(
+        1 for article in range(params.articles) for target in web.article_targets(article)
+        if TARGET_KINDS[target % len(TARGET_KINDS)] != 'none'
+    )
@@ -0,0 +1,43 @@
+from webmentions.scanner import urls
+
+
+def test_interned_urls_are_shared():
+    parsed_twice = [''.join(['https://blog.example/', 'post']) for _ in range(2)]
+    assert parsed_twice[0] is not parsed_twice[1]
+    assert urls.intern_url(parsed_twice[0]) is urls.intern_url(parsed_twice[1])
+
+
+def test_exact_seen_set_normalizes():
+    seen = urls.seen_set()
+    assert isinstance(seen, urls.ExactSeenSet)
+    assert seen.add('https://Blog.example:443/a/../post#comments')
+    assert not seen.add('https://blog.example/post')
+    assert 'https://blog.example/post' in seen
+    assert 'https://blog.example/other' not in seen
+
+
+def test_bloom_seen_set():
+    seen = urls.seen_set(error_rate=0.01, capacity=10_000)
+    assert isinstance(seen, urls.BloomSeenSet)
+    added = [f'https://blog{i % 50}.example/posts/{i}' for i in range(10_000)]
+    assert all(seen.add(url) for url in added[:10])
+    for url in added[10:]:
+        seen.add(url)
+
+    # Never forgets
+    assert all(url in seen for url in added)
+    assert not seen.add('https://BLOG0.example/posts/0#top')
+    # ...and is about as wrong as it was asked to be about the rest
+    false_positives = sum(f'https://elsewhere.example/{i}' in seen for i in range(10_000))
+    assert false_positives < 200
+    # About 9.6 bits per URL at 1%
+    assert seen.size_bytes < 13_000
+
+
+def test_bloom_seen_set_checks_error_rate():
+    for error_rate in (0, 1, 1.5):
+        try:
+            urls.BloomSeenSet(error_rate)
+            assert False, 'expected ValueError'
+        except ValueError:
+            pass
@@ -0,0 +1,182 @@
+import threading
+import time
+
+import requests_mock
+
+from webmentions.scanner import work_queue
+from webmentions.scanner.feed import RssItem
+from webmentions.scanner.ledger import SentMentionLedger
+from webmentions.scanner.mention_detector import MentionCapabilities, NO_CAPABILITIES
+from webmentions.scanner.mention_sender import MentionCandidate
+from webmentions.scanner.scheduler import RobotsCache
+from webmentions.scanner.shard import ShardWorker, site_unit, target_unit
+from webmentions.scanner.site_state import SiteStateStore
+from webmentions.scanner.work_queue import Heartbeat, NewUnit, SqliteWorkQueue
+
+
+def test_claims_are_leased_and_follow_ups_queued_on_completion():
+    queue = SqliteWorkQueue(':memory:')
+    assert queue.add([NewUnit('site', 'a'), NewUnit('site', 'b'), NewUnit('site', 'a')]) == 2
+    [first] = queue.claim('one', limit=1, lease_seconds=60)
+    assert first.key == 'a' and first.attempts == 1
+
+    # Higher priorities jump the queue, and units that have been queued before aren't queued again
+    assert queue.complete(first, [NewUnit('article', 'a/1', priority=1), NewUnit('site', 'b')])
+    assert [lease.key for lease in queue.claim('two', limit=5, lease_seconds=60)] == ['a/1', 'b']
+    assert queue.claim('three', limit=5, lease_seconds=60) == []
+    assert queue.counts() == {work_queue.STATUS_DONE: 1, work_queue.STATUS_LEASED: 2}
+    assert queue.outstanding() == 2
+
+
+def test_leases_run_out_unless_renewed():
+    queue = SqliteWorkQueue(':memory:', max_claims=2)
+    queue.add([NewUnit('site', 'kept'), NewUnit('site', 'lost')])
+    kept, lost = queue.claim('crashy', limit=2, lease_seconds=0.05)
+    assert queue.renew([kept], lease_seconds=60) == [kept]
+    assert queue.next_expiry() is not None
+    time.sleep(0.06)
+
+    [retaken] = queue.claim('steady', limit=5, lease_seconds=0.05)
+    assert retaken.key == 'lost' and retaken.attempts == 2
+    # The first worker's lease is gone: it can't finish or renew the unit any more
+    assert not queue.complete(lost)
+    assert queue.renew([lost], lease_seconds=60) == []
+    time.sleep(0.06)
+
+    # Claimed twice and never finished, so it's probably what's crashing the workers
+    assert queue.claim('steady', limit=5, lease_seconds=60) == []
+    assert queue.failures() == [('site', 'lost', 'lease ran out too many times')]
+    assert queue.complete(kept)
+    assert queue.outstanding() == 0
+
+
+def test_failed_units_wait_before_theyre_retried():
+    queue = SqliteWorkQueue(':memory:', retry_delay_seconds=0.1)
+    queue.add([NewUnit('site', 'flaky')])
+    [lease] = queue.claim('one', limit=1, lease_seconds=60)
+    assert queue.fail(lease, 'try again', retry=True)
+    assert queue.claim('one', limit=1, lease_seconds=60) == []
+    assert queue.outstanding() == 1
+    time.sleep(0.11)
+    [retaken] = queue.claim('one', limit=1, lease_seconds=60)
+    assert retaken.attempts == 2
+
+
+def test_heartbeat_keeps_leases_alive():
+    queue = SqliteWorkQueue(':memory:')
+    queue.add([NewUnit('site', 'slow')])
+    [lease] = queue.claim('one', limit=1, lease_seconds=0.09)
+    with Heartbeat(queue, lease_seconds=0.09) as heartbeat:
+        heartbeat.hold(lease)
+        time.sleep(0.3)
+        assert queue.claim('two', limit=1, lease_seconds=60) == []
+    assert queue.complete(lease)
+
+
+ARTICLES = [RssItem(title=f'{i}', absolute_url=f'https://blog.example/{i}') for i in range(20)]
+CAPABLE = MentionCapabilities(webmention_url='https://target.example/webmention', pingback_url=None)
+
+
+def test_shard_workers_split_a_crawl(tmp_path):
+    path = str(tmp_path / 'work.sqlite3')
+    SqliteWorkQueue(path).add([site_unit('https://blog.example/')])
+    found: list[MentionCandidate] = []
+    looked_up: list[str] = []
+    lock = threading.Lock()
+
+    def on_candidate(candidate: MentionCandidate) -> None:
+        with lock:
+            found.append(candidate)
+
+    def resolve(url: str) -> MentionCapabilities:
+        time.sleep(0.001)
+        with lock:
+            looked_up.append(url)
+        return CAPABLE if url.endswith('/0') else NO_CAPABILITIES
+
+    # A unit that was leased by a worker that then crashed
+    crashed = SqliteWorkQueue(path)
+    crashed.add([target_unit('https://blog.example/x', 'https://target.example/0')])
+    crashed.claim('crashed', limit=1, lease_seconds=0.2)
+
+    workers = [
+        ShardWorker(
+            SqliteWorkQueue(path), on_candidate,
+            find_links=lambda article: [f'https://target.example/{i}' for i in range(3)],
+            resolve_capabilities=resolve,
+            list_articles=lambda url, state: iter(ARTICLES),
+            threads=2,
+            name=f'worker-{n}',
+        )
+        for n in range(3)
+    ]
+    stats = []
+    threads = [threading.Thread(target=lambda w=worker: stats.append(w.run())) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sum(s.sites for s in stats) == 1
+    assert sum(s.articles for s in stats) == len(ARTICLES)
+    # Every link of every article, plus the crashed worker's, exactly once
+    assert sum(s.targets for s in stats) == len(ARTICLES) * 3 + 1
+    assert len(looked_up) == len(ARTICLES) * 3 + 1
+    assert sorted(candidate.mentioner_url for candidate in found) == sorted(
+        [article.absolute_url for article in ARTICLES] + ['https://blog.example/x']
+    )
+    assert SqliteWorkQueue(path).counts() == {work_queue.STATUS_DONE: 1 + len(ARTICLES) * 4 + 1}
+
+
+def test_shard_workers_space_out_lookups_to_one_host():
+    queue = SqliteWorkQueue(':memory:')
+    queue.add([target_unit('https://blog.example/post', f'https://target.example/{i}') for i in range(4)])
+    started: list[float] = []
+    active = []
+    lock = threading.Lock()
+
+    def resolve(url: str) -> MentionCapabilities:
+        with lock:
+            started.append(time.monotonic())
+            active.append(url)
+            assert len(active) <= 2
+        time.sleep(0.05)
+        with lock:
+            active.remove(url)
+        return NO_CAPABILITIES
+
+    with requests_mock.Mocker() as m:
+        m.get('https://target.example/robots.txt', text='User-agent: *\nCrawl-delay: 0.2\n')
+        stats = ShardWorker(
+            queue, lambda candidate: None, resolve_capabilities=resolve, threads=4, robots=RobotsCache(),
+        ).run()
+
+    assert stats.targets == 4 and stats.errors == 0
+    # The first link to a host doesn't wait for its robots.txt, but the rest keep their distance
+    started.sort()
+    gaps = [later - earlier for earlier, later in zip(started, started[1:])]
+    assert all(gap >= 0.19 for gap in sorted(gaps)[1:])
+
+
+def test_links_that_never_get_checked_are_left_for_next_time():
+    article = RssItem(title='post', absolute_url='https://blog.example/post')
+    links = ['https://up.example/', 'https://down.example/']
+    state = SiteStateStore(':memory:')
+    ledger = SentMentionLedger(':memory:')
+
+    def resolve(url: str) -> MentionCapabilities:
+        if 'down' in url:
+            raise IOError('down')
+        return CAPABLE
+
+    queue = SqliteWorkQueue(':memory:', max_claims=2, retry_delay_seconds=0)
+    queue.add([site_unit('https://blog.example/')])
+    stats = ShardWorker(
+        queue, lambda candidate: None, find_links=lambda _: links, resolve_capabilities=resolve,
+        list_articles=lambda url, _: iter([article]), state=state, ledger=ledger,
+    ).run()
+
+    assert stats.errors == 2
+    assert queue.failures() == [('target', target_unit(article.absolute_url, links[1]).key, "OSError('down')")]
+    assert not state.is_processed('https://blog.example/', article)
+    assert ledger.diff_links(article.absolute_url, links).added == ['https://down.example/']
@@ -0,0 +1,73 @@
+import pytest
+from lxml import etree
+
+from webmentions.scanner import xmlrpc
+
+
+def _lxml_pingback_request(source: str, target: str) -> str:
+    method_call = etree.Element('methodCall')
+    etree.SubElement(method_call, 'methodName').text = 'pingback.ping'
+    params = etree.SubElement(method_call, 'params')
+    for uri in (source, target):
+        etree.SubElement(etree.SubElement(etree.SubElement(params, 'param'), 'value'), 'string').text = uri
+    return etree.tostring(
+        etree.ElementTree(method_call), pretty_print=True, xml_declaration=True, encoding='utf-8'
+    ).decode('utf-8')
+
+
+@pytest.mark.parametrize('target', [
+    'https://destination.potato/',
+    'https://destination.potato/?a=1&b=<2>',
+    'https://destination.potato/über\r\n',
+])
+def test_encode_matches_lxml(target):
+    assert xmlrpc.encode_pingback_request('https://sender.potato', target) == \
+        _lxml_pingback_request('https://sender.potato', target)
+
+
+def test_encode_rejects_control_characters():
+    with pytest.raises(ValueError):
+        xmlrpc.encode_pingback_request('https://sender.potato', 'https://destination.potato/\x00')
+
+
+def test_decode_fault_variants():
+    response = b"""
+    <?xml version="1.0"?>
+    <methodResponse><fault><value><struct>
+      <member><name>faultString</name><value>Target is not pingback-enabled</value></member>
+      <member><name>faultCode</name><value><i4>33</i4></value></member>
+    </struct></value></fault></methodResponse>
+    """
+    assert xmlrpc.decode_response(response) == xmlrpc.Fault(code=33, message='Target is not pingback-enabled')
+
+
+def test_decode_success():
+    response = b'<methodResponse><params><param><value><string>Thanks!</string></value></param></params>' \
+        b'</methodResponse>'
+    assert xmlrpc.decode_response(response) == xmlrpc.Success(value='Thanks!')
+    assert xmlrpc.decode_response(b'<methodResponse><params/></methodResponse>') == xmlrpc.Success(value=None)
+
+
+@pytest.mark.parametrize('body', [
+    b'',
+    b'<html><body>Not XML-RPC</body></html>',
+    b'<methodResponse><fault><value><int>1</int></value></fault></methodResponse>',
+])
+def test_decode_malformed(body):
+    with pytest.raises(xmlrpc.MalformedResponse):
+        xmlrpc.decode_response(body)
+
+
+def test_decode_does_not_expand_external_entities():
+    body = b'<!DOCTYPE x [<!ENTITY e SYSTEM "file:///etc/passwd">]><methodResponse><fault><value><struct>' \
+        b'<member><name>faultCode</name><value><int>0</int></value></member>' \
+        b'<member><name>faultString</name><value><string>&e;</string></value></member>' \
+        b'</struct></value></fault></methodResponse>'
+    assert xmlrpc.decode_response(body) == xmlrpc.Fault(code=0, message='')
+
+
+def test_decode_size_limit():
+    body = b'<methodResponse><params><param><value><string>' + b'x' * 100 + \
+        b'</string></value></param></params></methodResponse>'
+    with pytest.raises(xmlrpc.MalformedResponse):
+        xmlrpc.decode_response(body, max_bytes=64)
@@ -1 +1,5 @@
+import os
+
 USER_AGENT = 'HECK YEAH Webmentions v0.0.1'
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'webmentions')
@@ -0,0 +1,221 @@
+"""
+Receives webmentions (https://www.w3.org/TR/webmention/#receiving-webmentions) for the blogs we
+host. Requests are checked, queued and answered with a 202 straight away; whether the source
+really links to the target is checked afterwards (see `verifier`).
+
+    python -m webmentions.receiver.server --target-host blog.example --port 8080
+"""
+import argparse
+import http.server
+import socketserver
+import threading
+from typing import Callable, Iterable, Optional
+from urllib import parse
+
+from webmentions import util
+from webmentions.receiver.store import DEFAULT_RECEIVED_PATH, DEFAULT_REVERIFY_AFTER_SECONDS, ReceivedMentionStore
+from webmentions.receiver.verifier import DEFAULT_VERIFY_WORKERS, Verdict, VerificationWorkers, verify_mention
+from webmentions.scanner.request_utils import extra_spooky_monkey_patch_to_block_local_traffic
+
+DEFAULT_PATH = '/webmention'
+DEFAULT_PORT = 8080
+# Two URLs and their names fit in this many times over
+MAX_BODY_BYTES = 8 * 1024
+MAX_URL_LENGTH = 2048
+
+
+class InvalidMention(ValueError):
+    """The request isn't a webmention we'll accept; the message says why, for the sender"""
+
+
+def validate(fields: dict[str, list[str]], target_hosts: Optional[frozenset[str]]) -> tuple[str, str]:
+    """
+    Checks the submitted form, and returns the source and target. `target_hosts` is the hosts we
+    accept mentions of, or None to accept them for anywhere.
+    """
+    source = _single_url(fields, 'source')
+    target = _single_url(fields, 'target')
+    if util.normalize_url(source) == util.normalize_url(target):
+        raise InvalidMention('source and target are the same')
+    target_host = parse.urlsplit(target).hostname or ''
+    if target_hosts is not None and target_host not in target_hosts:
+        raise InvalidMention(f"We don't accept webmentions for {target_host}")
+    return source, target
+
+
+def _single_url(fields: dict[str, list[str]], name: str) -> str:
+    values = fields.get(name, [])
+    if len(values) != 1:
+        raise InvalidMention(f'Expected exactly one {name}')
+    url = values[0]
+    if len(url) > MAX_URL_LENGTH:
+        raise InvalidMention(f'{name} is too long')
+    parsed = parse.urlsplit(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise InvalidMention(f'{name} must be an http or https URL')
+    return url
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Set on the per-server subclass
+    receiver: 'Receiver'
+
+    protocol_version = 'HTTP/1.1'
+    # Otherwise the headers and body go out in separate segments and delayed ACKs add 40ms to everything
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: object) -> None:
+        # A line per request adds up in a burst
+        pass
+
+    def do_POST(self) -> None:
+        if parse.urlsplit(self.path).path != self.receiver.path:
+            self._respond(404, 'Not found')
+            return
+        length = self.headers.get('Content-Length', '')
+        if not length.isdigit():
+            self._respond(411, 'Content-Length required')
+            return
+        if int(length) > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._respond(413, 'Too big')
+            return
+        body = self.rfile.read(int(length))
+
+        try:
+            fields = parse.parse_qs(body.decode('utf-8'), strict_parsing=bool(body), max_num_fields=8)
+            source, target = validate(fields, self.receiver.target_hosts)
+        except InvalidMention as e:
+            self._respond(400, str(e))
+            return
+        except ValueError:
+            self._respond(400, 'Expected a form-encoded source and target')
+            return
+
+        self.receiver.submit(source, target)
+        # Same answer whether or not it was already queued, so that senders can't tell
+        self._respond(202, 'Accepted')
+
+    def _respond(self, status: int, message: str) -> None:
+        body = f'{message}\n'.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    # Bursts open plenty of connections at once
+    request_queue_size = 128
+
+
+class Receiver:
+    """The HTTP server, the queue, and the workers verifying what's in it."""
+
+    def __init__(
+        self,
+        store: ReceivedMentionStore,
+        target_hosts: Optional[Iterable[str]] = None,
+        workers: int = DEFAULT_VERIFY_WORKERS,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        path: str = DEFAULT_PATH,
+        verify: Callable[[str, str], Verdict] = verify_mention,
+    ) -> None:
+        self.store = store
+        self.target_hosts = frozenset(h.lower() for h in target_hosts) if target_hosts is not None else None
+        self.path = path
+        self.workers = VerificationWorkers(store, workers, verify)
+        self._lock = threading.Lock()
+        self._accepted = 0
+        self._queued = 0
+        handler = type('Handler', (_Handler,), {'receiver': self})
+        self._server = _Server((host, port), handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host!s}:{port}{self.path}'
+
+    def submit(self, source: str, target: str) -> None:
+        queued = self.store.submit(source, target)
+        with self._lock:
+            self._accepted += 1
+            self._queued += queued
+        if queued:
+            self.workers.wake()
+
+    @property
+    def accepted(self) -> int:
+        """How many mentions we've said 202 to"""
+        return self._accepted
+
+    @property
+    def queued(self) -> int:
+        """How many of those were queued for verification, i.e. weren't repeats"""
+        return self._queued
+
+    def start(self) -> None:
+        """Serves from a background thread"""
+        self.workers.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self) -> None:
+        self.workers.start()
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self.workers.stop()
+
+    def __enter__(self) -> 'Receiver':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+
+def main() -> None:
+    extra_spooky_monkey_patch_to_block_local_traffic()
+
+    parser = argparse.ArgumentParser(prog='Receiver', description='Receives webmentions for the blogs we host')
+    parser.add_argument(
+        '--target-host', action='append', required=True, dest='target_hosts',
+        help='A host to accept webmentions for (repeat for more)',
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--path', default=DEFAULT_PATH, help='Where the webmention endpoint is')
+    parser.add_argument('--db-path', default=DEFAULT_RECEIVED_PATH, help='Where to keep received mentions')
+    parser.add_argument(
+        '--workers', type=int, default=DEFAULT_VERIFY_WORKERS, help='How many sources to fetch at once',
+    )
+    parser.add_argument(
+        '--reverify-after', type=float, default=DEFAULT_REVERIFY_AFTER_SECONDS,
+        help="How long before a mention that's been resubmitted gets verified again, in seconds",
+    )
+    args = parser.parse_args()
+
+    store = ReceivedMentionStore(args.db_path, reverify_after_seconds=args.reverify_after)
+    receiver = Receiver(store, args.target_hosts, args.workers, args.host, args.port, args.path)
+    print(f'📥 Receiving webmentions at {receiver.url}')
+    try:
+        receiver.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        backlog = store.backlog()
+        if backlog:
+            print(f'⏸️ {backlog} mentions still to verify next time')
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from webmentions import config
+
+DEFAULT_RECEIVED_PATH = os.path.join(config.CACHE_DIR, 'received.sqlite3')
+# A mention that's just been verified isn't verified again for at least this long, however many
+# times it's sent to us
+DEFAULT_REVERIFY_AFTER_SECONDS = 60.0
+
+# Waiting to be verified, or being verified
+STATUS_PENDING = 'pending'
+STATUS_VERIFYING = 'verifying'
+# The source links to the target
+STATUS_VERIFIED = 'verified'
+# The source doesn't link to the target (any more), or isn't something we can check
+STATUS_REJECTED = 'rejected'
+# The source is gone (HTTP 410), so any mention it made is too
+STATUS_DELETED = 'deleted'
+# We couldn't fetch the source, even after retrying
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mentions (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    received_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    verified_at REAL,
+    last_error TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (source, target)
+);
+CREATE INDEX IF NOT EXISTS mentions_due ON mentions (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS mentions_by_target ON mentions (target, status);
+"""
+
+
+class ReceivedMention(NamedTuple):
+    id: int
+    source: str
+    target: str
+    attempts: int
+
+
+class StoredMention(NamedTuple):
+    source: str
+    target: str
+    status: str
+    attempts: int
+    received_at: float
+    verified_at: Optional[float]
+    last_error: Optional[str]
+
+
+class ReceivedMentionStore:
+    """
+    Mentions sent to us, and what we made of them, kept in SQLite. There's one row per (source,
+    target): submitting the same mention again while it's waiting to be verified doesn't queue it
+    twice, and submitting it again later (e.g. because the source was edited) queues it for another
+    look.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_RECEIVED_PATH,
+        reverify_after_seconds: float = DEFAULT_REVERIFY_AFTER_SECONDS,
+    ) -> None:
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._reverify_after_seconds = reverify_after_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Every submission is a write, so under a burst the fsyncs are what we'd be waiting on.
+        # With WAL, NORMAL only syncs at checkpoints, and a crash can only lose the last few.
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.executescript(_SCHEMA)
+        # Anything that was being verified when we last went down needs another go
+        self._db.execute(
+            'UPDATE mentions SET status = ? WHERE status = ?', (STATUS_PENDING, STATUS_VERIFYING)
+        )
+
+    def submit(self, source: str, target: str) -> bool:
+        """Queues the mention for verification, and returns False if it didn't need queueing again."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO mentions (source, target, status, received_at, next_attempt_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (source, target) DO UPDATE SET '
+                'status = excluded.status, attempts = 0, received_at = excluded.received_at, '
+                'next_attempt_at = excluded.next_attempt_at, last_error = NULL, updated_at = excluded.updated_at '
+                'WHERE status NOT IN (?, ?) AND updated_at <= ?',
+                (
+                    source, target, STATUS_PENDING, now, now, now,
+                    STATUS_PENDING, STATUS_VERIFYING, now - self._reverify_after_seconds,
+                ),
+            )
+            return cursor.rowcount > 0
+
+    def claim(self, limit: int) -> list[ReceivedMention]:
+        """Marks up to `limit` mentions that are due for verification as being verified, and returns them."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, source, target, attempts FROM mentions '
+                'WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?',
+                (STATUS_PENDING, now, limit),
+            ).fetchall()
+            self._db.executemany(
+                'UPDATE mentions SET status = ?, updated_at = ? WHERE id = ?',
+                [(STATUS_VERIFYING, now, row[0]) for row in rows],
+            )
+        return [ReceivedMention(id=row[0], source=row[1], target=row[2], attempts=row[3]) for row in rows]
+
+    def record(self, mention: ReceivedMention, status: str, error: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'UPDATE mentions SET status = ?, attempts = ?, last_error = ?, updated_at = ?, '
+                'verified_at = CASE WHEN ? = ? THEN ? ELSE verified_at END WHERE id = ?',
+                (status, mention.attempts + 1, error, now, status, STATUS_VERIFIED, now, mention.id),
+            )
+
+    def retry(self, mention: ReceivedMention, error: Optional[str], delay_seconds: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'UPDATE mentions SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, updated_at = ? '
+                'WHERE id = ?',
+                (STATUS_PENDING, mention.attempts + 1, error, now + delay_seconds, now, mention.id),
+            )
+
+    def next_due_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT MIN(next_attempt_at) FROM mentions WHERE status = ?', (STATUS_PENDING,)
+            ).fetchone()
+        return float(row[0]) if row[0] is not None else None
+
+    def get(self, source: str, target: str) -> Optional[StoredMention]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT source, target, status, attempts, received_at, verified_at, last_error FROM mentions '
+                'WHERE source = ? AND target = ?',
+                (source, target),
+            ).fetchone()
+        return StoredMention(*row) if row is not None else None
+
+    def verified_sources(self, target: str) -> list[str]:
+        """The pages that we know mention `target`, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT source FROM mentions WHERE target = ? AND status = ? ORDER BY verified_at',
+                (target, STATUS_VERIFIED),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM mentions GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def backlog(self) -> int:
+        """How many mentions are waiting to be (or being) verified"""
+        counts = self.counts()
+        return counts.get(STATUS_PENDING, 0) + counts.get(STATUS_VERIFYING, 0)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,172 @@
+"""
+Checking that the source of a received mention really does link to the target
+(https://www.w3.org/TR/webmention/#webmention-verification), off the request path: the server
+just queues mentions, and a fixed number of worker threads work through the queue. A burst of
+submissions makes the queue longer, rather than making the server fetch more pages at once.
+"""
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+import requests
+
+from webmentions import util
+from webmentions.receiver.store import (
+    ReceivedMention, ReceivedMentionStore, STATUS_DELETED, STATUS_FAILED, STATUS_REJECTED, STATUS_VERIFIED,
+)
+from webmentions.scanner import request_utils
+from webmentions.scanner.request_utils import WrappedResponse
+from webmentions.scanner.send_queue import RETRYABLE_STATUS_CODES, backoff_seconds
+
+DEFAULT_VERIFY_WORKERS = 8
+MAX_VERIFY_ATTEMPTS = 4
+# How long an idle worker waits before looking at the queue again, if nothing wakes it up sooner
+IDLE_POLL_SECONDS = 1.0
+
+_HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+
+class Verdict(NamedTuple):
+    status: str
+    # Worth trying again later, e.g. the source's server was down
+    retryable: bool = False
+    error: Optional[str] = None
+
+
+VERIFIED = Verdict(STATUS_VERIFIED)
+
+
+def verify_mention(source: str, target: str) -> Verdict:
+    """
+    Fetches `source` (through the local-address guard, if it's installed: unlike the scanner's own
+    articles, the source is whatever anyone on the internet sent us) and looks for a link to `target`.
+
+    In an HTML page, that's a link in the article if we can tell which bit of the page is the article
+    (the same way the scanner does), and anywhere in the page otherwise. A link in the sidebar of a
+    page that does have an article doesn't count, because that's where blogroll spam lives.
+    """
+    try:
+        r = request_utils.fetch(source, request_utils.ARTICLE)
+    except request_utils.ResponseTooLarge as e:
+        return Verdict(STATUS_REJECTED, error=str(e))
+    except (requests.RequestException, IOError) as e:
+        return Verdict(STATUS_FAILED, retryable=True, error=repr(e))
+
+    if r.status_code == 410:
+        return Verdict(STATUS_DELETED)
+    if not r.ok:
+        return Verdict(
+            STATUS_FAILED if r.status_code in RETRYABLE_STATUS_CODES else STATUS_REJECTED,
+            retryable=r.status_code in RETRYABLE_STATUS_CODES,
+            error=f'{source} returned HTTP {r.status_code}',
+        )
+
+    content_type = r.headers.get('Content-Type', 'text/html').split(';')[0].strip().lower()
+    if content_type == 'text/plain':
+        linked = target in r.text
+    elif content_type in _HTML_CONTENT_TYPES:
+        linked = _links_to(WrappedResponse(r), target)
+    else:
+        return Verdict(STATUS_REJECTED, error=f"Can't look for links in {content_type}")
+    return VERIFIED if linked else Verdict(STATUS_REJECTED, error=f"{source} doesn't link to {target}")
+
+
+def _links_to(r: WrappedResponse, target: str) -> bool:
+    document = r.document
+    hrefs = document.article_hrefs()
+    if hrefs is None:
+        hrefs = document.link_hrefs()
+    wanted = util.normalize_url(target)
+    for href in hrefs:
+        try:
+            if not util.is_only_fragment(href) and util.normalize_url(r.resolve_url(href)) == wanted:
+                return True
+        except ValueError:
+            # Someone else's broken link (e.g. `http://[::1/`) somewhere on the page isn't the mention's problem
+            continue
+    return False
+
+
+class VerificationStats(NamedTuple):
+    verified: int
+    rejected: int
+    retried: int
+    failed: int
+
+
+class VerificationWorkers:
+    """A fixed pool of threads verifying whatever's queued in `store`, until stopped."""
+
+    def __init__(
+        self,
+        store: ReceivedMentionStore,
+        workers: int = DEFAULT_VERIFY_WORKERS,
+        verify: Callable[[str, str], Verdict] = verify_mention,
+    ) -> None:
+        self.store = store
+        self._verify = verify
+        self._threads = [
+            threading.Thread(target=self._run, name=f'verifier-{i}', daemon=True) for i in range(workers)
+        ]
+        self._wake_up = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._verified = 0
+        self._rejected = 0
+        self._retried = 0
+        self._failed = 0
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def wake(self) -> None:
+        """Lets idle workers know there's something new in the queue"""
+        self._wake_up.set()
+
+    def stop(self) -> None:
+        """Stops once the mentions being verified right now are done. The rest stay queued."""
+        self._stopping.set()
+        self._wake_up.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            # Cleared before looking, so that anything queued after we look wakes us back up
+            self._wake_up.clear()
+            claimed = self.store.claim(limit=1)
+            if not claimed:
+                next_due_at = self.store.next_due_at()
+                wait = IDLE_POLL_SECONDS if next_due_at is None else next_due_at - time.time()
+                self._wake_up.wait(min(max(wait, 0), IDLE_POLL_SECONDS))
+                continue
+            self._verify_one(claimed[0])
+
+    def _verify_one(self, mention: ReceivedMention) -> None:
+        try:
+            verdict = self._verify(mention.source, mention.target)
+        except Exception as e:
+            verdict = Verdict(STATUS_FAILED, error=repr(e))
+
+        retrying = verdict.retryable and mention.attempts + 1 < MAX_VERIFY_ATTEMPTS
+        if retrying:
+            self.store.retry(mention, verdict.error, backoff_seconds(mention.attempts + 1))
+        else:
+            self.store.record(mention, verdict.status, verdict.error)
+
+        with self._lock:
+            if retrying:
+                self._retried += 1
+            elif verdict.status == STATUS_VERIFIED:
+                self._verified += 1
+            elif verdict.status == STATUS_FAILED:
+                self._failed += 1
+            else:
+                self._rejected += 1
+
+    def stats(self) -> VerificationStats:
+        with self._lock:
+            return VerificationStats(
+                verified=self._verified, rejected=self._rejected, retried=self._retried, failed=self._failed,
+            )
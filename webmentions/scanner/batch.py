@@ -0,0 +1,199 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import sys
+import threading
+import time
+from typing import IO, Any, Iterable, Iterator, Optional
+
+from webmentions.scanner import main as scanner
+from webmentions.scanner import request_utils
+from webmentions.scanner.crawler import DEFAULT_PER_HOST_CONCURRENCY, TimedOut
+from webmentions.scanner.mention_detector import ResolveCapabilities
+from webmentions.scanner.mention_sender import mention_endpoint
+from webmentions.scanner.request_utils import extra_spooky_monkey_patch_to_block_local_traffic
+from webmentions.scanner.scheduler import HostScheduler, RobotsCache
+from webmentions.scanner.send_queue import Outcome, QueuedMention
+
+DEFAULT_WORKERS = 4
+
+
+class JsonlWriter:
+    """Writes one JSON object per line; safe to share between threads."""
+
+    def __init__(self, out: IO[str]) -> None:
+        self._out = out
+        self._lock = threading.Lock()
+
+    def write(self, record_type: str, **fields: Any) -> None:
+        line = json.dumps({'type': record_type, **fields}, ensure_ascii=False)
+        with self._lock:
+            self._out.write(line + '\n')
+            self._out.flush()
+
+
+def read_site_urls(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        url = line.strip()
+        if url and not url.startswith('#'):
+            yield url
+
+
+def process_site(
+    site_url: str,
+    args: argparse.Namespace,
+    stores: scanner.ScanStores,
+    resolve_capabilities: ResolveCapabilities,
+    writer: JsonlWriter,
+    robots: Optional[RobotsCache] = None,
+) -> bool:
+    """Scans one site, writing everything that happens to `writer`. Returns whether it succeeded."""
+    started = time.monotonic()
+    # Each site's crawl runs in its own event loop, so they can't share one
+    scheduler = HostScheduler(args.concurrency, min(args.concurrency, DEFAULT_PER_HOST_CONCURRENCY))
+    candidates = 0
+    queued = 0
+    sends = 0
+    timed_out = 0
+    ok = True
+
+    def on_timeout(lookup: TimedOut) -> None:
+        nonlocal timed_out
+        timed_out += 1
+        writer.write('timeout', site=site_url, source=lookup.article_url, target=lookup.link)
+
+    try:
+        if stores.state is not None and args.full_rescan:
+            stores.state.forget_site(site_url)
+
+        ledger = stores.ledger if args.real else None
+        for candidate in scanner.generate_webmention_candidates(
+            site_url, args.single_page, args.concurrency, resolve_capabilities, stores.state, ledger,
+            scanner.article_lister(args), scheduler, robots, args.article_budget, args.scan_budget, on_timeout,
+        ):
+            candidates += 1
+            writer.write(
+                'candidate',
+                site=site_url,
+                source=candidate.mentioner_url,
+                target=candidate.mentioned_url,
+                webmention_url=candidate.capabilities.webmention_url,
+                pingback_url=candidate.capabilities.pingback_url,
+            )
+            if not args.real:
+                continue
+            if stores.send_queue is not None:
+                # Sent in one go once all the sites are done, see run_batch
+                queued += stores.send_queue.enqueue(candidate)
+                continue
+
+            send_started = time.monotonic()
+            try:
+                scanner.send_and_record(candidate, ledger)
+            except Exception as e:
+                writer.write(
+                    'send', site=site_url, source=candidate.mentioner_url, target=candidate.mentioned_url,
+                    endpoint=mention_endpoint(candidate), ok=False, error=repr(e),
+                    elapsed_seconds=time.monotonic() - send_started,
+                )
+                # Give up on the site, so that the ledger/state don't record the article as done
+                raise
+            sends += 1
+            writer.write(
+                'send', site=site_url, source=candidate.mentioner_url, target=candidate.mentioned_url,
+                endpoint=mention_endpoint(candidate), ok=True, elapsed_seconds=time.monotonic() - send_started,
+            )
+    except Exception as e:
+        ok = False
+        writer.write('error', site=site_url, error=repr(e))
+
+    writer.write(
+        'site', site=site_url, ok=ok, candidates=candidates, queued=queued, sends=sends, timed_out=timed_out,
+        host_wait_seconds=sum(host.wait_seconds for host in scheduler.stats().values()),
+        elapsed_seconds=time.monotonic() - started,
+    )
+    return ok
+
+
+def run_batch(
+    site_urls: Iterable[str],
+    args: argparse.Namespace,
+    stores: scanner.ScanStores,
+    writer: JsonlWriter,
+) -> int:
+    """Returns the number of sites that failed."""
+    started = time.monotonic()
+    resolve_capabilities, single_flight = scanner.build_capability_resolver(
+        stores.cache, args.full_page_discovery, args.seen_error_rate,
+    )
+    # Shared, so each linked host's robots.txt is only fetched once for the whole batch
+    robots = scanner.build_robots(args)
+    # Only read as far ahead in the site list as we've got workers for, so stdin can be a stream
+    slots = threading.BoundedSemaphore(args.workers * 2)
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for site_url in site_urls:
+            slots.acquire()
+            future = executor.submit(process_site, site_url, args, stores, resolve_capabilities, writer, robots)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+
+    failures = sum(1 for future in futures if not future.result())
+
+    def on_send_result(item: QueuedMention, outcome: Outcome) -> None:
+        writer.write(
+            'send', source=item.candidate.mentioner_url, target=item.candidate.mentioned_url,
+            endpoint=mention_endpoint(item.candidate), ok=outcome.sent,
+            retrying=not outcome.sent and outcome.retryable, attempt=item.attempts + 1, error=outcome.error,
+        )
+
+    sender = scanner.build_sender(args, stores, on_result=on_send_result) if args.real else None
+    if sender is not None:
+        sender.drain()
+
+    client_stats = request_utils.client().stats()
+    writer.write(
+        'batch',
+        sites=len(futures),
+        failed=failures,
+        requests_sent=client_stats.requests_sent,
+        connections_opened=client_stats.connections_opened,
+        lookups_saved=single_flight.saved,
+        robots_fetched=robots.hosts_fetched if robots is not None else 0,
+        elapsed_seconds=time.monotonic() - started,
+    )
+    return failures
+
+
+def main() -> None:
+    extra_spooky_monkey_patch_to_block_local_traffic()
+
+    parser = argparse.ArgumentParser(
+        prog='Batch scanner',
+        description='Scans many sites in one process and writes the results as JSON lines',
+    )
+    parser.add_argument(
+        '--input', type=argparse.FileType('r'), default='-',
+        help='File with one site URL per line (default: stdin)',
+    )
+    parser.add_argument(
+        '--output', type=argparse.FileType('w'), default='-',
+        help='Where to write the JSONL records (default: stdout)',
+    )
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='How many sites to scan at once')
+    parser.add_argument('--single-page', action='store_true', help='Treat each URL as a single article')
+    scanner.add_scan_arguments(parser)
+    args = parser.parse_args()
+
+    scanner.configure_from_args(args, workers=args.workers)
+    writer = JsonlWriter(args.output)
+    # The scanner's progress output would get mixed in with the records otherwise
+    with scanner.collect_metrics(args), scanner.open_stores(args) as stores, contextlib.redirect_stdout(sys.stderr):
+        failures = run_batch(read_site_urls(args.input), args, stores, writer)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
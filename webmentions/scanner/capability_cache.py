@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+from urllib import parse
+
+from webmentions import config
+from webmentions.scanner.mention_detector import MentionCapabilities, NO_CAPABILITIES, ResolveCapabilities
+
+DEFAULT_CACHE_PATH = os.path.join(config.CACHE_DIR, 'capabilities.sqlite3')
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+# After this many distinct pages on a host turn out not to support mentions, assume none of the
+# host's pages do (think: wikipedia, github, youtube).
+DEFAULT_HOST_MISS_THRESHOLD = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS capabilities (
+    url TEXT PRIMARY KEY,
+    webmention_url TEXT,
+    pingback_url TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS host_misses (
+    host TEXT PRIMARY KEY,
+    misses INTEGER NOT NULL,
+    last_miss_at REAL NOT NULL
+);
+"""
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    host_hits: int
+    misses: int
+
+
+class CapabilityCache:
+    """
+    On-disk cache of MentionCapabilities per target URL.
+
+    Results without any capabilities are cached too, and also counted against the target's host, so
+    that hosts which never advertise an endpoint get skipped entirely after a few misses. Everything
+    expires after the TTL so that sites which start supporting mentions get picked up eventually.
+    Targets that couldn't be checked (`CapabilityCheckFailed`) aren't cached at all.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        host_miss_threshold: int = DEFAULT_HOST_MISS_THRESHOLD,
+    ) -> None:
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._ttl_seconds = ttl_seconds
+        self._host_miss_threshold = host_miss_threshold
+        # The crawler looks things up from its worker threads, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+        self._hits = 0
+        self._host_hits = 0
+        self._misses = 0
+
+    def get(self, url: str) -> Optional[MentionCapabilities]:
+        cutoff = time.time() - self._ttl_seconds
+        with self._lock:
+            row = self._db.execute(
+                'SELECT webmention_url, pingback_url FROM capabilities WHERE url = ? AND fetched_at >= ?',
+                (url, cutoff),
+            ).fetchone()
+            if row is not None:
+                self._hits += 1
+                return MentionCapabilities(webmention_url=row[0], pingback_url=row[1])
+
+            host_row = self._db.execute(
+                'SELECT misses FROM host_misses WHERE host = ? AND last_miss_at >= ?',
+                (_host_of(url), cutoff),
+            ).fetchone()
+            if host_row is not None and host_row[0] >= self._host_miss_threshold:
+                self._host_hits += 1
+                return NO_CAPABILITIES
+
+            self._misses += 1
+            return None
+
+    def put(self, url: str, capabilities: MentionCapabilities) -> None:
+        now = time.time()
+        host = _host_of(url)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO capabilities (url, webmention_url, pingback_url, fetched_at) '
+                'VALUES (?, ?, ?, ?)',
+                (url, capabilities.webmention_url, capabilities.pingback_url, now),
+            )
+            if capabilities == NO_CAPABILITIES:
+                self._db.execute(
+                    'INSERT INTO host_misses (host, misses, last_miss_at) VALUES (?, 1, ?) '
+                    'ON CONFLICT (host) DO UPDATE SET misses = misses + 1, last_miss_at = excluded.last_miss_at',
+                    (host, now),
+                )
+            else:
+                self._db.execute('DELETE FROM host_misses WHERE host = ?', (host,))
+
+    def wrap(self, resolve_capabilities: ResolveCapabilities) -> ResolveCapabilities:
+        def cached_resolve_capabilities(url: str) -> MentionCapabilities:
+            capabilities = self.get(url)
+            if capabilities is None:
+                capabilities = resolve_capabilities(url)
+                self.put(url, capabilities)
+            return capabilities
+
+        return cached_resolve_capabilities
+
+    def purge(self) -> None:
+        with self._lock:
+            self._db.execute('DELETE FROM capabilities')
+            self._db.execute('DELETE FROM host_misses')
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(hits=self._hits, host_hits=self._host_hits, misses=self._misses)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _host_of(url: str) -> str:
+    return parse.urlparse(url).netloc.lower()
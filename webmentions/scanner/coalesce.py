@@ -0,0 +1,93 @@
+import concurrent.futures
+import sys
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+from webmentions import util
+from webmentions.scanner.urls import SeenSet
+
+T = TypeVar('T')
+
+
+class SingleFlight(Generic[T]):
+    """
+    Run-scoped memoisation of a lookup keyed by URL.
+
+    The first call for a (normalised) URL does the work; calls that arrive while it's in flight
+    block until it's done and share its result, and later calls get the memoised result. Failures
+    aren't memoised, so the next call after a failure tries again.
+
+    Given an `empty` result and a `seen` set, URLs whose result is `empty` are only remembered in
+    `seen` rather than in the memo. Most links go nowhere interesting, so with a Bloom filter for
+    `seen` that keeps a huge crawl's memo small, at the cost of the filter's false positives coming
+    back as `empty` without being looked up.
+    """
+
+    def __init__(
+        self,
+        normalize: Callable[[str], str] = util.normalize_url,
+        empty: Optional[T] = None,
+        seen: Optional[SeenSet] = None,
+    ) -> None:
+        self._normalize = normalize
+        self._empty = empty
+        self._seen = seen if empty is not None else None
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, concurrent.futures.Future[T]] = {}
+        # Finished lookups are kept apart from the futures, which weigh a lot more than the results
+        self._results: dict[str, T] = {}
+        self._calls = 0
+        self._saved = 0
+
+    def wrap(self, fn: Callable[[str], T]) -> Callable[[str], T]:
+        def single_flight(url: str) -> T:
+            return self.call(fn, url)
+
+        return single_flight
+
+    def call(self, fn: Callable[[str], T], url: str) -> T:
+        key = sys.intern(self._normalize(url))
+        with self._lock:
+            self._calls += 1
+            if key in self._results:
+                self._saved += 1
+                return self._results[key]
+            if self._seen is not None and key in self._seen:
+                self._saved += 1
+                assert self._empty is not None
+                return self._empty
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._saved += 1
+                owner = False
+            else:
+                future = self._in_flight[key] = concurrent.futures.Future()
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = fn(url)
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            if self._seen is not None and result == self._empty:
+                self._seen.add(key)
+            else:
+                self._results[key] = result
+        future.set_result(result)
+        return result
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    @property
+    def saved(self) -> int:
+        """How many calls were answered without calling through"""
+        return self._saved
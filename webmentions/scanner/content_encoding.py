@@ -0,0 +1,132 @@
+"""
+Decoding compressed response bodies (`Content-Encoding`) a bounded amount at a time, so that whoever's
+reading can give up at a byte cap (see `request_utils.fetch`) before a small, very compressible body
+has been inflated into memory. The HTTP backends hand over bodies as they came off the wire, and the
+encodings we ask for are exactly the ones we can decode like this.
+
+brotli and zstd are optional; install the `compression` extra for them.
+"""
+import itertools
+import sys
+import zlib
+from typing import Callable, Iterable, Iterator, Optional
+
+import requests
+
+# Decodes a body, handing it back no more than `max_length` bytes at a time
+Decoder = Callable[[Iterator[bytes], int], Iterator[bytes]]
+
+
+def _zlib_decoded(chunks: Iterator[bytes], max_length: int, wbits: int) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj(wbits)
+    for data in chunks:
+        while True:
+            out = decompressor.decompress(data, max_length)
+            data = decompressor.unconsumed_tail
+            if out:
+                yield out
+            # Anything after the end of the stream is ignored, like urllib3 and httpx do
+            if decompressor.eof:
+                return
+            if not data and len(out) < max_length:
+                break
+    if tail := decompressor.flush():
+        yield tail
+
+
+def _gzip_decoded(chunks: Iterator[bytes], max_length: int) -> Iterator[bytes]:
+    return _zlib_decoded(chunks, max_length, 16 + zlib.MAX_WBITS)
+
+
+def _deflate_decoded(chunks: Iterator[bytes], max_length: int) -> Iterator[bytes]:
+    # Meant to be zlib-wrapped, but plenty of servers send raw deflate, so look for a zlib header first
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 2:
+            break
+    wrapped = len(head) >= 2 and head[0] & 0x0f == 8 and int.from_bytes(head[:2], 'big') % 31 == 0
+    yield from _zlib_decoded(
+        itertools.chain([head], chunks), max_length, zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS,
+    )
+
+
+_DECODERS: dict[str, Decoder] = {
+    'gzip': _gzip_decoded,
+    'x-gzip': _gzip_decoded,
+    'deflate': _deflate_decoded,
+}
+_DECODE_ERRORS: tuple[type[Exception], ...] = (zlib.error,)
+
+try:
+    import brotli
+except ImportError:
+    pass
+else:
+    def _brotli_decoded(chunks: Iterator[bytes], max_length: int) -> Iterator[bytes]:
+        decompressor = brotli.Decompressor()
+        for data in chunks:
+            out = decompressor.process(data, output_buffer_limit=max_length)
+            # Whatever's left over comes out with more calls, until there's nothing left to give
+            while out:
+                yield out
+                out = decompressor.process(b'', output_buffer_limit=max_length)
+            if decompressor.is_finished():
+                return
+
+    # Older versions can only decompress everything they're given in one go
+    if hasattr(brotli.Decompressor, 'can_accept_more_data'):
+        _DECODERS['br'] = _brotli_decoded
+        _DECODE_ERRORS += (brotli.error,)
+
+try:
+    if sys.version_info >= (3, 14):
+        from compression import zstd
+    else:
+        from backports import zstd
+except ImportError:
+    pass
+else:
+    def _zstd_decoded(chunks: Iterator[bytes], max_length: int) -> Iterator[bytes]:
+        decompressor = zstd.ZstdDecompressor()
+        for data in chunks:
+            while True:
+                out = decompressor.decompress(data, max_length)
+                data = b''
+                if out:
+                    yield out
+                if decompressor.eof:
+                    # Bodies can be several frames one after the other
+                    data = decompressor.unused_data
+                    decompressor = zstd.ZstdDecompressor()
+                    if not data:
+                        break
+                elif decompressor.needs_input:
+                    break
+
+    _DECODERS['zstd'] = _zstd_decoded
+    _DECODE_ERRORS += (zstd.ZstdError,)
+
+ACCEPT_ENCODING = ', '.join(coding for coding in ('gzip', 'deflate', 'br', 'zstd') if coding in _DECODERS)
+
+
+def decoded(chunks: Iterable[bytes], content_encoding: Optional[str], max_length: int) -> Iterator[bytes]:
+    """
+    The body that `chunks` (as sent) encode, `max_length` bytes at a time at most. Bodies in encodings we
+    don't know come back as they are, same as with urllib3.
+    """
+    codings = [coding.strip().lower() for coding in (content_encoding or '').split(',')]
+    codings = [coding for coding in codings if coding and coding != 'identity']
+    if not all(coding in _DECODERS for coding in codings):
+        yield from chunks
+        return
+
+    body = iter(chunks)
+    # Applied in the order they're listed, so they come off last one first
+    for coding in reversed(codings):
+        body = _DECODERS[coding](body, max_length)
+    try:
+        yield from body
+    except _DECODE_ERRORS as e:
+        # What requests raises when urllib3 can't decode something
+        raise requests.exceptions.ContentDecodingError(e) from e
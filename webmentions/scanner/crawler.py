@@ -0,0 +1,416 @@
+import asyncio
+import concurrent.futures
+import itertools
+import time
+from typing import (
+    Any, AsyncGenerator, AsyncIterator, Callable, Coroutine, Generator, Iterator, NamedTuple, Optional, TypeVar,
+    Union,
+)
+from urllib import parse
+
+from webmentions import util
+from webmentions.scanner.feed import scan_site_for_feed, link_generator_from_feed, RssItem
+from webmentions.scanner.mention_detector import (
+    CapabilityCheckFailed, fetch_page_check_mention_capabilities, MentionCapabilities, NO_CAPABILITIES,
+    ResolveCapabilities,
+)
+from webmentions.scanner.ledger import SentMentionLedger
+from webmentions.scanner.mention_sender import MentionCandidate
+from webmentions.scanner.scheduler import HostScheduler, RobotsCache
+from webmentions.scanner.site_state import SiteStateStore
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PER_HOST_CONCURRENCY = 2
+# How many feed entries to pull out of the (lazily parsed) feed per trip to the thread pool
+_LISTING_BATCH_SIZE = 32
+
+T = TypeVar('T')
+
+# Returns None when there's nothing to say about an article (e.g. it's unchanged), as opposed to it
+# not having any links.
+FindLinks = Callable[[RssItem], Optional[list[str]]]
+# Lists the site's articles, given its URL and (for incremental scans) what we know about it
+ListArticles = Callable[[str, Optional[SiteStateStore]], Iterator[RssItem]]
+
+
+class TimedOut(NamedTuple):
+    """Something we gave up on because its article's or the scan's time budget ran out"""
+    article_url: str
+    # None if it was the article itself (fetching it and finding its links)
+    link: Optional[str]
+
+
+OnTimeout = Callable[[TimedOut], None]
+
+
+class _ArticleDone(NamedTuple):
+    article_link: RssItem
+    # What to record in the ledger as the article's link set
+    links: Optional[list[str]]
+    # False if some of its lookups timed out, in which case it gets looked at again next time
+    complete: bool = True
+
+
+class Crawler:
+    """
+    Fetches articles and checks their outbound links for mention capabilities concurrently: in a thread
+    pool, because requests blocks, with asyncio scheduling the work and enforcing the concurrency limits.
+    """
+
+    def __init__(
+        self,
+        find_links: FindLinks,
+        resolve_capabilities: ResolveCapabilities = fetch_page_check_mention_capabilities,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        per_host_concurrency: int = DEFAULT_PER_HOST_CONCURRENCY,
+        state: Optional[SiteStateStore] = None,
+        ledger: Optional[SentMentionLedger] = None,
+        list_articles: Optional[ListArticles] = None,
+        scheduler: Optional[HostScheduler] = None,
+        robots: Optional[RobotsCache] = None,
+        article_budget_seconds: Optional[float] = None,
+        scan_budget_seconds: Optional[float] = None,
+        on_timeout: Optional[OnTimeout] = None,
+    ) -> None:
+        """
+        Lookups still going when their article's or the scan's budget runs out go to `on_timeout`, and are
+        left for the next incremental scan.
+        """
+        assert concurrency >= 1
+        assert per_host_concurrency >= 1
+        self._find_links = find_links
+        self._resolve_capabilities = resolve_capabilities
+        self._concurrency = concurrency
+        self._state = state
+        self._ledger = ledger
+        self._list_articles: ListArticles = list_articles or list_feed_articles
+        self._scheduler = scheduler or HostScheduler(concurrency, per_host_concurrency)
+        self._robots = robots
+        self._article_budget_seconds = article_budget_seconds
+        self._scan_budget_seconds = scan_budget_seconds
+        self._on_timeout = on_timeout
+
+    async def generate_webmention_candidates(
+        self, url: str, single_page: bool
+    ) -> AsyncGenerator[MentionCandidate, None]:
+        # Everything here has to be created inside the running loop, so it's per-call state
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._concurrency)
+        run = _Run(self, url, executor)
+        finished = False
+        try:
+            # Articles get going as soon as they come out of the feed, rather than once it's all been read
+            run.spawn(run.list_articles(single_page))
+
+            async for candidate in run.results():
+                yield candidate
+            finished = True
+        finally:
+            await run.cancel()
+            executor.shutdown(wait=True, cancel_futures=True)
+            if self._state is not None:
+                if finished and not run.cut_short:
+                    # Only now is it safe to remember that the homepage and feed haven't changed
+                    run.commit_validators(self._state)
+                else:
+                    # A 304 for the homepage or feed next time would mean never getting back to what we didn't finish
+                    run.discard_validators(self._state)
+
+    def iter_webmention_candidates(self, url: str, single_page: bool) -> Generator[MentionCandidate, None, None]:
+        """Blocking adapter around `generate_webmention_candidates`, for callers that aren't async."""
+        loop = asyncio.new_event_loop()
+        candidates = self.generate_webmention_candidates(url, single_page)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(anext(candidates))
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(candidates.aclose())
+            loop.close()
+
+
+class _Run:
+    """State for a single crawl; lives inside one event loop."""
+
+    def __init__(self, crawler: Crawler, site_url: str, executor: concurrent.futures.Executor) -> None:
+        self._crawler = crawler
+        self._site_url = site_url
+        self._executor = executor
+        self._hosts_linked: set[str] = set()
+        self._crawl_delays: dict[str, asyncio.Future[None]] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._queue: asyncio.Queue[Union[MentionCandidate, _ArticleDone]] = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._error: Optional[BaseException] = None
+        scan_budget_seconds = crawler._scan_budget_seconds
+        self._scan_deadline = time.monotonic() + scan_budget_seconds if scan_budget_seconds is not None else None
+        # Whether anything was left undone for lack of time
+        self.cut_short = False
+        # Articles that have been started but not marked as done
+        self._unfinished_articles: set[str] = set()
+
+    async def in_thread(self, host: str, fn: Callable[..., T], *args: object) -> T:
+        async with self._crawler._scheduler.slot(host):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def find_links(self, article_link: RssItem) -> tuple[Optional[list[str]], Optional[float]]:
+        """The article's links, and the deadline for everything else to do with the article"""
+        async with self._crawler._scheduler.slot(_host_of(article_link.absolute_url)):
+            # The article's budget starts once it's got a slot, not while it's queued up behind the others
+            deadline = self._article_deadline()
+            loop = asyncio.get_running_loop()
+            links = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, self._crawler._find_links, article_link), _time_left(deadline),
+            )
+        return links, deadline
+
+    async def honour_crawl_delay(self, url: str) -> None:
+        """Makes sure the scheduler knows the host's Crawl-delay before anything's fetched from it"""
+        robots = self._crawler._robots
+        host = _host_of(url)
+        if robots is None or not should_look_up_crawl_delay(host, self._site_url, self._hosts_linked):
+            return
+        known = self._crawl_delays.get(host)
+        if known is None:
+            known = self._crawl_delays[host] = asyncio.ensure_future(self._look_up_crawl_delay(robots, host, url))
+        await asyncio.shield(known)
+
+    async def _look_up_crawl_delay(self, robots: RobotsCache, host: str, url: str) -> None:
+        delay = robots.known_crawl_delay(url)
+        if delay is None:
+            delay = await self.in_thread(host, robots.crawl_delay, url)
+        self._crawler._scheduler.set_crawl_delay(host, delay)
+
+    def spawn(self, coro: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        self._idle.clear()
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: 'asyncio.Task[None]') -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None and self._error is None:
+            # Same semantics as the serial scanner: the first failure aborts the crawl
+            self._error = task.exception()
+            self._idle.set()
+        if not self._tasks:
+            self._idle.set()
+
+    async def results(self) -> AsyncIterator[MentionCandidate]:
+        while True:
+            if self._error is not None:
+                raise self._error
+            if self._queue.empty() and self._idle.is_set():
+                return
+            getter = asyncio.ensure_future(self._queue.get())
+            idle = asyncio.ensure_future(self._idle.wait())
+            await asyncio.wait({getter, idle}, return_when=asyncio.FIRST_COMPLETED)
+            idle.cancel()
+            if not getter.done():
+                getter.cancel()
+                continue
+
+            result = getter.result()
+            if isinstance(result, _ArticleDone):
+                # Everything this article produced has been handled by the consumer by now
+                self._article_done(result)
+            else:
+                yield result
+
+    def _article_done(self, done: _ArticleDone) -> None:
+        ledger = self._crawler._ledger
+        if ledger is not None and done.links is not None:
+            ledger.record_link_set(done.article_link.absolute_url, done.links)
+        state = self._crawler._state
+        if done.complete:
+            self._unfinished_articles.discard(done.article_link.absolute_url)
+            if state is not None:
+                state.mark_processed(self._site_url, done.article_link)
+
+    async def cancel(self) -> None:
+        tasks = [*self._tasks, *self._crawl_delays.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def commit_validators(self, state: SiteStateStore) -> None:
+        """
+        Saves the validators staged for the homepage and feed. Just this site's: the store might be
+        shared with crawls of other sites that haven't finished (see `batch`).
+        """
+        for url in (self._site_url, state.feed_url(self._site_url)):
+            if url is not None:
+                state.commit_validators(url)
+
+    def discard_validators(self, state: SiteStateStore) -> None:
+        """Forgets the validators staged for the homepage, the feed and the articles we didn't finish"""
+        for url in (self._site_url, state.feed_url(self._site_url), *self._unfinished_articles):
+            if url is not None:
+                state.discard_validators(url)
+
+    def _timed_out(self, timed_out: TimedOut) -> None:
+        self.cut_short = True
+        print(f'⏱️ Ran out of time for {timed_out.link or "the article"} in {timed_out.article_url}')
+        if self._crawler._on_timeout is not None:
+            self._crawler._on_timeout(timed_out)
+
+    async def list_articles(self, single_page: bool) -> None:
+        host = _host_of(self._site_url)
+        try:
+            articles = await asyncio.wait_for(
+                self.in_thread(
+                    host, _list_articles, self._site_url, single_page, self._crawler._state,
+                    self._crawler._list_articles,
+                ),
+                _time_left(self._scan_deadline),
+            )
+            while batch := await asyncio.wait_for(
+                self.in_thread(host, _take, articles, _LISTING_BATCH_SIZE), _time_left(self._scan_deadline),
+            ):
+                for article_link in batch:
+                    self.spawn(self.process_article(article_link))
+        except asyncio.TimeoutError:
+            self.cut_short = True
+            print(f'⏱️ Ran out of time for {self._site_url}, leaving the rest of its articles for next time')
+
+    def _article_deadline(self) -> Optional[float]:
+        budget_seconds = self._crawler._article_budget_seconds
+        deadlines = [
+            deadline for deadline in (
+                time.monotonic() + budget_seconds if budget_seconds is not None else None,
+                self._scan_deadline,
+            ) if deadline is not None
+        ]
+        return min(deadlines, default=None)
+
+    async def process_article(self, article_link: RssItem) -> None:
+        print(f'checking {article_link}')
+        self._unfinished_articles.add(article_link.absolute_url)
+        try:
+            links, deadline = await asyncio.wait_for(self.find_links(article_link), _time_left(self._scan_deadline))
+        except asyncio.TimeoutError:
+            self._timed_out(TimedOut(article_link.absolute_url, link=None))
+            return
+        to_check = links or []
+        removed: list[str] = []
+        ledger = self._crawler._ledger
+        if ledger is not None and links is not None:
+            diff = ledger.diff_links(article_link.absolute_url, links)
+            to_check = diff.added
+            removed = diff.removed
+
+        lookups = {
+            **{asyncio.ensure_future(self.check_link(article_link, link)): link for link in to_check},
+            **{asyncio.ensure_future(self.check_link(article_link, link, removed=True)): link for link in removed},
+        }
+        if not lookups:
+            await self._queue.put(_ArticleDone(article_link, links))
+            return
+        try:
+            done, pending = await asyncio.wait(
+                lookups, timeout=_time_left(deadline), return_when=asyncio.FIRST_EXCEPTION,
+            )
+        finally:
+            # Including when we're cancelled ourselves, which asyncio.wait doesn't pass on
+            for task in lookups:
+                task.cancel()
+        for task in done:
+            # Passed on to `_task_done`
+            task.result()
+        failed = {lookups[task] for task in done if not task.result()}
+        timed_out = {lookups[task] for task in pending}
+        for link in sorted(timed_out):
+            self._timed_out(TimedOut(article_link.absolute_url, link))
+        unchecked = failed | timed_out
+        if not unchecked:
+            await self._queue.put(_ArticleDone(article_link, links))
+            return
+
+        if links is not None:
+            # Recorded as if the links we didn't get to (or couldn't check) hadn't changed yet, so the ledger
+            # shows them as added (or removed) again next time, and the ones we did check don't get notified twice
+            unfinished = {util.normalize_url(link) for link in unchecked}
+            links = [
+                *(link for link in links if util.normalize_url(link) not in unfinished),
+                *(link for link in removed if link in unchecked),
+            ]
+        await self._queue.put(_ArticleDone(article_link, links, complete=False))
+
+    async def check_link(self, article_link: RssItem, link: str, removed: bool = False) -> bool:
+        """Returns False if the link couldn't be checked this time round"""
+        await self.honour_crawl_delay(link)
+        try:
+            capabilities = await self.in_thread(_host_of(link), self._crawler._resolve_capabilities, link)
+        except CapabilityCheckFailed as e:
+            # TODO(ux): report this probably
+            print(f'⚠️ {e}')
+            return False
+        if removed:
+            capabilities = removed_link_capabilities(capabilities)
+        if capabilities != NO_CAPABILITIES:
+            await self._queue.put(MentionCandidate(
+                mentioner_url=article_link.absolute_url,
+                mentioned_url=link,
+                capabilities=capabilities,
+            ))
+        return True
+
+
+def removed_link_capabilities(capabilities: MentionCapabilities) -> MentionCapabilities:
+    """
+    How to tell a target that a link to it went away. Pingback has no way to, but webmention does (the
+    receiver re-fetches the source and notices the link is gone).
+    """
+    return capabilities._replace(pingback_url=None)
+
+
+def should_look_up_crawl_delay(host: str, source_url: str, hosts_linked: set[str]) -> bool:
+    """
+    Whether a link from `source_url` to `host` needs the host's Crawl-delay before it's fetched, noting in
+    `hosts_linked` that it's been linked to. Our own site is the one place we're allowed to be impatient. And a
+    delay between requests doesn't matter until there's a second one, and most hosts only get linked to once,
+    so don't spend a request on their robots.txt until then.
+    """
+    if host == _host_of(source_url):
+        return False
+    if host not in hosts_linked:
+        hosts_linked.add(host)
+        return False
+    return True
+
+
+def list_feed_articles(url: str, state: Optional[SiteStateStore]) -> Iterator[RssItem]:
+    feed = scan_site_for_feed(url, state)
+    if not feed:
+        # TODO(ux): print error, couldn't find feed
+        return iter([])
+    return link_generator_from_feed(feed)
+
+
+def _list_articles(
+    url: str, single_page: bool, state: Optional[SiteStateStore], list_articles: ListArticles,
+) -> Iterator[RssItem]:
+    if single_page:
+        return iter([RssItem(title='single page', absolute_url=url)])
+
+    articles = list_articles(url, state)
+    if state is not None:
+        articles = (article for article in articles if not state.is_processed(url, article))
+    return articles
+
+
+def _take(items: Iterator[T], n: int) -> list[T]:
+    return list(itertools.islice(items, n))
+
+
+def _host_of(url: str) -> str:
+    return parse.urlparse(url).netloc.lower()
+
+
+def _time_left(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
@@ -1,32 +1,166 @@
 import io
-from typing import Iterable, NamedTuple, Optional
+from typing import Generator, Iterable, Iterator, Mapping, NamedTuple, Optional, TYPE_CHECKING
+from urllib import parse
 
-import bs4
-import feedparser  # type: ignore
-import requests
+from lxml import etree
 
 from webmentions import util
-from webmentions.scanner import request_utils
-from webmentions.scanner.bs4_utils import tag
+from webmentions.scanner import metrics, request_utils
+
+if TYPE_CHECKING:
+    import feedparser  # type: ignore
+
+    from webmentions.scanner.site_state import SiteStateStore
+
+# RFC 5005 paged feeds can go on for a while; this is where we stop following rel="next"
+MAX_FEED_PAGES = 50
+
+_ATOM = '{http://www.w3.org/2005/Atom}'
+_RSS_1 = '{http://purl.org/rss/1.0/}'
+_DUBLIN_CORE = '{http://purl.org/dc/elements/1.1/}'
+_ITEM_TAGS = ('item', f'{_RSS_1}item', f'{_ATOM}entry')
+_FEED_TAGS = ('channel', f'{_ATOM}feed')
 
 
 class Feed(NamedTuple):
     absolute_url: str
-    content: feedparser.FeedParserDict
+    # The feed's first page, or None if it hasn't changed since the last scan
+    body: Optional[bytes]
+    headers: Mapping[str, str] = {}
 
 
 class RssItem(NamedTuple):
     title: str
     absolute_url: str
+    # When the feed says the entry was last changed, verbatim; optional in both RSS and Atom
+    updated: Optional[str] = None
+
+
+def link_generator_from_feed(feed: Feed) -> Iterator[RssItem]:
+    """
+    The feed's entries, parsed as they're asked for: the first one comes out without having to
+    parse the rest. Follows RFC 5005 rel="next" links to later pages (only fetching them once
+    we've got to the end of the page before).
+    """
+    page_url = feed.absolute_url
+    body = feed.body
+    headers = feed.headers
+    seen_pages = {page_url}
+    while body is not None:
+        next_url = yield from metrics.timed_iter(
+            metrics.FEED_PARSE, _items_from_page(page_url, body, headers), page_url,
+        )
+        if next_url is None or next_url in seen_pages or len(seen_pages) >= MAX_FEED_PAGES:
+            return
+        seen_pages.add(next_url)
+        page_url = next_url
+        page = _fetch_feed(page_url, state=None)
+        if page is None:
+            return
+        body = page.body
+        headers = page.headers
+
+
+def _items_from_page(page_url: str, body: bytes, headers: Mapping[str, str]) -> Generator[RssItem, None, Optional[str]]:
+    """Yields the page's items, and returns the URL of the next page, if there is one."""
+    yielded: set[str] = set()
+    try:
+        return (yield from _iterparse_page(page_url, body, yielded))
+    except etree.XMLSyntaxError:
+        # lxml's strict about well-formedness, feedparser isn't. Pick up where we left off.
+        pass
+
+    # don't need HTML sanitisation because we're not sticking it in a website or anything
+    # wrapped in BytesIO because as per docs, untrusted strings can trigger filesystem access (!?)
+    # It is cursed; I do not like it one bit.
+    # the docs say that you can pass a StringIO around a string, but it breaks a regex somewhere in feedparser,
+    # so you have to supply a BytesIO and then pass the response headers through to maximise the chances of getting
+    # the content encoding right. Gross.
+    # TODO(reliability): wrap feedparser to watch out for sharp edges
+    # Only imported for the feeds that need it: it's slow to import, and most feeds parse fine with lxml.
+    import feedparser
+    content = feedparser.parse(io.BytesIO(body), response_headers=headers)
+    for item in _items_from_feedparser(page_url, content):
+        if item.absolute_url not in yielded:
+            yield item
+    next_links = [link.get('href') for link in content.feed.get('links', []) if link.get('rel') == 'next']
+    return parse.urljoin(page_url, next_links[0]) if next_links and next_links[0] else None
+
+
+def _iterparse_page(page_url: str, body: bytes, yielded: set[str]) -> Generator[RssItem, None, Optional[str]]:
+    next_url = None
+    events = etree.iterparse(
+        io.BytesIO(body), events=('end',), tag=(*_ITEM_TAGS, f'{_ATOM}link'),
+        resolve_entities=False, no_network=True, huge_tree=False,
+    )
+    for _, element in events:
+        if element.tag == f'{_ATOM}link':
+            parent = element.getparent()
+            if parent is not None and parent.tag in _FEED_TAGS and element.get('rel') == 'next':
+                href = element.get('href')
+                if href:
+                    next_url = parse.urljoin(page_url, href.strip())
+            continue
+
+        item = _item_from_element(page_url, element)
+        # Entries can be huge (full-content feeds), so don't keep the ones we're done with around
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        if item is not None:
+            yielded.add(item.absolute_url)
+            yield item
+    return next_url
+
+
+def _item_from_element(page_url: str, element: etree._Element) -> Optional[RssItem]:
+    if element.tag == f'{_ATOM}entry':
+        link = None
+        for link_element in element.iterfind(f'{_ATOM}link'):
+            if link_element.get('rel', 'alternate') == 'alternate':
+                link = link_element.get('href')
+                break
+        title_element = element.find(f'{_ATOM}title')
+        # Atom titles can have markup in them
+        title = str(title_element.xpath('string()')) if title_element is not None else None
+        updated = element.findtext(f'{_ATOM}updated') or element.findtext(f'{_ATOM}published')
+    else:
+        ns = _RSS_1 if element.tag == f'{_RSS_1}item' else ''
+        link = element.findtext(f'{ns}link')
+        if not link:
+            # RSS 2.0 lets the guid stand in for the link, if it's a URL
+            guid = element.find('guid')
+            if guid is not None and guid.get('isPermaLink', 'true').lower() != 'false':
+                link = guid.text
+        title = element.findtext(f'{ns}title')
+        updated = (
+            element.findtext(f'{_ATOM}updated') or element.findtext('pubDate')
+            or element.findtext(f'{_DUBLIN_CORE}date')
+        )
+
+    # from RSS spec: link is optional
+    if not link or not link.strip():
+        # Doesn't make sense to handle this if there's no link (we're gonna send a mention based on this link).
+        return None
+    link = parse.urljoin(page_url, link.strip())
+    if not util.is_absolute_link(link):
+        return None
+
+    # from RSS spec: title is optional if description is set
+    # https://www.rssboard.org/rss-draft-1#element-channel-item
+    title = title.strip() if title and title.strip() else link
+    return RssItem(title=title, absolute_url=link, updated=updated.strip() if updated else None)
 
 
-def link_generator_from_feed(feed: Feed) -> Iterable[RssItem]:
-    for item in feed.content.entries:
+def _items_from_feedparser(page_url: str, content: 'feedparser.FeedParserDict') -> Iterable[RssItem]:
+    for item in content.entries:
         # from RSS spec: link is optional
         link = item.get('link')
         if not link:
             # Doesn't make sense to handle this if there's no link (we're gonna send a mention based on this link).
             continue
+        # feedparser only resolves relative links if it knows where the feed came from
+        link = parse.urljoin(page_url, link)
         if not util.is_absolute_link(link):
             # We can probably handle these gracefully eventually, but not yet.
             continue
@@ -36,52 +170,86 @@ def link_generator_from_feed(feed: Feed) -> Iterable[RssItem]:
         title = item.get('title', link)
 
         assert util.is_absolute_link(link)
-        yield RssItem(title=title, absolute_url=link)
+        yield RssItem(title=title, absolute_url=link, updated=item.get('updated') or item.get('published'))
 
 
-def scan_site_for_feed(url: str) -> Optional[Feed]:
-    with request_utils.allow_local_addresses():
-        r = requests.get(url)
-    assert r.ok
-    response = request_utils.WrappedResponse(r)
-    html = response.parsed_html
-    rss_link = tag(html.find('link', attrs={'rel': 'alternate', 'type': 'application/rss+xml'}))
-    atom_link = tag(html.find('link', attrs={'rel': 'alternate', 'type': 'application/atom+xml'}))
-
-    def fetch_feed(link_elem: Optional[bs4.element.Tag]) -> Optional[Feed]:
-        if link_elem is None:
-            return None
+def _conditional_get(
+    url: str, state: Optional['SiteStateStore'], content_class: str,
+) -> request_utils.WrappedResponse:
+    headers = state.validators(url).conditional_headers() if state is not None else {}
+    with metrics.stage(metrics.FEED_FETCH, url) as record:
+        r = request_utils.fetch(url, content_class, headers=headers)
+        record.status = r.status_code
+        record.bytes = len(r.content)
+    if state is not None and r.ok and r.status_code != 304:
+        state.record_validators(url, r.headers)
+    return request_utils.WrappedResponse(r)
+
 
-        hrefs = link_elem.get_attribute_list('href')
-        if not hrefs:
+def _empty_feed(url: str) -> Feed:
+    return Feed(absolute_url=url, body=None)
+
+
+def scan_site_for_feed(url: str, state: Optional['SiteStateStore'] = None) -> Optional[Feed]:
+    """
+    Finds and fetches the site's feed. With a `state`, the homepage and feed are fetched
+    conditionally, and a feed that hasn't changed since last time comes back without any entries.
+    """
+    with request_utils.allow_local_addresses():
+        response = _conditional_get(url, state, request_utils.ARTICLE)
+    assert response.ok
+
+    if response.status_code == 304:
+        known_feed_url = state.feed_url(url) if state is not None else None
+        if known_feed_url is not None:
+            # Homepage hasn't changed, so neither has the feed link
+            return _fetch_feed(known_feed_url, state)
+        # We lost track of the feed somehow, so we need the page after all
+        with request_utils.allow_local_addresses():
+            response = request_utils.WrappedResponse(request_utils.fetch(url, request_utils.ARTICLE))
+        assert response.ok
+
+    document = response.document
+    rss_links = document.rel_hrefs('alternate', ['link'], type='application/rss+xml')
+    atom_links = document.rel_hrefs('alternate', ['link'], type='application/atom+xml')
+
+    def fetch_feed(link_hrefs: list[Optional[str]]) -> Optional[Feed]:
+        if not link_hrefs:
             return None
 
-        resolved_url = response.resolve_url(hrefs[0])
-        r = requests.get(resolved_url)
-        if not r.ok:
-            # TODO(ux): let user know, this is an error in their site or their server is borked or something
-            print("Couldn't find feed")
+        href = link_hrefs[0]
+        if href is None:
             return None
 
-        assert util.is_absolute_link(resolved_url)
-        # don't need HTML sanitisation because we're not sticking it in a website or anything
-        # wrapped in BytesIO because as per docs, untrusted strings can trigger filesystem access (!?)
-        # It is cursed; I do not like it one bit.
-        # the docs say that you can pass a StringIO around a string, but it breaks a regex somewhere in feedparser,
-        # so you have to supply a BytesIO and then pass the response headers through to maximise the chances of getting
-        # the content encoding right. Gross.
-        # TODO(reliability): wrap feedparser to watch out for sharp edges
-        return Feed(
-            absolute_url=resolved_url,
-            content=feedparser.parse(io.BytesIO(r.content), response_headers=r.headers),
-        )
+        resolved_url = response.resolve_url(href)
+        if state is not None:
+            state.save_feed_url(url, resolved_url)
+        return _fetch_feed(resolved_url, state)
 
     # rss has preference, chosen arbitrarily 🤷
-    links = [rss_link, atom_link]
+    links = [rss_links, atom_links]
     candidate_feeds = (fetch_feed(link) for link in links)
-    chosen_feed = next(candidate_feeds)
+    chosen_feed = next((feed for feed in candidate_feeds if feed), None)
     if not chosen_feed:
         # TODO(ux): alert user
         return None
 
     return chosen_feed
+
+
+def _fetch_feed(feed_url: str, state: Optional['SiteStateStore']) -> Optional[Feed]:
+    try:
+        r = _conditional_get(feed_url, state, request_utils.FEED)
+    except request_utils.ResponseTooLarge as e:
+        # TODO(ux): let user know
+        print(f'Feed is too big to read: {e}')
+        return None
+    if r.status_code == 304:
+        return _empty_feed(feed_url)
+    if not r.ok:
+        # TODO(ux): let user know, this is an error in their site or their server is borked or something
+        print("Couldn't find feed")
+        return None
+
+    assert util.is_absolute_link(feed_url)
+    return Feed(absolute_url=feed_url, body=r.content, headers=r.headers)
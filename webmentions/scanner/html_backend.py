@@ -0,0 +1,173 @@
+import abc
+import typing
+from typing import Any, Callable, Optional, Sequence, TYPE_CHECKING
+
+import lxml.html
+from lxml import etree
+
+if TYPE_CHECKING:
+    # bs4 takes longer to import than everything else the scanner needs put together, and only this
+    # backend uses it, so it's imported when something's parsed with it
+    import bs4
+
+SCHEMA_ORG_ARTICLE = 'https://schema.org/Article'
+
+
+class HtmlDocument(abc.ABC):
+    """The handful of questions the scanner asks of an HTML page."""
+
+    @abc.abstractmethod
+    def article_hrefs(self) -> Optional[list[str]]:
+        """
+        The hrefs of all the links in the page's article, in document order, or None if we can't
+        tell which bit of the page is the article. Links without an href are skipped.
+        """
+
+    @abc.abstractmethod
+    def link_hrefs(self) -> list[str]:
+        """The hrefs of all the links anywhere in the page, in document order"""
+
+    @abc.abstractmethod
+    def rel_hrefs(self, rel: str, tags: Sequence[str], type: Optional[str] = None) -> list[Optional[str]]:
+        """
+        The href of every `tags` element whose rel includes `rel` (and whose type is `type`, if
+        given), in document order. The href is None for elements that don't have one.
+        """
+
+
+class Bs4Document(HtmlDocument):
+    def __init__(self, html: 'bs4.BeautifulSoup') -> None:
+        self.html = html
+
+    @classmethod
+    def parse(cls, text: str) -> 'Bs4Document':
+        import bs4
+        return cls(bs4.BeautifulSoup(text, features='lxml'))
+
+    def article_hrefs(self) -> Optional[list[str]]:
+        article_body = find_article(self.html)
+        if article_body is None:
+            return None
+        return [href for link in article_body.find_all('a') if (href := link.get('href'))]
+
+    def link_hrefs(self) -> list[str]:
+        return [href for link in self.html.find_all('a') if (href := link.get('href'))]
+
+    def rel_hrefs(self, rel: str, tags: Sequence[str], type: Optional[str] = None) -> list[Optional[str]]:
+        attrs = {'rel': rel}
+        if type is not None:
+            attrs['type'] = type
+        return [
+            hrefs[0] if (hrefs := element.get_attribute_list('href')) else None
+            for element in self.html.find_all(list(tags), attrs=attrs)
+        ]
+
+
+def _find_article_schema_org(html: 'bs4.BeautifulSoup') -> Optional['bs4.Tag']:
+    from webmentions.scanner.bs4_utils import tag
+    schema_org_article = html.find_all(attrs={'itemtype': SCHEMA_ORG_ARTICLE})
+    if not schema_org_article or len(schema_org_article) > 1:
+        return None
+    article_body = tag(schema_org_article[0].find(attrs={'itemprop': 'articleBody'}))
+    return article_body
+
+
+def _find_article_semantic_html(html: 'bs4.BeautifulSoup') -> Optional['bs4.Tag']:
+    from webmentions.scanner.bs4_utils import tag
+    all_articles = html.find_all('article')
+    if len(all_articles) == 1:
+        return tag(all_articles[0])
+
+    return None
+
+
+def find_article(html: 'bs4.BeautifulSoup') -> Optional['bs4.Tag']:
+    return _find_article_schema_org(html) or _find_article_semantic_html(html)
+
+
+# One pass over the document finds the candidates for both ways of marking up an article
+_ARTICLE_CANDIDATES = etree.XPath('//*[@itemtype=$itemtype] | //article')
+_ARTICLE_BODY = etree.XPath('.//*[@itemprop="articleBody"]')
+_ARTICLE_LINK_HREFS = etree.XPath('.//a/@href')
+_REL_ELEMENTS = etree.XPath(
+    "//*[contains(concat(' ', normalize-space(@rel), ' '), concat(' ', $rel, ' '))]"
+)
+
+
+def _select(xpath: etree.XPath, element: etree._Element, **variables: Any) -> list[Any]:
+    """The XPath result type is a union of everything XPath can return; ours all return node-sets."""
+    return typing.cast(list[Any], xpath(element, **variables))
+
+
+class LxmlDocument(HtmlDocument):
+    def __init__(self, root: Optional[etree._Element]) -> None:
+        self.root = root
+
+    @classmethod
+    def parse(cls, text: str) -> 'LxmlDocument':
+        # lxml refuses str input with an encoding declaration in it, so hand it bytes
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        try:
+            return cls(lxml.html.document_fromstring(text.encode('utf-8'), parser=parser))
+        except etree.ParserError:
+            # Empty document
+            return cls(None)
+
+    def find_article(self) -> Optional[etree._Element]:
+        if self.root is None:
+            return None
+        schema_org_articles: list[etree._Element] = []
+        semantic_articles: list[etree._Element] = []
+        for candidate in _select(_ARTICLE_CANDIDATES, self.root, itemtype=SCHEMA_ORG_ARTICLE):
+            if candidate.get('itemtype') == SCHEMA_ORG_ARTICLE:
+                schema_org_articles.append(candidate)
+            if candidate.tag == 'article':
+                semantic_articles.append(candidate)
+
+        if len(schema_org_articles) == 1:
+            article_bodies: list[etree._Element] = _select(_ARTICLE_BODY, schema_org_articles[0])
+            if article_bodies:
+                return article_bodies[0]
+        if len(semantic_articles) == 1:
+            return semantic_articles[0]
+        return None
+
+    def article_hrefs(self) -> Optional[list[str]]:
+        article_body = self.find_article()
+        if article_body is None:
+            return None
+        return [str(href) for href in _select(_ARTICLE_LINK_HREFS, article_body) if href]
+
+    def link_hrefs(self) -> list[str]:
+        if self.root is None:
+            return []
+        return [str(href) for href in _select(_ARTICLE_LINK_HREFS, self.root) if href]
+
+    def rel_hrefs(self, rel: str, tags: Sequence[str], type: Optional[str] = None) -> list[Optional[str]]:
+        if self.root is None:
+            return []
+        return [
+            element.get('href')
+            for element in _select(_REL_ELEMENTS, self.root, rel=rel)
+            if element.tag in tags and (type is None or element.get('type') == type)
+        ]
+
+
+# lxml is the default because it's a lot cheaper: there's no bs4 tree built on top of lxml's, and the
+# queries are precompiled. bs4 stays around as a fallback, and to check the two against each other.
+BACKENDS: dict[str, Callable[[str], HtmlDocument]] = {
+    'lxml': LxmlDocument.parse,
+    'bs4': Bs4Document.parse,
+}
+_default_backend = 'lxml'
+
+
+def set_default_backend(name: str) -> None:
+    global _default_backend
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown HTML backend {name!r}')
+    _default_backend = name
+
+
+def parse(text: str, backend: Optional[str] = None) -> HtmlDocument:
+    return BACKENDS[backend or _default_backend](text)
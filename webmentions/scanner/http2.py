@@ -0,0 +1,184 @@
+"""
+An HTTP/2 transport for requests, backed by httpx: mounted on a session in place of the usual
+urllib3 adapter (see `request_utils.configure_client`), so that everything upstream still gets a
+`requests.Response`. Requests to the same host are multiplexed over one connection.
+
+httpx is optional; install the `http2` extra to use this.
+"""
+import typing
+from typing import Any, Callable, Iterator, Mapping, Optional, Union
+
+import httpcore
+import httpx
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from webmentions.scanner import content_encoding
+
+# Whether a connection to this (resolved) address can be used; asked before anything's sent over it
+PeerAllowed = Callable[[str], bool]
+
+
+class _GuardedBackend(httpcore.NetworkBackend):
+    """Counts and checks connections as they're opened, like the urllib3 pools in `request_utils` do"""
+
+    def __init__(self, peer_allowed: PeerAllowed, on_connect: Callable[[], None]) -> None:
+        self._backend = httpcore.SyncBackend()
+        self._peer_allowed = peer_allowed
+        self._on_connect = on_connect
+
+    def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[typing.Iterable[httpcore.SOCKET_OPTION]] = None,
+    ) -> httpcore.NetworkStream:
+        self._on_connect()
+        stream = self._backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        peer = stream.get_extra_info('server_addr')
+        peer_ip = peer[0] if peer else ''
+        if not self._peer_allowed(peer_ip):
+            stream.close()
+            raise httpcore.ConnectError(f'Refusing to connect to non-global address {peer_ip}')
+        return stream
+
+    def connect_unix_socket(
+        self,
+        path: str,
+        timeout: Optional[float] = None,
+        socket_options: Optional[typing.Iterable[httpcore.SOCKET_OPTION]] = None,
+    ) -> httpcore.NetworkStream:
+        raise httpcore.ConnectError('Unix sockets are not allowed')
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+
+# How much of a body gets decompressed at a time
+_DECODE_CHUNK_SIZE = 64 * 1024
+
+
+class _StreamedBody:
+    """
+    Enough of urllib3's HTTPResponse for requests to read a body from. The body's decoded here, a chunk at
+    a time (see `content_encoding`), rather than by httpx, which inflates each network read all at once.
+    """
+
+    def __init__(self, response: httpx.Response) -> None:
+        self._response = response
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._buffer = b''
+
+    def read(self, amt: Optional[int] = None, decode_content: bool = True) -> bytes:
+        if self._chunks is None:
+            raw = self._raw_chunks()
+            self._chunks = raw if not decode_content else content_encoding.decoded(
+                raw, self._response.headers.get('Content-Encoding'), _DECODE_CHUNK_SIZE,
+            )
+        if amt is None:
+            data = self._buffer
+            while (chunk := next(self._chunks, None)) is not None:
+                data += chunk
+            self._buffer = b''
+            return data
+        # Hands back whatever the network's given us so far rather than waiting for all of `amt`, so that
+        # whoever's reading can give up between chunks (see `request_utils.iter_body`) on a server that's
+        # trickling bytes, which a read timeout doesn't catch
+        if not self._buffer:
+            self._buffer = next(self._chunks, b'')
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def _raw_chunks(self) -> Iterator[bytes]:
+        try:
+            yield from self._response.iter_raw()
+        except httpx.HTTPError as e:
+            # What requests would have raised for the same thing going wrong in urllib3
+            raise requests.ConnectionError(e) from e
+
+    def stream(self, amt: int = 64 * 1024, decode_content: bool = True) -> Iterator[bytes]:
+        while data := self.read(amt, decode_content):
+            yield data
+
+    def close(self) -> None:
+        self._response.close()
+
+    def release_conn(self) -> None:
+        self._response.close()
+
+
+def _timeout(timeout: Union[None, float, tuple[Optional[float], Optional[float]]]) -> httpx.Timeout:
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+    return httpx.Timeout(timeout)
+
+
+class Http2Adapter(BaseAdapter):
+    """
+    A requests transport adapter that sends everything through one httpx client with HTTP/2 on.
+    Redirects, cookies and the rest of the session machinery stay with requests.
+    """
+
+    def __init__(
+        self,
+        peer_allowed: PeerAllowed,
+        on_connect: Callable[[], None],
+        max_connections: int,
+    ) -> None:
+        super().__init__()
+        transport = httpx.HTTPTransport(
+            http2=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            # Proxies from the environment would get connected to without going through the guard
+            trust_env=False,
+        )
+        # httpx has no way to pass a network backend in, so it goes on the connection pool directly
+        assert isinstance(transport._pool, httpcore.ConnectionPool)
+        transport._pool._network_backend = _GuardedBackend(peer_allowed, on_connect)
+        self._client = httpx.Client(transport=transport, follow_redirects=False, trust_env=False)
+        # Only ask for what we can decode without httpx's help, which isn't necessarily what urllib3 can
+        self._accept_encoding = content_encoding.ACCEPT_ENCODING
+
+    def send(
+        self,
+        request: requests.PreparedRequest,
+        stream: bool = False,
+        timeout: Union[None, float, tuple[Optional[float], Optional[float]]] = None,
+        verify: Union[bool, str] = True,
+        cert: Any = None,
+        proxies: Optional[Mapping[str, str]] = None,
+    ) -> requests.Response:
+        assert request.url is not None and request.method is not None
+        headers = dict(request.headers)
+        headers['Accept-Encoding'] = self._accept_encoding
+        try:
+            httpx_request = self._client.build_request(
+                request.method, request.url, headers=headers, content=request.body,
+                timeout=_timeout(timeout),
+            )
+            httpx_response = self._client.send(httpx_request, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(e, request=request) from e
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            raise requests.ConnectionError(e, request=request) from e
+
+        response = requests.Response()
+        response.status_code = httpx_response.status_code
+        response.reason = httpx_response.reason_phrase
+        # httpx joins repeated headers with commas, same as urllib3 does
+        response.headers = CaseInsensitiveDict(httpx_response.headers.items())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = _StreamedBody(httpx_response)
+        response.url = request.url
+        response.request = request
+        if not stream:
+            response.content
+        return response
+
+    def close(self) -> None:
+        self._client.close()
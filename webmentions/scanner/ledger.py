@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, NamedTuple, Optional
+
+from webmentions import config, util
+from webmentions.scanner.mention_sender import MentionCandidate
+
+DEFAULT_LEDGER_PATH = os.path.join(config.CACHE_DIR, 'ledger.sqlite3')
+
+STATUS_SENT = 'sent'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sends (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sends_by_source_target ON sends (source, target);
+CREATE TABLE IF NOT EXISTS link_sets (
+    source TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    targets TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class LinkSetDiff(NamedTuple):
+    fingerprint: str
+    # Both in the order they appear in the article (added) or were recorded in (removed)
+    added: list[str]
+    removed: list[str]
+    # True if we've seen exactly this set of links for this article before
+    unchanged: bool
+
+
+class SendRecord(NamedTuple):
+    source: str
+    target: str
+    endpoint: str
+    status: str
+    sent_at: float
+
+
+def link_set_fingerprint(links: Iterable[str]) -> str:
+    normalized = sorted({util.normalize_url(link) for link in links})
+    return hashlib.sha256('\n'.join(normalized).encode('utf-8')).hexdigest()
+
+
+class SentMentionLedger:
+    """
+    A durable record of the mentions we've sent, and of the set of links each article had the last
+    time we sent mentions for it.
+
+    That makes sending idempotent: when an article's links haven't changed there's nothing to send,
+    and when they have, only the targets that were added (or removed, so that the receiver can
+    notice) need to hear about it.
+    """
+
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH) -> None:
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+
+    def diff_links(self, source: str, links: list[str]) -> LinkSetDiff:
+        fingerprint = link_set_fingerprint(links)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fingerprint, targets FROM link_sets WHERE source = ?', (source,)
+            ).fetchone()
+        if row is None:
+            return LinkSetDiff(fingerprint=fingerprint, added=_dedupe(links), removed=[], unchanged=False)
+
+        old_fingerprint, old_targets_json = row
+        if old_fingerprint == fingerprint:
+            return LinkSetDiff(fingerprint=fingerprint, added=[], removed=[], unchanged=True)
+
+        old_targets: list[str] = json.loads(old_targets_json)
+        old_normalized = {util.normalize_url(target) for target in old_targets}
+        new_normalized = {util.normalize_url(link) for link in links}
+        return LinkSetDiff(
+            fingerprint=fingerprint,
+            added=[link for link in _dedupe(links) if util.normalize_url(link) not in old_normalized],
+            removed=[target for target in old_targets if util.normalize_url(target) not in new_normalized],
+            unchanged=False,
+        )
+
+    def record_link_set(self, source: str, links: list[str]) -> None:
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO link_sets (source, fingerprint, targets, updated_at) VALUES (?, ?, ?, ?)',
+                (source, link_set_fingerprint(links), json.dumps(_dedupe(links)), time.time()),
+            )
+
+    def update_link_set(self, source: str, added: Iterable[str] = (), removed: Iterable[str] = ()) -> None:
+        """
+        Adds links to (or removes them from) the article's recorded link set, one at a time as they're
+        dealt with, rather than the whole set at once.
+        """
+        removed_normalized = {util.normalize_url(link) for link in removed}
+        with self._lock:
+            # Other processes might be updating the same article's links (see `shard`)
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT targets FROM link_sets WHERE source = ?', (source,)).fetchone()
+                targets: list[str] = json.loads(row[0]) if row is not None else []
+                targets = _dedupe([
+                    *(target for target in targets if util.normalize_url(target) not in removed_normalized),
+                    *added,
+                ])
+                self._db.execute(
+                    'INSERT OR REPLACE INTO link_sets (source, fingerprint, targets, updated_at) VALUES (?, ?, ?, ?)',
+                    (source, link_set_fingerprint(targets), json.dumps(targets), time.time()),
+                )
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def record_send(self, candidate: MentionCandidate, endpoint: str, status: str) -> None:
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO sends (source, target, endpoint, status, sent_at) VALUES (?, ?, ?, ?, ?)',
+                (candidate.mentioner_url, candidate.mentioned_url, endpoint, status, time.time()),
+            )
+
+    def sends(self, source: str, target: Optional[str] = None) -> list[SendRecord]:
+        query = 'SELECT source, target, endpoint, status, sent_at FROM sends WHERE source = ?'
+        params: tuple[str, ...] = (source,)
+        if target is not None:
+            query += ' AND target = ?'
+            params += (target,)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY sent_at', params).fetchall()
+        return [SendRecord(*row) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _dedupe(links: Iterable[str]) -> list[str]:
+    seen = set()
+    deduped = []
+    for link in links:
+        normalized = util.normalize_url(link)
+        if normalized not in seen:
+            seen.add(normalized)
+            deduped.append(link)
+    return deduped
@@ -1,16 +1,33 @@
 import argparse
-from typing import Iterable, NamedTuple, Optional
+import contextlib
+import functools
+from typing import Generator, Iterable, Iterator, NamedTuple, Optional
 from urllib import parse
 
-import bs4
-import requests
-
-from webmentions.scanner import request_utils
-from webmentions.scanner.bs4_utils import tag
-from webmentions.scanner.feed import scan_site_for_feed, link_generator_from_feed, RssItem
-from webmentions.scanner.mention_detector import fetch_page_check_mention_capabilities, NO_CAPABILITIES
-from webmentions.scanner.mention_sender import send_mention, MentionCandidate
+from webmentions.scanner import html_backend, metrics, redirects, request_utils
+from webmentions.scanner.capability_cache import CapabilityCache, DEFAULT_CACHE_PATH, DEFAULT_TTL_SECONDS
+from webmentions.scanner.coalesce import SingleFlight
+from webmentions.scanner.crawler import (
+    Crawler, DEFAULT_CONCURRENCY, DEFAULT_PER_HOST_CONCURRENCY, ListArticles, OnTimeout, TimedOut,
+)
+from webmentions.scanner.feed import RssItem
+from webmentions.scanner.html_backend import find_article  # noqa: F401 (re-exported)
+from webmentions.scanner.mention_detector import (
+    fetch_page_check_mention_capabilities, stream_page_check_mention_capabilities, MentionCapabilities,
+    NO_CAPABILITIES, ResolveCapabilities,
+)
+from webmentions.scanner.ledger import SentMentionLedger, DEFAULT_LEDGER_PATH, STATUS_SENT
+from webmentions.scanner.mention_sender import send_mention, mention_endpoint, MentionCandidate
+from webmentions.scanner.send_queue import (
+    DEFAULT_ENDPOINT_RATE, DEFAULT_MAX_WAIT_SECONDS, DEFAULT_QUEUE_PATH, DEFAULT_SEND_WORKERS, EndpointRateLimiter,
+    OnResult, SendQueue, SendWorkerPool,
+)
+from webmentions.scanner.redirects import DEFAULT_REDIRECTS_PATH, RedirectCache
 from webmentions.scanner.request_utils import WrappedResponse, extra_spooky_monkey_patch_to_block_local_traffic
+from webmentions.scanner.scheduler import HostScheduler, RobotsCache
+from webmentions.scanner.site_state import SiteStateStore, DEFAULT_STATE_PATH
+from webmentions.scanner.sitemap import list_sitemap_articles
+from webmentions.scanner.urls import DEFAULT_SEEN_CAPACITY, BloomSeenSet, already_normalized, intern_url
 from webmentions.util import is_only_fragment
 
 
@@ -19,65 +36,108 @@ class Link(NamedTuple):
     url: str
 
 
-def _find_article_schema_org(html: bs4.BeautifulSoup) -> Optional[bs4.Tag]:
-    schema_org_article = html.find_all(attrs={'itemtype': "https://schema.org/Article"})
-    if not schema_org_article or len(schema_org_article) > 1:
-        return None
-    article_body = tag(schema_org_article[0].find(attrs={'itemprop': 'articleBody'}))
-    return article_body
-
-
-def _find_article_semantic_html(html: bs4.BeautifulSoup) -> Optional[bs4.Tag]:
-    all_articles = html.find_all('article')
-    if len(all_articles) == 1:
-        return tag(all_articles[0])
-
-    return None
-
+def parse_page_find_links(page_link: RssItem, state: Optional[SiteStateStore] = None) -> Iterable[str]:
+    yield from find_article_links(page_link, state) or []
 
-def find_article(html: bs4.BeautifulSoup) -> Optional[bs4.Tag]:
-    return _find_article_schema_org(html) or _find_article_semantic_html(html)
 
-
-def parse_page_find_links(page_link: RssItem) -> Iterable[str]:
+def find_article_links(page_link: RssItem, state: Optional[SiteStateStore] = None) -> Optional[list[str]]:
+    """
+    The outbound links in the article, or None if we've got nothing to say about it: either it's
+    unchanged since we last looked, or we couldn't figure out which bit of the page is the article.
+    """
     parsed_page_link_netloc = parse.urlparse(page_link.absolute_url).netloc
-    with request_utils.allow_local_addresses():
-        r = requests.get(page_link.absolute_url)
+    headers = state.validators(page_link.absolute_url).conditional_headers() if state is not None else {}
+    with request_utils.allow_local_addresses(), metrics.stage(metrics.ARTICLE_FETCH, page_link.absolute_url) as record:
+        try:
+            r = request_utils.fetch(page_link.absolute_url, request_utils.ARTICLE, headers=headers)
+        except request_utils.ResponseTooLarge as e:
+            # TODO(ux): report this probably
+            print(f'Article is too big to read: {e}')
+            return None
+        record.status = r.status_code
+        record.bytes = len(r.content)
     assert r.ok
-    r = WrappedResponse(r)
-    html = bs4.BeautifulSoup(r.text, features="lxml")
-    article_body = find_article(html)
-    if article_body is None:
+    if r.status_code == 304:
+        # Unchanged since the last time we went through it
+        return None
+    if state is not None:
+        state.record_validators(page_link.absolute_url, r.headers)
+    with metrics.stage(metrics.ARTICLE_PARSE):
+        return _article_links(WrappedResponse(r), parsed_page_link_netloc)
+
+
+def _article_links(r: WrappedResponse, page_netloc: str) -> Optional[list[str]]:
+    article_hrefs = r.document.article_hrefs()
+    if article_hrefs is None:
         # TODO(ux): report this probably
         print("Couldn't resolve article")
-        return
+        return None
 
-    for link in article_body.find_all('a'):
+    links = []
+    # Links that don't have an HREF are already gone, because we can't work with them
+    for url in article_hrefs:
         # TODO(ux): filter out nofollow etc
         # TODO(ux): maybe include images?
         # TODO:(reliability): maybe cap these to url MAX_LENGTH?
         #  See eg. https://www.baeldung.com/cs/max-url-length but there's no actual spec'd limit
         #  AFAICT
-        url = link.get('href')
-        if not url:
-            # Can't work with links that don't have an HREF
-            continue
-        if is_only_fragment(url):
+        try:
+            if is_only_fragment(url):
+                continue
+            abs_link = r.resolve_url(url)
+            parsed_abs_link = parse.urlparse(abs_link)
+        except ValueError:
+            # e.g. `http://[::1/`; someone else's typo, nothing to mention
             continue
-        abs_link = r.resolve_url(url)
-        parsed_abs_link = parse.urlparse(abs_link)
         if parsed_abs_link.scheme not in ('http', 'https'):
             continue
-        if parsed_abs_link.netloc == parsed_page_link_netloc:
+        if parsed_abs_link.netloc == page_netloc:
             continue
 
-        yield abs_link
+        links.append(intern_url(abs_link))
+
+    return links
 
 
-def scan(url: str, notify: bool, single_page: bool) -> None:
-    for mentionable in generate_webmention_candidates(url, single_page):
-        if notify:
-            send_mention(mentionable)
+def scan(
+    url: str,
+    notify: bool,
+    single_page: bool,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    cache: Optional[CapabilityCache] = None,
+    full_page_discovery: bool = False,
+    state: Optional[SiteStateStore] = None,
+    ledger: Optional[SentMentionLedger] = None,
+    sender: Optional[SendWorkerPool] = None,
+    list_articles: Optional[ListArticles] = None,
+    robots: Optional[RobotsCache] = None,
+    seen_error_rate: float = 0.0,
+    article_budget_seconds: Optional[float] = None,
+    scan_budget_seconds: Optional[float] = None,
+) -> None:
+    """
+    With a `ledger`, real runs only notify targets that were added to (or removed from) an article.
+    With a `sender`, mentions are queued up while scanning and sent (with retries) afterwards.
+    With a `robots`, linked hosts get the Crawl-delay they ask for. See `build_capability_resolver`
+    for `seen_error_rate`, and `Crawler` for the budgets.
+    """
+    if not notify:
+        # Dry runs mustn't convince the ledger that anything's been sent
+        ledger = None
+
+    resolve_capabilities, single_flight = build_capability_resolver(cache, full_page_discovery, seen_error_rate)
+
+    scheduler = HostScheduler(concurrency, min(concurrency, DEFAULT_PER_HOST_CONCURRENCY))
+    timed_out: list[TimedOut] = []
+    candidates = generate_webmention_candidates(
+        url, single_page, concurrency, resolve_capabilities, state, ledger, list_articles, scheduler, robots,
+        article_budget_seconds, scan_budget_seconds, on_timeout=timed_out.append,
+    )
+    for mentionable in candidates:
+        if notify and sender is not None:
+            sender.queue.enqueue(mentionable)
+        elif notify:
+            send_and_record(mentionable, ledger)
         else:
             webmention_link = mentionable.capabilities.webmention_url
             pingback_link = mentionable.capabilities.pingback_url
@@ -88,28 +148,367 @@ def scan(url: str, notify: bool, single_page: bool) -> None:
             if pingback_link is not None:
                 print(f'🥬 Found a pingback for {mentionable.mentioned_url}! -> "{pingback_link}"')
 
+    if notify and sender is not None:
+        drain_stats = sender.drain()
+        print(
+            f'📬 Sent {drain_stats.sent} mentions, {drain_stats.retried} to retry later, '
+            f'{drain_stats.failed} failed'
+        )
+
+    if timed_out:
+        print(
+            f'⏱️ Ran out of time for {sum(1 for t in timed_out if t.link is not None)} target lookups and '
+            f'{sum(1 for t in timed_out if t.link is None)} articles, which will be looked at again next time'
+        )
+    stats = request_utils.client().stats()
+    print(
+        f'📡 {stats.requests_sent} requests over {stats.connections_opened} connections '
+        f'({stats.connections_reused} reused)'
+    )
+    print(f'♻️ Saved {single_flight.saved} of {single_flight.calls} target lookups')
+    slowest_hosts = sorted(scheduler.stats().items(), key=lambda item: item[1].wait_seconds, reverse=True)
+    for host, host_stats in slowest_hosts[:3]:
+        if host_stats.max_queue_depth <= 1:
+            continue
+        print(
+            f'🚦 {host}: {host_stats.requests} requests, up to {host_stats.max_queue_depth} queued, '
+            f'{host_stats.wait_seconds:.1f}s waiting (crawl-delay {host_stats.crawl_delay:g}s)'
+        )
+    dns_stats = request_utils.resolver_stats()
+    if dns_stats is not None:
+        print(f'🧭 Saved {dns_stats.lookups_saved} of {dns_stats.lookups} DNS lookups')
+    redirect_stats = redirects.stats()
+    if redirect_stats is not None:
+        print(
+            f'↪️ Skipped {redirect_stats.hops_skipped} redirects we knew about, followed '
+            f'{redirect_stats.hops_followed} ({redirect_stats.hops_rejected} remembered ones went somewhere local)'
+        )
+    if cache is not None:
+        cache_stats = cache.stats()
+        print(
+            f'🗃️ Capability cache: {cache_stats.hits} hits, {cache_stats.host_hits} skipped hosts, '
+            f'{cache_stats.misses} misses'
+        )
+
+
+def build_capability_resolver(
+    cache: Optional[CapabilityCache], full_page_discovery: bool = False, seen_error_rate: float = 0.0,
+    seen_capacity: int = DEFAULT_SEEN_CAPACITY,
+) -> tuple[ResolveCapabilities, SingleFlight[MentionCapabilities]]:
+    """
+    With a `seen_error_rate`, targets without any endpoints are only remembered in a Bloom filter,
+    so that many of the targets we've never seen (the error rate) are taken to have no endpoints.
+    """
+    resolve_capabilities: ResolveCapabilities = stream_page_check_mention_capabilities
+    if full_page_discovery:
+        resolve_capabilities = fetch_page_check_mention_capabilities
+    if cache is not None:
+        resolve_capabilities = cache.wrap(resolve_capabilities)
+    # The same link tends to show up in lots of articles, so only look each one up once per run
+    single_flight: SingleFlight[MentionCapabilities] = SingleFlight()
+    if seen_error_rate > 0:
+        # SingleFlight only hands it the URLs it's already normalised
+        seen = BloomSeenSet(seen_error_rate, seen_capacity, normalize=already_normalized)
+        single_flight = SingleFlight(empty=NO_CAPABILITIES, seen=seen)
+    return single_flight.wrap(resolve_capabilities), single_flight
 
-def generate_webmention_candidates(url: str, single_page: bool) -> Iterable[MentionCandidate]:
+
+def send_and_record(mentionable: MentionCandidate, ledger: Optional[SentMentionLedger]) -> None:
+    if ledger is None:
+        send_mention(mentionable)
+        return
+
+    endpoint = mention_endpoint(mentionable)
+    assert endpoint
+    try:
+        send_mention(mentionable)
+    except Exception as e:
+        ledger.record_send(mentionable, endpoint, f'failed: {e!r}')
+        raise
+    ledger.record_send(mentionable, endpoint, STATUS_SENT)
+
+
+def generate_webmention_candidates(
+    url: str,
+    single_page: bool,
+    concurrency: int = 1,
+    resolve_capabilities: ResolveCapabilities = stream_page_check_mention_capabilities,
+    state: Optional[SiteStateStore] = None,
+    ledger: Optional[SentMentionLedger] = None,
+    list_articles: Optional[ListArticles] = None,
+    scheduler: Optional[HostScheduler] = None,
+    robots: Optional[RobotsCache] = None,
+    article_budget_seconds: Optional[float] = None,
+    scan_budget_seconds: Optional[float] = None,
+    on_timeout: Optional[OnTimeout] = None,
+) -> Generator[MentionCandidate, None, None]:
+    """
+    With a `state`, only feed entries that are new or changed since the last scan get checked (and
+    they're marked as done once the consumer has handled their candidates).
+
+    `list_articles` picks where the articles come from; the site's feed, by default. Fetches are
+    shared out between hosts by `scheduler` (a fresh one if not given), which with a `robots` also
+    spaces out requests to hosts that ask for a Crawl-delay.
+
+    With a `ledger`, only links that were added to or removed from an article since its link set
+    was last recorded become candidates, and the new link set is recorded once the consumer has
+    handled them.
+
+    Articles, and the crawl as a whole, can be given time budgets; what doesn't fit in them is
+    passed to `on_timeout` (see `Crawler`).
+    """
     if single_page:
-        articles: Iterable[RssItem] = [RssItem(title='single page', absolute_url=url)]
-    else:
-        feed = scan_site_for_feed(url)
-        if not feed:
-            # TODO(ux): print error, couldn't find feed
-            return
-
-        articles = link_generator_from_feed(feed)
-
-    for article_link in articles:
-        print(f'checking {article_link}')
-        for link in parse_page_find_links(article_link):
-            capabilities = fetch_page_check_mention_capabilities(link)
-            if capabilities != NO_CAPABILITIES:
-                yield MentionCandidate(
-                    mentioner_url=article_link.absolute_url,
-                    mentioned_url=link,
-                    capabilities=capabilities,
-                )
+        # There's no feed to keep track of, and skipping the page the user asked for would be weird
+        state = None
+    # With concurrency=1 this is equivalent to checking every link one after the other
+    crawler = Crawler(
+        find_links=functools.partial(find_article_links, state=state),
+        resolve_capabilities=resolve_capabilities,
+        concurrency=concurrency,
+        per_host_concurrency=min(concurrency, DEFAULT_PER_HOST_CONCURRENCY),
+        state=state,
+        ledger=ledger,
+        list_articles=list_articles,
+        scheduler=scheduler,
+        robots=robots,
+        article_budget_seconds=article_budget_seconds,
+        scan_budget_seconds=scan_budget_seconds,
+        on_timeout=on_timeout,
+    )
+    return crawler.iter_webmention_candidates(url, single_page)
+
+
+class ScanStores(NamedTuple):
+    cache: Optional[CapabilityCache]
+    state: Optional[SiteStateStore]
+    ledger: Optional[SentMentionLedger]
+    send_queue: Optional[SendQueue]
+    redirects: Optional[RedirectCache] = None
+
+
+def add_scan_arguments(parser: argparse.ArgumentParser) -> None:
+    """The options that aren't about which site to scan, shared with the batch entry point"""
+    parser.add_argument('--real', action='store_true')
+    parser.add_argument(
+        '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+        help='Maximum number of pages to fetch at once',
+    )
+    parser.add_argument(
+        '--pool-size', type=int, default=None,
+        help='Maximum number of keep-alive connections per host (defaults to --concurrency times the number of '
+             f'batch workers, or {request_utils.DEFAULT_POOL_MAXSIZE} if that is fewer)',
+    )
+    parser.add_argument(
+        '--http-backend', choices=request_utils.HTTP_BACKENDS, default=request_utils.URLLIB3,
+        help='How to make requests: http2 multiplexes requests to the same host over one connection where the '
+             'server supports it (needs the http2 extra)',
+    )
+    parser.add_argument(
+        '--full-page-discovery', action='store_true',
+        help='Download and parse all of every target page, rather than stopping once the endpoints are found',
+    )
+    parser.add_argument(
+        '--seen-error-rate', type=float, default=0.0,
+        help='Remember which targets (and backfilled pages) have been seen with a Bloom filter with this '
+             'false-positive rate, rather than exactly, to save memory on huge scans',
+    )
+    parser.add_argument(
+        '--ignore-crawl-delay', action='store_true',
+        help="Don't fetch linked sites' robots.txt to find out how long to wait between requests to them",
+    )
+    parser.add_argument(
+        '--html-backend', choices=sorted(html_backend.BACKENDS), default='lxml',
+        help='Which HTML parser to use',
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='Only check feed entries that are new or changed since the last incremental scan',
+    )
+    parser.add_argument('--state-path', default=DEFAULT_STATE_PATH, help='Where to keep track of incremental scans')
+    parser.add_argument(
+        '--backfill', action='store_true',
+        help="Check every article in the site's sitemaps, not just the feed. Implies --incremental, so an "
+             'interrupted backfill picks up where it left off when run again',
+    )
+    parser.add_argument(
+        '--full-rescan', action='store_true',
+        help='Forget what previous incremental scans saw of the site first',
+    )
+    parser.add_argument(
+        '--ledger-path', default=DEFAULT_LEDGER_PATH,
+        help='Where to record sent mentions, so that --real runs only notify targets that changed',
+    )
+    parser.add_argument('--no-ledger', action='store_true', help='Notify every target, even if it has been before')
+    parser.add_argument('--queue-path', default=DEFAULT_QUEUE_PATH, help='Where to queue mentions that need sending')
+    parser.add_argument(
+        '--no-queue', action='store_true',
+        help='Send each mention as soon as it is found, without retries',
+    )
+    parser.add_argument(
+        '--send-workers', type=int, default=DEFAULT_SEND_WORKERS, help='How many mentions to send at once',
+    )
+    parser.add_argument(
+        '--endpoint-rate', type=float, default=DEFAULT_ENDPOINT_RATE,
+        help='Maximum mentions per second to any one receiver',
+    )
+    parser.add_argument(
+        '--drain-wait', type=float, default=DEFAULT_MAX_WAIT_SECONDS,
+        help='How many seconds to wait around for retries before leaving them for the next run',
+    )
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH, help='Where to keep the capability cache')
+    parser.add_argument(
+        '--cache-ttl-days', type=float, default=DEFAULT_TTL_SECONDS / (24 * 60 * 60),
+        help='How long cached capabilities stay valid',
+    )
+    parser.add_argument('--no-cache', action='store_true', help="Don't read or write the capability cache")
+    parser.add_argument(
+        '--purge-cache', action='store_true', help='Empty the capability and redirect caches before scanning',
+    )
+    parser.add_argument(
+        '--redirect-cache-path', default=DEFAULT_REDIRECTS_PATH,
+        help='Where to remember where redirects go, so that later scans can skip them',
+    )
+    parser.add_argument('--no-redirect-cache', action='store_true', help='Follow every redirect every time')
+    parser.add_argument(
+        '--max-feed-bytes', type=int, default=request_utils.DEFAULT_BYTE_CAPS[request_utils.FEED],
+        help='Give up on feeds bigger than this (after decompression)',
+    )
+    parser.add_argument(
+        '--max-article-bytes', type=int, default=request_utils.DEFAULT_BYTE_CAPS[request_utils.ARTICLE],
+        help='Give up on articles bigger than this (after decompression)',
+    )
+    parser.add_argument(
+        '--max-target-page-bytes', type=int, default=request_utils.DEFAULT_BYTE_CAPS[request_utils.TARGET_PAGE],
+        help='Give up on linked pages bigger than this (after decompression)',
+    )
+    parser.add_argument(
+        '--connect-timeout', type=float, default=request_utils.DEFAULT_TIMEOUTS.connect_seconds,
+        help='Seconds to wait for a connection to open',
+    )
+    parser.add_argument(
+        '--read-timeout', type=float, default=request_utils.DEFAULT_TIMEOUTS.read_seconds,
+        help='Seconds to wait for a server to send anything',
+    )
+    parser.add_argument(
+        '--request-deadline', type=float, default=request_utils.DEFAULT_TIMEOUTS.deadline_seconds,
+        help='Give up on any request that takes longer than this many seconds all told, however steadily the '
+             'server is trickling out its response',
+    )
+    parser.add_argument(
+        '--article-budget', type=float, default=None,
+        help='Seconds to spend on each article, including looking up all of its links; the lookups still '
+             'outstanding are reported as timed out and retried by the next incremental scan',
+    )
+    parser.add_argument(
+        '--scan-budget', type=float, default=None,
+        help='Seconds to spend scanning a site, after which no more articles are started and the lookups still '
+             'outstanding are reported as timed out',
+    )
+    parser.add_argument('--metrics-json', help='Write per-stage timings and counts here as JSON at the end of the run')
+    parser.add_argument(
+        '--metrics-textfile',
+        help="Write per-stage timings and counts here for Prometheus (node_exporter's textfile collector)",
+    )
+
+
+def configure_from_args(args: argparse.Namespace, workers: int = 1) -> None:
+    html_backend.set_default_backend(args.html_backend)
+    request_utils.set_byte_cap(request_utils.FEED, args.max_feed_bytes)
+    request_utils.set_byte_cap(request_utils.ARTICLE, args.max_article_bytes)
+    request_utils.set_byte_cap(request_utils.TARGET_PAGE, args.max_target_page_bytes)
+    request_utils.set_timeouts(request_utils.Timeouts(
+        connect_seconds=args.connect_timeout, read_seconds=args.read_timeout, deadline_seconds=args.request_deadline,
+    ))
+    request_utils.configure_client(
+        pool_maxsize=args.pool_size or max(args.concurrency * workers, request_utils.DEFAULT_POOL_MAXSIZE),
+        backend=args.http_backend,
+    )
+
+
+@contextlib.contextmanager
+def collect_metrics(args: argparse.Namespace) -> Iterator[None]:
+    """Collects metrics for the duration if they were asked for, and writes them out at the end."""
+    if not args.metrics_json and not args.metrics_textfile:
+        yield
+        return
+
+    collected = metrics.enable()
+    try:
+        yield
+    finally:
+        metrics.disable()
+        if args.metrics_json:
+            collected.write_json(args.metrics_json)
+        if args.metrics_textfile:
+            collected.write_prometheus(args.metrics_textfile)
+
+
+@contextlib.contextmanager
+def open_stores(args: argparse.Namespace) -> Iterator[ScanStores]:
+    cache = None
+    if not args.no_cache:
+        cache = CapabilityCache(args.cache_path, ttl_seconds=args.cache_ttl_days * 24 * 60 * 60)
+        if args.purge_cache:
+            cache.purge()
+
+    state = None
+    if args.incremental or args.backfill:
+        state = SiteStateStore(args.state_path)
+
+    ledger = None
+    if args.real and not args.no_ledger:
+        ledger = SentMentionLedger(args.ledger_path)
+
+    send_queue = None
+    if args.real and not args.no_queue:
+        send_queue = SendQueue(args.queue_path)
+
+    redirect_cache = None
+    if not args.no_redirect_cache:
+        redirect_cache = RedirectCache(args.redirect_cache_path)
+        if args.purge_cache:
+            redirect_cache.purge()
+        redirects.set_cache(redirect_cache)
+
+    try:
+        yield ScanStores(cache=cache, state=state, ledger=ledger, send_queue=send_queue, redirects=redirect_cache)
+    finally:
+        if redirect_cache is not None:
+            redirects.set_cache(None)
+            redirect_cache.close()
+        if send_queue is not None:
+            send_queue.close()
+        if ledger is not None:
+            ledger.close()
+        if cache is not None:
+            cache.close()
+        if state is not None:
+            state.close()
+
+
+def article_lister(args: argparse.Namespace) -> Optional[ListArticles]:
+    if not args.backfill:
+        return None
+    return functools.partial(list_sitemap_articles, seen_error_rate=args.seen_error_rate)
+
+
+def build_robots(args: argparse.Namespace) -> Optional[RobotsCache]:
+    return None if args.ignore_crawl_delay else RobotsCache()
+
+
+def build_sender(
+    args: argparse.Namespace, stores: ScanStores, on_result: Optional[OnResult] = None
+) -> Optional[SendWorkerPool]:
+    if stores.send_queue is None:
+        return None
+    return SendWorkerPool(
+        stores.send_queue,
+        workers=args.send_workers,
+        rate_limiter=EndpointRateLimiter(rate=args.endpoint_rate),
+        ledger=stores.ledger,
+        on_result=on_result,
+        max_wait_seconds=args.drain_wait,
+    )
 
 
 def main() -> None:
@@ -121,11 +520,29 @@ def main() -> None:
         epilog='Text at the bottom of help'
     )
     parser.add_argument('--url', required=True)
-    parser.add_argument('--real', action='store_true')
     parser.add_argument('--single-page', action='store_true')
+    add_scan_arguments(parser)
     args = parser.parse_args()
 
-    scan(args.url, args.real, args.single_page)
+    configure_from_args(args)
+    with collect_metrics(args), open_stores(args) as stores:
+        if stores.state is not None and args.full_rescan:
+            stores.state.forget_site(args.url)
+        if args.backfill and stores.state is not None:
+            done = stores.state.processed_count(args.url)
+            if done:
+                print(f'⏩ Resuming backfill: {done} articles already done')
+        try:
+            scan(
+                args.url, args.real, args.single_page, args.concurrency, stores.cache, args.full_page_discovery,
+                stores.state, stores.ledger, build_sender(args, stores), article_lister(args), build_robots(args),
+                args.seen_error_rate, args.article_budget, args.scan_budget,
+            )
+        except KeyboardInterrupt:
+            if not args.backfill:
+                raise
+            # Every article that's finished has already been recorded, so there's nothing to save
+            print('⏸️ Backfill interrupted; run the same command again to carry on')
 
 
 if __name__ == '__main__':
@@ -1,11 +1,12 @@
-from typing import NamedTuple, Optional
+from typing import Callable, NamedTuple, Optional
 
 import requests
+from lxml import etree
 
-from webmentions import config, util
-from webmentions.scanner import request_utils
-from webmentions.scanner.bs4_utils import tag
+from webmentions import util
+from webmentions.scanner import metrics, redirects, request_utils
 from webmentions.scanner.request_utils import WrappedResponse
+from webmentions.scanner.urls import intern_url
 
 
 class MentionCapabilities(NamedTuple):
@@ -15,8 +16,55 @@ class MentionCapabilities(NamedTuple):
 
 NO_CAPABILITIES = MentionCapabilities(webmention_url=None, pingback_url=None)
 
+# Anything that can take a target URL and figure out how to notify it. Raises `CapabilityCheckFailed` if it
+# couldn't find out, as opposed to finding out that there's no way to.
+ResolveCapabilities = Callable[[str], MentionCapabilities]
 
-def _resolve_webmention_url(response: WrappedResponse) -> Optional[str]:
+
+class CapabilityCheckFailed(IOError):
+    """The target couldn't be checked this time (it's down, slow, rate limiting us...); worth trying again later"""
+
+    def __init__(self, url: str, reason: str) -> None:
+        super().__init__(f"Couldn't check {url}: {reason}")
+        self.url = url
+
+
+# Statuses that say something about the server right now, rather than about the page
+_TRANSIENT_STATUS_CODES = frozenset({408, 425, 429})
+# Requests that are never going to work, however many times they're tried
+_PERMANENT_ERRORS = (
+    request_utils.ResponseTooLarge, requests.TooManyRedirects, requests.exceptions.InvalidURL,
+    requests.exceptions.InvalidSchema, requests.exceptions.MissingSchema,
+)
+
+
+def _check_status(url: str, status_code: int) -> None:
+    if status_code >= 500 or status_code in _TRANSIENT_STATUS_CODES:
+        raise CapabilityCheckFailed(url, f'status {status_code}')
+
+
+def _check_error(url: str, e: IOError) -> None:
+    """Raises `CapabilityCheckFailed` unless `e` means there's no point trying again"""
+    if isinstance(e, _PERMANENT_ERRORS):
+        return
+    if isinstance(e, requests.ConnectionError) and request_utils.is_rejected_destination(url):
+        # The local-traffic guard turned us away, and it will next time too. A host that didn't resolve
+        # at all might next time, so that isn't one of these
+        return
+    raise CapabilityCheckFailed(url, repr(e)) from e
+
+
+def _capabilities(webmention_url: Optional[str], pingback_url: Optional[str]) -> MentionCapabilities:
+    # Lots of targets share an endpoint (a whole site, or a hosted service), and most have none at all
+    if webmention_url is None and pingback_url is None:
+        return NO_CAPABILITIES
+    return MentionCapabilities(
+        webmention_url=intern_url(webmention_url) if webmention_url is not None else None,
+        pingback_url=intern_url(pingback_url) if pingback_url is not None else None,
+    )
+
+
+def _resolve_webmention_url_from_headers(response: WrappedResponse) -> Optional[str]:
     webmention_header = response.links.get('webmention')
     if webmention_header:
         webmention_url = webmention_header.get('url')
@@ -29,35 +77,48 @@ def _resolve_webmention_url(response: WrappedResponse) -> Optional[str]:
             if 'webmention' in k.split():
                 return response.resolve_url(v.get('url'))
 
+    return None
+
+
+def _resolve_webmention_url(response: WrappedResponse) -> Optional[str]:
+    header_url = _resolve_webmention_url_from_headers(response)
+    if header_url is not None:
+        return header_url
+
     # TODO(spec): theoretically this only applies if the Content-Type is html
-    webmention_links = response.parsed_html.find_all(['link', 'a'], attrs={'rel': 'webmention'})
+    webmention_hrefs = response.document.rel_hrefs('webmention', ['link', 'a'])
     # href not present = invalid, href present but blank = valid and self
-    for maybe_link in webmention_links:
-        if maybe_link.has_attr('href'):
+    for href in webmention_hrefs:
+        if href is not None:
             # The URL is relative, so we've gotta make it absolute
-            return response.resolve_url(maybe_link['href'])
+            return response.resolve_url(href)
 
     return None
 
 
-def _resolve_pingback_url(response: WrappedResponse) -> Optional[str]:
+def _resolve_pingback_url_from_headers(response: WrappedResponse) -> Optional[str]:
     # absolute link by definition
     header_url = response.headers.get('X-Pingback')
     if header_url:
         assert util.is_absolute_link(header_url)
         return header_url
 
+    return None
+
+
+def _resolve_pingback_url(response: WrappedResponse) -> Optional[str]:
+    header_url = _resolve_pingback_url_from_headers(response)
+    if header_url is not None:
+        return header_url
+
     # wtf the spec here is _draconian_ and also requires the parsing of HTML with regex.
     # I will ignore it for simplicity
     # http://www.hixie.ch/specs/pingback/pingback
     # TODO(spec): make this spec-compliant
-    html_link_element = response.parsed_html.find(['link'], attrs={'rel': 'pingback'})
-    html_link_element = tag(html_link_element)
-    if html_link_element:
-        hrefs = html_link_element.get_attribute_list('href')
-        if hrefs:
-            # could be specified multiple times, pick the first
-            return hrefs[0]
+    # could be specified multiple times, pick the first
+    html_link_hrefs = response.document.rel_hrefs('pingback', ['link'])
+    if html_link_hrefs:
+        return html_link_hrefs[0]
 
     return None
 
@@ -65,23 +126,130 @@ def _resolve_pingback_url(response: WrappedResponse) -> Optional[str]:
 def fetch_page_check_mention_capabilities(url: str) -> MentionCapabilities:
     # TODO(ux): warn that this is a page we couldn't load if we can't load it
     try:
-        # Note that this follows redirects by default
-        # See https://requests.readthedocs.io/en/latest/user/quickstart/#redirection-and-history
-        r = requests.get(url, headers={'User-Agent': config.USER_AGENT})
+        # Note that this follows redirects (skipping the ones we've seen before, see `redirects`)
+        with metrics.stage(metrics.CAPABILITY_FETCH, url) as record:
+            r = redirects.fetch(url, request_utils.TARGET_PAGE)
+            record.status = r.status_code
+            record.bytes = len(r.content)
         if not r.ok:
             print('not ok:', r.status_code, r.text[:1000])
+            _check_status(url, r.status_code)
             return NO_CAPABILITIES
+    except CapabilityCheckFailed:
+        raise
     except IOError as e:
         print('not ok:', e)
+        _check_error(url, e)
         return NO_CAPABILITIES
 
     assert r.ok
 
     response = request_utils.WrappedResponse(r)
-    webmention_link = _resolve_webmention_url(response)
-    pingback_link = _resolve_pingback_url(response)
+    with metrics.stage(metrics.CAPABILITY_PARSE):
+        webmention_link = _resolve_webmention_url(response)
+        pingback_link = _resolve_pingback_url(response)
 
-    return MentionCapabilities(
-        webmention_url=webmention_link,
-        pingback_url=pingback_link,
-    )
+    return _capabilities(webmention_link, pingback_link)
+
+
+# How far into the body we'll keep looking for a webmention <a> once we're past the <head>
+DEFAULT_DISCOVERY_BYTE_CAP = 256 * 1024
+_DISCOVERY_CHUNK_SIZE = 16 * 1024
+_HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+
+def stream_page_check_mention_capabilities(
+    url: str, byte_cap: int = DEFAULT_DISCOVERY_BYTE_CAP
+) -> MentionCapabilities:
+    """
+    Like `fetch_page_check_mention_capabilities`, but reads as little of the target as possible:
+    it stops after the headers if they advertise a webmention endpoint, doesn't read non-HTML bodies
+    at all, and otherwise streams the HTML and stops at the end of the <head> (or, if the endpoint
+    isn't in there, at the first webmention link in the body, or after `byte_cap` bytes).
+    """
+    # TODO(ux): warn that this is a page we couldn't load if we can't load it
+    try:
+        with metrics.stage(metrics.CAPABILITY_FETCH, url) as record:
+            r = redirects.get(url, stream=True)
+            record.status = r.status_code
+        with r:
+            if not r.ok:
+                print('not ok:', r.status_code)
+                _check_status(url, r.status_code)
+                return NO_CAPABILITIES
+
+            response = request_utils.WrappedResponse(r)
+            webmention_link = _resolve_webmention_url_from_headers(response)
+            pingback_link = _resolve_pingback_url_from_headers(response)
+            if webmention_link is not None or not _is_html(response):
+                return _capabilities(webmention_link, pingback_link)
+
+            with metrics.stage(metrics.CAPABILITY_PARSE) as record:
+                html_webmention_href, html_pingback_href = _scan_html_stream(response, byte_cap, record)
+    except CapabilityCheckFailed:
+        raise
+    except IOError as e:
+        print('not ok:', e)
+        _check_error(url, e)
+        return NO_CAPABILITIES
+
+    if html_webmention_href is not None:
+        # The URL is relative, so we've gotta make it absolute
+        webmention_link = response.resolve_url(html_webmention_href)
+    return _capabilities(webmention_link, pingback_link or html_pingback_href)
+
+
+def _is_html(response: WrappedResponse) -> bool:
+    content_type = response.headers.get('Content-Type')
+    if not content_type:
+        # Plenty of servers don't bother, so give it the benefit of the doubt
+        return True
+    return content_type.split(';')[0].strip().lower() in _HTML_CONTENT_TYPES
+
+
+def _scan_html_stream(
+    response: WrappedResponse, byte_cap: int, record: metrics.StageRecord,
+) -> tuple[Optional[str], Optional[str]]:
+    """Returns the hrefs of the first webmention and pingback links, as written in the document."""
+    content_type = response.headers.get('Content-Type', '')
+    # requests makes up an encoding if there isn't one in the header; lxml does better on its own
+    encoding = response.encoding if 'charset' in content_type.lower() else None
+    parser = etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+
+    webmention_href: Optional[str] = None
+    pingback_href: Optional[str] = None
+    past_head = False
+    bytes_read = 0
+    for chunk in request_utils.iter_body(response, _DISCOVERY_CHUNK_SIZE):
+        bytes_read += len(chunk)
+        record.bytes += len(chunk)
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if not isinstance(element, etree._Element):
+                # Only namespace events give you anything else, and we didn't ask for those
+                continue
+            if event == 'end':
+                if element.tag == 'head':
+                    past_head = True
+                    if webmention_href is not None:
+                        return webmention_href, pingback_href
+                continue
+
+            if element.tag not in ('link', 'a'):
+                continue
+            rels = (element.get('rel') or '').split()
+            href = element.get('href')
+            # href not present = invalid, href present but blank = valid and self
+            if href is None:
+                continue
+            if webmention_href is None and 'webmention' in rels:
+                webmention_href = href
+                if past_head:
+                    return webmention_href, pingback_href
+            if pingback_href is None and element.tag == 'link' and 'pingback' in rels:
+                pingback_href = href
+
+        if bytes_read >= byte_cap:
+            break
+
+    return webmention_href, pingback_href
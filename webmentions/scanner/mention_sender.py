@@ -1,11 +1,8 @@
-from typing import NamedTuple, Optional, NoReturn
+from typing import NamedTuple, Optional
 
-import bs4
 import requests
-from lxml import etree
 
-from webmentions.scanner import request_utils
-from webmentions.scanner.bs4_utils import tag
+from webmentions.scanner import metrics, request_utils
 from webmentions.scanner.mention_detector import MentionCapabilities
 
 
@@ -26,16 +23,22 @@ def _send_webmention(mention_candidate: MentionCandidate) -> None:
         'target': mention_candidate.mentioned_url,
     }
     # Pretty sure this is form-encoded by default
-    # TODO(reliability): timeouts etc
+    # Timeouts come from the shared client (see `request_utils.set_timeouts`)
     # - https://docs.gitlab.com/ee/security/webhooks.html
 
-    # TODO(reliability): set user agent?
-    r = requests.post(webmention_url, data=data)
+    with metrics.stage(metrics.WEBMENTION_SEND, webmention_url) as record:
+        r = request_utils.post(webmention_url, data=data)
+        record.status = r.status_code
+        record.bytes = len(r.content)
     # according to spec, can return a 202 or 201
     # https://www.w3.org/TR/webmention/#sender-notifies-receiver
     # product idea: could maybe eventually use 201s as 'read receipts'
-    # TODO(ux): handle not-ok, report it back to the user.
-    assert r.ok
+    _raise_for_status(webmention_url, r)
+
+
+def mention_endpoint(mention_candidate: MentionCandidate) -> Optional[str]:
+    """The endpoint that `send_mention` will notify"""
+    return mention_candidate.capabilities.webmention_url or mention_candidate.capabilities.pingback_url
 
 
 def send_mention(mention_candidate: MentionCandidate) -> None:
@@ -46,65 +49,51 @@ def send_mention(mention_candidate: MentionCandidate) -> None:
 
 
 def _send_pingback(mention_candidate: MentionCandidate) -> None:
+    # Only pingbacks need the XML-RPC machinery, so dry runs and webmentions don't import it
+    from webmentions.scanner import xmlrpc
+
     pingback_url = mention_candidate.capabilities.pingback_url
     assert pingback_url
 
     xml = _build_pingback_xml(mention_candidate)
-    # TODO(reliability): set user agent?
-    r = requests.post(pingback_url, data=xml, headers={'Content-Type': 'text/xml'})
-
-    # TODO(ux): handle not-ok, report it back to the user.
-    assert r.ok
-    print(r.text)
-    r = request_utils.WrappedResponse(r)
-    fault_struct = r.parsed_xml.select('methodResponse>fault>value>struct')
-    if fault_struct:
-        # there should be at most one fault_struct
-        _handle_fault(fault_struct[0])
+    with metrics.stage(metrics.PINGBACK_SEND, pingback_url) as record, request_utils.post(
+        pingback_url, data=xml.encode('utf-8'), headers={'Content-Type': 'text/xml'}, stream=True,
+    ) as r:
+        record.status = r.status_code
+        _raise_for_status(pingback_url, r)
+        try:
+            body = request_utils.read_body(r, xmlrpc.DEFAULT_MAX_RESPONSE_BYTES)
+        except request_utils.ResponseTooLarge as e:
+            raise INDETERMINATE_ERROR from e
+        record.bytes = len(body)
+
+    try:
+        response = xmlrpc.decode_response(body)
+    except xmlrpc.MalformedResponse as e:
+        raise INDETERMINATE_ERROR from e
+    if isinstance(response, xmlrpc.Fault):
+        raise RemoteError(response.code, response.message)
 
     # optional return value, used for debug
-    result = r.parsed_xml.select('methodResponse>params>param:first-child>value>string')
-    if result:
+    if response.value:
         # log result? this is optional though
-        print(result[0].text or '')
+        print(response.value)
 
 
-def _handle_fault(fault_struct: bs4.Tag) -> NoReturn:
-    members = fault_struct.find_all('member')
-    if not members:
-        raise INDETERMINATE_ERROR
+def _raise_for_status(endpoint: str, r: requests.Response) -> None:
+    if not r.ok:
+        raise SendError(endpoint, r.status_code, r.headers.get('Retry-After'))
 
-    def member_matches(member: bs4.Tag, name: str) -> bool:
-        member_name = member.find('name')
-        return bool(member_name and member_name.text == name)
 
-    fault_code = next(member for member in members if member_matches(member, 'faultCode'))
-    fault_string = next(member for member in members if member_matches(member, 'faultString'))
-    print(fault_code)
-    print(fault_string)
+class SendError(Exception):
+    """The receiver didn't accept the mention at the HTTP level"""
 
-    def _safe_navigate(member: Optional[bs4.Tag], *path: str) -> Optional[str]:
-        """Grabs a value"""
-        for p in path:
-            if not member:
-                return None
-            member = tag(member.find(p))
-
-        if not member:
-            return None
-
-        return member.text
-
-    fault_code = _safe_navigate(fault_code, 'value', 'int')
-    try:
-        fault_code = int(fault_code)
-    except ValueError:
-        fault_code = None
-    fault_string = _safe_navigate(fault_string, 'value', 'string')
-    if fault_code is not None and fault_string is not None:
-        raise RemoteError(fault_code, fault_string)
-    else:
-        raise INDETERMINATE_ERROR
+    def __init__(self, endpoint: str, status_code: int, retry_after: Optional[str] = None) -> None:
+        super().__init__(f'{endpoint} returned HTTP {status_code}')
+        self.endpoint = endpoint
+        self.status_code = status_code
+        # Verbatim from the header: either a number of seconds or an HTTP date
+        self.retry_after = retry_after
 
 
 class RemoteError(Exception):
@@ -123,31 +112,5 @@ def _build_pingback_xml(mention_candidate: MentionCandidate) -> str:
     """Totally fine for this to return a string because the document will
     probably be tiny.
     """
-    source_uri = mention_candidate.mentioner_url
-    target_uri = mention_candidate.mentioned_url
-
-    method_call = etree.Element('methodCall')
-    method_name = etree.Element('methodName')
-    method_name.text = 'pingback.ping'
-    method_call.append(method_name)
-
-    params = etree.Element('params')
-    method_call.append(params)
-    source_param = _build_param(source_uri)
-    params.append(source_param)
-    target_param = _build_param(target_uri)
-    params.append(target_param)
-    xml_tree = etree.ElementTree(method_call)
-    return etree.tostring(
-        xml_tree, pretty_print=True, xml_declaration=True, encoding="utf-8"
-    ).decode('utf-8')
-
-
-def _build_param(value_abs_url: str) -> etree._Element:
-    source_param = etree.Element('param')
-    value = etree.Element('value')
-    str_value = etree.Element('string')
-    str_value.text = value_abs_url
-    value.append(str_value)
-    source_param.append(value)
-    return source_param
+    from webmentions.scanner import xmlrpc
+    return xmlrpc.encode_pingback_request(mention_candidate.mentioner_url, mention_candidate.mentioned_url)
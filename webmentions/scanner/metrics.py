@@ -0,0 +1,315 @@
+"""
+Timing and counting for each stage of the scanner, exported as JSON or as a Prometheus textfile
+(for node_exporter's textfile collector) at the end of a run.
+
+Metrics are off unless `enable` has been called; until then `stage` hands out a shared no-op, so
+leaving the hooks in costs about as much as a function call.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from types import TracebackType
+from typing import Any, Generator, Optional, Type, TypeVar, Union
+from urllib import parse
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+FEED_FETCH = 'feed_fetch'
+FEED_PARSE = 'feed_parse'
+ARTICLE_FETCH = 'article_fetch'
+ARTICLE_PARSE = 'article_parse'
+CAPABILITY_FETCH = 'capability_fetch'
+CAPABILITY_PARSE = 'capability_parse'
+WEBMENTION_SEND = 'webmention_send'
+PINGBACK_SEND = 'pingback_send'
+
+STAGES = (
+    FEED_FETCH, FEED_PARSE, ARTICLE_FETCH, ARTICLE_PARSE, CAPABILITY_FETCH, CAPABILITY_PARSE, WEBMENTION_SEND,
+    PINGBACK_SEND,
+)
+
+# Upper bounds, in seconds; the same as the Prometheus client's defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# Hosts are unbounded, which Prometheus doesn't like, so only the slowest make it into the textfile
+PROMETHEUS_MAX_HOSTS = 100
+
+
+class StageRecord:
+    """What the code inside a `stage` block knows about it: how much it transferred, and the status."""
+
+    __slots__ = ('bytes', 'status')
+
+    def __init__(self) -> None:
+        self.bytes = 0
+        self.status: Optional[int] = None
+
+
+class _NullRecord(StageRecord):
+    """Forgets everything it's told, so one instance can be shared by everyone while metrics are off."""
+
+    __slots__ = ()
+
+    def __init__(self) -> None:
+        pass
+
+    def __setattr__(self, name: str, value: object) -> None:
+        pass
+
+    def __getattr__(self, name: str) -> Any:
+        return 0 if name == 'bytes' else None
+
+
+class _NullStage:
+    _record = _NullRecord()
+
+    def __enter__(self) -> StageRecord:
+        return self._record
+
+    def __exit__(
+        self, exc_type: Optional[Type[BaseException]], exc: Optional[BaseException], tb: Optional[TracebackType],
+    ) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _StageTotals:
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        # One count per bucket in LATENCY_BUCKETS, plus one for everything slower
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.status_codes: dict[int, int] = {}
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_seconds': self.seconds,
+            'mean_ms': self.seconds / self.count * 1000 if self.count else 0.0,
+            'bytes': self.bytes,
+            'status_codes': {str(code): n for code, n in sorted(self.status_codes.items())},
+            'latency_buckets': {
+                str(bound): n for bound, n in zip([*LATENCY_BUCKETS, '+Inf'], self.buckets)
+            },
+        }
+
+
+class _HostTotals:
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_seconds': self.seconds,
+            'mean_ms': self.seconds / self.count * 1000 if self.count else 0.0,
+        }
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stages: dict[str, _StageTotals] = {}
+        self._hosts: dict[tuple[str, str], _HostTotals] = {}
+
+    def record(
+        self, stage: str, url: Optional[str], seconds: float, record: StageRecord, failed: bool,
+    ) -> None:
+        host = parse.urlparse(url).netloc.lower() if url else None
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            totals = self._stages.get(stage)
+            if totals is None:
+                totals = self._stages[stage] = _StageTotals()
+            totals.count += 1
+            totals.errors += failed
+            totals.seconds += seconds
+            totals.bytes += record.bytes
+            totals.buckets[bucket] += 1
+            if record.status is not None:
+                totals.status_codes[record.status] = totals.status_codes.get(record.status, 0) + 1
+
+            if host is not None:
+                host_totals = self._hosts.get((stage, host))
+                if host_totals is None:
+                    host_totals = self._hosts[(stage, host)] = _HostTotals()
+                host_totals.count += 1
+                host_totals.errors += failed
+                host_totals.seconds += seconds
+
+    def to_json(self) -> dict[str, Any]:
+        with self._lock:
+            hosts: dict[str, dict[str, Any]] = {}
+            for (stage, host), host_totals in sorted(self._hosts.items()):
+                hosts.setdefault(host, {})[stage] = host_totals.to_json()
+            return {
+                'elapsed_seconds': time.monotonic() - self._started,
+                'stages': {stage: self._stages[stage].to_json() for stage in STAGES if stage in self._stages},
+                'hosts': hosts,
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            stages = [(stage, self._stages[stage]) for stage in STAGES if stage in self._stages]
+            slowest_hosts = sorted(self._hosts.items(), key=lambda item: item[1].seconds, reverse=True)
+            hosts = sorted(slowest_hosts[:PROMETHEUS_MAX_HOSTS])
+
+            lines += [
+                '# HELP webmentions_stage_duration_seconds Time spent in each stage of the scanner.',
+                '# TYPE webmentions_stage_duration_seconds histogram',
+            ]
+            for stage, totals in stages:
+                cumulative = 0
+                for bound, n in zip([*map(str, LATENCY_BUCKETS), '+Inf'], totals.buckets):
+                    cumulative += n
+                    lines.append(
+                        f'webmentions_stage_duration_seconds_bucket{_labels(stage=stage, le=bound)} {cumulative}'
+                    )
+                lines.append(f'webmentions_stage_duration_seconds_sum{_labels(stage=stage)} {totals.seconds}')
+                lines.append(f'webmentions_stage_duration_seconds_count{_labels(stage=stage)} {totals.count}')
+
+            lines += [
+                '# HELP webmentions_stage_errors_total Stages that raised an exception.',
+                '# TYPE webmentions_stage_errors_total counter',
+                *(f'webmentions_stage_errors_total{_labels(stage=stage)} {t.errors}' for stage, t in stages),
+                '# HELP webmentions_stage_bytes_total Bytes of response body read in each stage.',
+                '# TYPE webmentions_stage_bytes_total counter',
+                *(f'webmentions_stage_bytes_total{_labels(stage=stage)} {t.bytes}' for stage, t in stages),
+                '# HELP webmentions_stage_responses_total HTTP responses seen in each stage, by status code.',
+                '# TYPE webmentions_stage_responses_total counter',
+            ]
+            for stage, totals in stages:
+                for code, n in sorted(totals.status_codes.items()):
+                    lines.append(f'webmentions_stage_responses_total{_labels(stage=stage, code=str(code))} {n}')
+
+            lines += [
+                '# HELP webmentions_host_duration_seconds Time spent on each host, by stage.',
+                '# TYPE webmentions_host_duration_seconds summary',
+            ]
+            for (stage, host), host_totals in hosts:
+                labels = _labels(stage=stage, host=host)
+                lines.append(f'webmentions_host_duration_seconds_sum{labels} {host_totals.seconds}')
+                lines.append(f'webmentions_host_duration_seconds_count{labels} {host_totals.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str) -> None:
+        _write_atomically(path, json.dumps(self.to_json(), indent=2) + '\n')
+
+    def write_prometheus(self, path: str) -> None:
+        _write_atomically(path, self.to_prometheus())
+
+
+def _labels(**labels: str) -> str:
+    def escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _write_atomically(path: str, content: str) -> None:
+    # The textfile collector can read the file at any moment, so it mustn't ever see half of it
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class _Stage:
+    __slots__ = ('_metrics', '_name', '_url', '_record', '_started')
+
+    def __init__(self, metrics: Metrics, name: str, url: Optional[str]) -> None:
+        self._metrics = metrics
+        self._name = name
+        self._url = url
+        self._record = StageRecord()
+        self._started = 0.0
+
+    def __enter__(self) -> StageRecord:
+        self._started = time.perf_counter()
+        return self._record
+
+    def __exit__(
+        self, exc_type: Optional[Type[BaseException]], exc: Optional[BaseException], tb: Optional[TracebackType],
+    ) -> None:
+        elapsed = time.perf_counter() - self._started
+        self._metrics.record(self._name, self._url, elapsed, self._record, failed=exc_type is not None)
+
+
+_metrics: Optional[Metrics] = None
+
+
+def enable() -> Metrics:
+    """Starts collecting metrics from scratch."""
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def disable() -> None:
+    global _metrics
+    _metrics = None
+
+
+def current() -> Optional[Metrics]:
+    return _metrics
+
+
+def stage(name: str, url: Optional[str] = None) -> Union[_Stage, _NullStage]:
+    """
+    Times the block as one run of the stage `name`, against the host in `url` if there is one.
+    The block can fill in the bytes it read and the status it got on the record it's given:
+
+        with metrics.stage(metrics.ARTICLE_FETCH, url) as record:
+            r = request_utils.get(url)
+            record.status = r.status_code
+    """
+    metrics = _metrics
+    if metrics is None:
+        return _NULL_STAGE
+    return _Stage(metrics, name, url)
+
+
+def timed_iter(name: str, items: Generator[T, None, R], url: Optional[str] = None) -> Generator[T, None, R]:
+    """
+    Like `stage`, for work that's done lazily by a generator: only the time spent producing items
+    counts, not the time the consumer spends on them in between. Recorded once the generator's done.
+    """
+    metrics = _metrics
+    if metrics is None:
+        return items
+    return _timed_iter(metrics, name, items, url)
+
+
+def _timed_iter(metrics: Metrics, name: str, items: Generator[T, None, R], url: Optional[str]) -> Generator[T, None, R]:
+    seconds = 0.0
+    failed = False
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration as stop:
+                result: R = stop.value
+                return result
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                seconds += time.perf_counter() - started
+            yield item
+    finally:
+        items.close()
+        metrics.record(name, url, seconds, StageRecord(), failed=failed)
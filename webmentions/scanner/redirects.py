@@ -0,0 +1,218 @@
+"""
+Remembering where redirects go, so that looking up a target that redirects (http to https, to the
+www. host, through a link shortener) goes straight to where it ends up next time, rather than
+taking the same one to three round-trips to get there on every scan.
+
+Each hop is cached on its own: permanent redirects (301, 308) for a long time, temporary ones
+(302, 303, 307) only briefly. Cached hops are checked against the local-address guard every time
+they're used, because they might have been cached by a run that wasn't guarding, and a host that
+was fine when we cached the hop might not resolve to anywhere we'd go now.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+from urllib import parse
+
+import requests
+from requests.models import DEFAULT_REDIRECT_LIMIT
+
+from webmentions import config
+from webmentions.scanner import request_utils
+
+DEFAULT_REDIRECTS_PATH = os.path.join(config.CACHE_DIR, 'redirects.sqlite3')
+# Permanent isn't forever: domains change hands, and shorteners get repointed
+DEFAULT_PERMANENT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_TEMPORARY_TTL_SECONDS = 60 * 60
+
+PERMANENT_STATUS_CODES = frozenset({301, 308})
+TEMPORARY_STATUS_CODES = frozenset({302, 303, 307})
+# Past this, we'd rather open a new connection than read the rest of a redirect's body
+_MAX_REDIRECT_BODY_BYTES = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS redirects (
+    url TEXT PRIMARY KEY,
+    location TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class _TooManyRedirectsWeRemembered(requests.TooManyRedirects):
+    """Too many redirects, but some of them were from the cache, so they might not be true any more"""
+
+
+class RedirectStats(NamedTuple):
+    # Redirects we didn't have to follow over the network, because we knew where they went
+    hops_skipped: int
+    hops_followed: int
+    # Cached hops that went somewhere the guard wouldn't let us go
+    hops_rejected: int
+
+
+class RedirectCache:
+    """
+    Redirect hops in SQLite. `get` follows redirects itself rather than leaving it to requests, so
+    that it can skip the hops it already knows about and record the ones it doesn't.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_REDIRECTS_PATH,
+        permanent_ttl_seconds: float = DEFAULT_PERMANENT_TTL_SECONDS,
+        temporary_ttl_seconds: float = DEFAULT_TEMPORARY_TTL_SECONDS,
+        max_redirects: int = DEFAULT_REDIRECT_LIMIT,
+    ) -> None:
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._permanent_ttl_seconds = permanent_ttl_seconds
+        self._temporary_ttl_seconds = temporary_ttl_seconds
+        self._max_redirects = max_redirects
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+        self._hops_skipped = 0
+        self._hops_followed = 0
+        self._hops_rejected = 0
+
+    def location(self, url: str) -> Optional[str]:
+        """Where `url` redirects to, if we know and it hasn't expired"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT location FROM redirects WHERE url = ? AND expires_at > ?', (url, time.time())
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def record(self, url: str, location: str, status: int) -> None:
+        if status in PERMANENT_STATUS_CODES:
+            ttl_seconds = self._permanent_ttl_seconds
+        elif status in TEMPORARY_STATUS_CODES:
+            ttl_seconds = self._temporary_ttl_seconds
+        else:
+            return
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO redirects (url, location, status, expires_at) VALUES (?, ?, ?, ?)',
+                (url, location, status, time.time() + ttl_seconds),
+            )
+
+    def forget(self, url: str) -> None:
+        with self._lock:
+            self._db.execute('DELETE FROM redirects WHERE url = ?', (url,))
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        """
+        GETs `url` through the shared client, following redirects like requests would (the response's
+        `url` is where it ended up), but skipping the hops we've seen before.
+        """
+        # One deadline for the whole chain, retry included, as when requests follows redirects itself
+        kwargs.setdefault('deadline', request_utils.deadline_from_now())
+        try:
+            return self._get(url, use_cache=True, **kwargs)
+        except _TooManyRedirectsWeRemembered:
+            # Maybe one of the hops we remembered has changed since; if so, finding out costs one more try
+            return self._get(url, use_cache=False, **kwargs)
+
+    def _get(self, url: str, use_cache: bool, **kwargs: Any) -> requests.Response:
+        try:
+            return self._follow(url, use_cache, **kwargs)
+        except request_utils.DeadlineExceeded as e:
+            # Whichever hop it ran out on, it's the lookup as a whole that took too long
+            raise request_utils.DeadlineExceeded(url, e.deadline_seconds) from e
+
+    def _follow(self, url: str, use_cache: bool, **kwargs: Any) -> requests.Response:
+        seen = {url}
+        current = url
+        used_cache = False
+        while True:
+            cached = self.location(current) if use_cache else None
+            if cached is not None and not request_utils.is_allowed_destination(cached):
+                self.forget(current)
+                with self._lock:
+                    self._hops_rejected += 1
+                cached = None
+
+            if cached is not None:
+                with self._lock:
+                    self._hops_skipped += 1
+                used_cache = True
+                next_url = cached
+            else:
+                r = request_utils.get(current, allow_redirects=False, **kwargs)
+                location = r.headers.get('Location') if r.is_redirect else None
+                if location is None:
+                    if not use_cache:
+                        # In case what we remembered about it is why we're here
+                        self.forget(current)
+                    return r
+                try:
+                    # Redirects hardly ever have much of a body, and reading it lets the connection be reused
+                    request_utils.read_body(r, _MAX_REDIRECT_BODY_BYTES)
+                except IOError:
+                    pass
+                r.close()
+                next_url = _redirect_target(current, location)
+                self.record(current, next_url, r.status_code)
+                with self._lock:
+                    self._hops_followed += 1
+
+            error = _TooManyRedirectsWeRemembered if used_cache else requests.TooManyRedirects
+            if next_url in seen:
+                raise error(f'{url} redirects in a loop through {next_url}')
+            if len(seen) > self._max_redirects:
+                raise error(f'{url} redirects more than {self._max_redirects} times')
+            seen.add(next_url)
+            current = next_url
+
+    def purge(self) -> None:
+        with self._lock:
+            self._db.execute('DELETE FROM redirects')
+
+    def stats(self) -> RedirectStats:
+        with self._lock:
+            return RedirectStats(
+                hops_skipped=self._hops_skipped, hops_followed=self._hops_followed, hops_rejected=self._hops_rejected,
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _redirect_target(url: str, location: str) -> str:
+    # Like requests: relative locations are relative to where we were, and a location without a
+    # fragment keeps the one we had
+    target = parse.urljoin(url, location)
+    fragment = parse.urlsplit(url).fragment
+    if fragment and not parse.urlsplit(target).fragment:
+        target = f'{target}#{fragment}'
+    return target
+
+
+# Like the shared client, process-wide: the lookups happen deep inside the capability resolvers
+_cache: Optional[RedirectCache] = None
+
+
+def set_cache(cache: Optional[RedirectCache]) -> None:
+    global _cache
+    _cache = cache
+
+
+def stats() -> Optional[RedirectStats]:
+    """What the redirect cache saved, or None if there isn't one"""
+    return _cache.stats() if _cache is not None else None
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    """`request_utils.get`, with the redirect cache if one's been set"""
+    if _cache is None:
+        return request_utils.get(url, **kwargs)
+    return _cache.get(url, **kwargs)
+
+
+def fetch(url: str, content_class: str, **kwargs: Any) -> requests.Response:
+    """`request_utils.fetch`, with the redirect cache if one's been set"""
+    return request_utils.read_capped(get(url, stream=True, **kwargs), content_class)
@@ -1,29 +1,49 @@
 import contextlib
 import functools
-import ipaddress
+import heapq
+import itertools
 import socket
 import threading
-from typing import Any
+import time
+import weakref
+from typing import Any, Callable, Iterator, NamedTuple, Optional, TYPE_CHECKING
 from urllib import parse
 
-import bs4
 import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import connection, connectionpool
+from urllib3.exceptions import NewConnectionError, ProtocolError, ReadTimeoutError, SSLError
+
+from webmentions import config
+from webmentions.scanner import content_encoding, html_backend, resolver
+
+if TYPE_CHECKING:
+    import bs4
 
 
 class WrappedResponse:
     """Wraps a requests Response and adds some useful utils"""
 
-    def __init__(self, response: requests.Response) -> None:
+    def __init__(self, response: requests.Response, html_backend: Optional[str] = None) -> None:
         self._response: requests.Response = response
+        self._html_backend = html_backend
+
+    @functools.cached_property
+    def document(self) -> html_backend.HtmlDocument:
+        """The page parsed with the configured parser backend (see `html_backend`)"""
+        # TODO(reliability): content-type check
+        return html_backend.parse(self._response.text, self._html_backend)
 
     @functools.cached_property
-    def parsed_html(self) -> bs4.BeautifulSoup:
+    def parsed_html(self) -> 'bs4.BeautifulSoup':
         # TODO(reliability): content-type check
+        import bs4
         return bs4.BeautifulSoup(self._response.text, features='lxml')
 
     @functools.cached_property
-    def parsed_xml(self) -> bs4.BeautifulSoup:
+    def parsed_xml(self) -> 'bs4.BeautifulSoup':
         # TODO(reliability): content-type check
+        import bs4
         return bs4.BeautifulSoup(self._response.text, features='lxml-xml')
 
     def resolve_url(self, url: str) -> str:
@@ -34,13 +54,21 @@ class WrappedResponse:
         return getattr(self._response, attr)
 
 
-def _init_threadlocal():
-    registry = threading.local()
-    registry.__dict__.setdefault('unsafe_requests', False)
-    return registry
+class _SpookyThreadLocal(threading.local):
+    # Class attributes act as the per-thread defaults, so this is also set on threads that
+    # weren't around when the module was imported (e.g. crawler worker threads).
+    unsafe_requests = False
+
+
+_spooky_threadlocal_data = _SpookyThreadLocal()
+
+
+class _DeadlineThreadLocal(threading.local):
+    # When the request this thread is in the middle of sending has to be finished by (monotonic)
+    deadline: Optional[float] = None
 
 
-_spooky_threadlocal_data = _init_threadlocal()
+_deadline_threadlocal_data = _DeadlineThreadLocal()
 
 
 @contextlib.contextmanager
@@ -53,26 +81,565 @@ def allow_local_addresses():
         _spooky_threadlocal_data.unsafe_requests = old_spooky
 
 
-def extra_spooky_monkey_patch_to_block_local_traffic() -> None:
-    """Sorry / not sorry"""
-    local_getaddrinfo = socket.getaddrinfo
+class ClientStats(NamedTuple):
+    requests_sent: int
+    connections_opened: int
+
+    @property
+    def connections_reused(self) -> int:
+        return max(self.requests_sent - self.connections_opened, 0)
+
+
+class _Counters:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.connections_opened = 0
+
+    def request_sent(self) -> None:
+        with self._lock:
+            self.requests_sent += 1
+
+    def connection_opened(self) -> None:
+        with self._lock:
+            self.connections_opened += 1
+
+
+# urllib3 doesn't expose how many connections a pool has opened once the pool's been evicted, so we
+# count them on the way in. This is process-wide, which is fine because so is the default client.
+_connection_counters = _Counters()
+
+
+def _peer_allowed(peer_ip: str) -> bool:
+    return not _guarding() or resolver.is_global_ip(peer_ip)
+
+
+def _check_peer(conn: connection.HTTPConnection, sock: socket.socket) -> None:
+    """
+    Pins the guard's decision to the socket: whatever happened during resolution, the address we
+    ended up connected to has to be global.
+    """
+    peer_ip = sock.getpeername()[0]
+    if not _peer_allowed(peer_ip):
+        sock.close()
+        raise NewConnectionError(conn, f'Refusing to connect to non-global address {peer_ip}')
+
+
+class _Watchdog:
+    """
+    Cuts off connections that are still busy at their request's deadline. A read timeout can't do
+    that on its own: a server that trickles out a byte every few seconds never trips one.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        # Tokens break ties, so the keys never get compared
+        self._heap: list[tuple[float, int, object, Callable[[], None]]] = []
+        # The token armed for each key: re-arming or disarming one turns what's already in the heap into a no-op
+        self._armed: dict[object, int] = {}
+        self._tokens = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def arm(self, key: object, deadline: float, cut_off: Callable[[], None]) -> None:
+        with self._condition:
+            token = next(self._tokens)
+            self._armed[key] = token
+            heapq.heappush(self._heap, (deadline, token, key, cut_off))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-deadlines', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def disarm(self, key: object) -> None:
+        with self._condition:
+            self._armed.pop(key, None)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                deadline, token, key, cut_off = self._heap[0]
+                armed = self._armed.get(key) == token
+                now = time.monotonic()
+                if armed and deadline > now:
+                    self._condition.wait(deadline - now)
+                    continue
+                heapq.heappop(self._heap)
+                if not armed:
+                    continue
+                del self._armed[key]
+            cut_off()
+
+
+_watchdog = _Watchdog()
+
+
+def _cut_off(sock: socket.socket) -> None:
+    try:
+        # Wakes up whoever's blocked reading from it. Not SSLSocket.shutdown, which would pull the TLS
+        # state out from under them.
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _arm_deadline(conn: connection.HTTPConnection) -> None:
+    deadline = _deadline_threadlocal_data.deadline
+    # The socket rather than the connection, because a response that closes the connection when it's done
+    # takes the socket with it
+    if deadline is not None and conn.sock is not None:
+        _watchdog.arm(conn, deadline, functools.partial(_cut_off, conn.sock))
+
+
+# Counted per socket rather than per pooled connection object: a pool reconnects the connections it
+# hands back out if they were closed (e.g. a response that wasn't read to the end), without a new one.
+class _GuardedHTTPConnection(connection.HTTPConnection):
+    def _new_conn(self) -> socket.socket:
+        _connection_counters.connection_opened()
+        sock = super()._new_conn()
+        _check_peer(self, sock)
+        return sock
+
+    def request(self, *args: Any, **kwargs: Any) -> None:
+        super().request(*args, **kwargs)
+        # Sent (and so connected), so it's waiting on the response from here on. Armed until the pool gets the
+        # connection back, i.e. once the response has been read or closed.
+        _arm_deadline(self)
+
+
+class _GuardedHTTPSConnection(connection.HTTPSConnection):
+    def _new_conn(self) -> socket.socket:
+        _connection_counters.connection_opened()
+        sock = super()._new_conn()
+        _check_peer(self, sock)
+        return sock
+
+    def request(self, *args: Any, **kwargs: Any) -> None:
+        super().request(*args, **kwargs)
+        _arm_deadline(self)
+
+
+class _CountingHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+    ConnectionCls = _GuardedHTTPConnection
+
+    def _put_conn(self, conn: Optional[connection.HTTPConnection]) -> None:  # type: ignore[override]
+        if conn is not None:
+            _watchdog.disarm(conn)
+        super()._put_conn(conn)
+
+
+class _CountingHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _GuardedHTTPSConnection
+
+    def _put_conn(self, conn: Optional[connection.HTTPConnection]) -> None:  # type: ignore[override]
+        if conn is not None:
+            _watchdog.disarm(conn)
+        super()._put_conn(conn)
+
+
+class _CountingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+# Whatever we can decode a chunk at a time with the packages that are installed (brotli and zstd are extras).
+# Bodies get decoded by `iter_body` rather than urllib3, whose older versions can't do either.
+ACCEPT_ENCODING = content_encoding.ACCEPT_ENCODING
+
+# How requests go out over the wire
+URLLIB3 = 'urllib3'
+# HTTP/2 where the server supports it, via httpx (the `http2` extra). Requests to the same host share one connection.
+HTTP2 = 'http2'
+HTTP_BACKENDS = (URLLIB3, HTTP2)
+
+
+class Timeouts(NamedTuple):
+    # Per attempt to open a connection
+    connect_seconds: float
+    # Between bytes, and before the response starts
+    read_seconds: float
+    # For the whole request, reading the body and following redirects included
+    deadline_seconds: float
+
+
+DEFAULT_TIMEOUTS = Timeouts(connect_seconds=10.0, read_seconds=30.0, deadline_seconds=60.0)
+_timeouts = DEFAULT_TIMEOUTS
+
+
+def set_timeouts(timeouts: Timeouts) -> None:
+    global _timeouts
+    _timeouts = timeouts
+
+
+def deadline_from_now() -> float:
+    """When a request started now has to be done by (in `time.monotonic()` time), see `HttpClient.request`"""
+    return time.monotonic() + _timeouts.deadline_seconds
+
+
+class DeadlineExceeded(requests.Timeout):
+    """The request, body and all, took longer than the deadline"""
+
+    def __init__(self, url: str, deadline_seconds: float) -> None:
+        super().__init__(f'{url} took more than {deadline_seconds:g}s')
+        self.url = url
+        self.deadline_seconds = deadline_seconds
+
+
+class _Deadline(NamedTuple):
+    at: float
+    seconds: float
+
+    def passed(self) -> bool:
+        return time.monotonic() >= self.at
 
-    def _addrinfo_represents_global_ip(addrinfo_tuple: Any) -> bool:
-        (family, type, proto, canonname, sockaddr) = addrinfo_tuple
-        if family not in (socket.AF_INET, socket.AF_INET6):
-            # ipv4/v6 only, no shenanigans please
-            return False
 
-        # For IPv4, this is a 2-tuple with IP/port
-        # For IPv6, this is a 4-tuple with IP/port/flowinfo/scope_id apparently
-        ip, *_ = sockaddr
-        return ipaddress.ip_address(ip).is_global
+# For reading the bodies of streamed responses; not on the response itself, because requests.Response doesn't
+# take extra attributes without complaint from the type checker
+_deadlines: 'weakref.WeakKeyDictionary[requests.Response, _Deadline]' = weakref.WeakKeyDictionary()
+_deadlines_lock = threading.Lock()
+
+
+class HttpClient:
+    """
+    Pooled keep-alive HTTP sessions shared by the whole scanner.
+
+    Requests made inside `allow_local_addresses()` go through a separate session: otherwise a
+    connection to a local address opened by a trusted request could get picked out of the pool by
+    an untrusted one, which would sidestep the local-traffic guard (which only runs on connect).
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        backend: str = URLLIB3,
+    ) -> None:
+        if backend not in HTTP_BACKENDS:
+            raise ValueError(f'Unknown HTTP backend {backend!r}')
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self.backend = backend
+        self._counters = _Counters()
+        self._opened_at_start = _connection_counters.connections_opened
+        self._local_session = self._build_session()
+        self._global_session = self._build_session()
+
+    def _build_session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers['User-Agent'] = config.USER_AGENT
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        adapter: BaseAdapter
+        if self.backend == HTTP2:
+            # Only imported when asked for, because httpx is optional
+            try:
+                from webmentions.scanner.http2 import Http2Adapter
+            except ImportError as e:
+                raise ImportError(f"The {HTTP2} backend needs httpx: install webmentions' http2 extra") from e
+            adapter = Http2Adapter(
+                _peer_allowed, _connection_counters.connection_opened, max_connections=self._pool_maxsize,
+            )
+        else:
+            adapter = _CountingAdapter(pool_connections=self._pool_connections, pool_maxsize=self._pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _session(self) -> requests.Session:
+        if _spooky_threadlocal_data.unsafe_requests:
+            return self._local_session
+        return self._global_session
+
+    def request(self, method: str, url: str, deadline: Optional[float] = None, **kwargs: Any) -> requests.Response:
+        """
+        Like `requests.request`, but with the configured timeouts (see `set_timeouts`) unless it's given
+        others. Responses that take longer than the deadline raise `DeadlineExceeded`; for streamed
+        ones, that's enforced while the body's read by `iter_body` (and so `fetch` and `read_body`).
+
+        Requests that are one step of something bigger (following redirects one at a time, say) can
+        share its `deadline` (from `deadline_from_now`), rather than each getting a whole one.
+        """
+        self._counters.request_sent()
+        stream = kwargs.pop('stream', False)
+        timeouts = _timeouts
+        kwargs.setdefault('timeout', (timeouts.connect_seconds, timeouts.read_seconds))
+        if deadline is None:
+            deadline = time.monotonic() + timeouts.deadline_seconds
+        elif time.monotonic() >= deadline:
+            raise DeadlineExceeded(url, timeouts.deadline_seconds)
+        request_deadline = _Deadline(deadline, timeouts.deadline_seconds)
+        # The connections the request goes out on get cut off at the deadline, see `_Watchdog`
+        _deadline_threadlocal_data.deadline = request_deadline.at
+        try:
+            # Always streamed underneath, so that the body gets decoded by `iter_body`
+            r = self._session().request(method, url, stream=True, **kwargs)
+        except OSError as e:
+            if request_deadline.passed():
+                raise DeadlineExceeded(url, request_deadline.seconds) from e
+            raise
+        finally:
+            _deadline_threadlocal_data.deadline = None
+        with _deadlines_lock:
+            _deadlines[r] = request_deadline
+        if not stream:
+            try:
+                r._content = b''.join(iter_body(r, _READ_CHUNK_SIZE))
+            except BaseException:
+                r.close()
+                raise
+        return r
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> ClientStats:
+        return ClientStats(
+            requests_sent=self._counters.requests_sent,
+            connections_opened=_connection_counters.connections_opened - self._opened_at_start,
+        )
+
+    def close(self) -> None:
+        self._local_session.close()
+        self._global_session.close()
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def client() -> HttpClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def configure_client(
+    pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+    backend: str = URLLIB3,
+) -> HttpClient:
+    """Replaces the shared client, e.g. to size the pools to match the crawl concurrency."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = HttpClient(pool_connections=pool_connections, pool_maxsize=pool_maxsize, backend=backend)
+        return _client
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return client().get(url, **kwargs)
+
+
+# What we're fetching, which decides how much of it we're prepared to hold in memory
+FEED = 'feed'
+ARTICLE = 'article'
+TARGET_PAGE = 'target_page'
+SITEMAP = 'sitemap'
+
+DEFAULT_BYTE_CAPS = {
+    FEED: 10 * 1024 * 1024,
+    ARTICLE: 5 * 1024 * 1024,
+    TARGET_PAGE: 2 * 1024 * 1024,
+    # The most the sitemaps protocol allows, uncompressed
+    SITEMAP: 50 * 1024 * 1024,
+}
+_byte_caps = dict(DEFAULT_BYTE_CAPS)
+_READ_CHUNK_SIZE = 64 * 1024
+
+
+class ResponseTooLarge(IOError):
+    """The response body (after decompression) was bigger than we were prepared to read"""
+
+    def __init__(self, url: str, max_bytes: int) -> None:
+        super().__init__(f'{url} is over {max_bytes} bytes')
+        self.url = url
+        self.max_bytes = max_bytes
+
+
+def set_byte_cap(content_class: str, max_bytes: int) -> None:
+    if content_class not in _byte_caps:
+        raise ValueError(f'Unknown content class {content_class!r}')
+    _byte_caps[content_class] = max_bytes
+
+
+def fetch(url: str, content_class: str, **kwargs: Any) -> requests.Response:
+    """
+    GETs `url` and reads the body, giving up with `ResponseTooLarge` as soon as it's clear that it's
+    over the cap for `content_class`. The body is read (and decompressed) a chunk at a time, so a
+    huge page or a gzip bomb costs at most the cap in memory.
+
+    The response comes back fully read, so `.content`/`.text` work as usual.
+    """
+    return read_capped(get(url, stream=True, **kwargs), content_class)
+
+
+def read_capped(r: requests.Response, content_class: str) -> requests.Response:
+    """The rest of `fetch`, for a streamed response that came from somewhere else"""
+    max_bytes = _byte_caps[content_class]
+    try:
+        content_length = r.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            # Only a hint (it's the compressed size, and it could be lying), but a reliable way to give up early
+            raise ResponseTooLarge(r.url, max_bytes)
+        body = read_body(r, max_bytes)
+    except BaseException:
+        r.close()
+        raise
+    r._content = body
+    r._content_consumed = True
+    return r
+
+
+def read_body(r: requests.Response, max_bytes: int) -> bytes:
+    """Reads a streamed response's (decompressed) body, raising `ResponseTooLarge` past `max_bytes`"""
+    body = bytearray()
+    for chunk in iter_body(r, _READ_CHUNK_SIZE):
+        body += chunk
+        if len(body) > max_bytes:
+            raise ResponseTooLarge(r.url, max_bytes)
+    return bytes(body)
+
+
+def iter_body(r: requests.Response, chunk_size: int) -> Iterator[bytes]:
+    """
+    `r.iter_content`, but decoded by `content_encoding` (so at most `chunk_size` bytes get decompressed at
+    a time, whatever urllib3's version), and raising `DeadlineExceeded` once the request is past its deadline,
+    whether that's noticed between chunks or because the connection got cut off in the middle of one.
+    """
+    if isinstance(r, WrappedResponse):
+        r = r._response
+    with _deadlines_lock:
+        deadline = _deadlines.get(r)
+    if deadline is None:
+        # Not one of ours
+        yield from _decoded_body(r, chunk_size)
+        return
+
+    try:
+        for chunk in _decoded_body(r, chunk_size):
+            if deadline.passed():
+                raise DeadlineExceeded(r.url, deadline.seconds)
+            yield chunk
+    except DeadlineExceeded:
+        raise
+    except OSError as e:
+        if deadline.passed():
+            raise DeadlineExceeded(r.url, deadline.seconds) from e
+        raise
+    if deadline.passed():
+        # Being cut off can look just like the end of the body, if the server didn't say how long it was
+        raise DeadlineExceeded(r.url, deadline.seconds)
+
+
+def _decoded_body(r: requests.Response, chunk_size: int) -> Iterator[bytes]:
+    if r._content_consumed:
+        # Already read (or being asked to read twice, which requests complains about)
+        yield from r.iter_content(chunk_size=chunk_size)
+        return
+    raw = _raw_body(r, chunk_size)
+    yield from content_encoding.decoded(raw, r.headers.get('Content-Encoding'), chunk_size)
+    r._content_consumed = True
+
+
+def _raw_body(r: requests.Response, chunk_size: int) -> Iterator[bytes]:
+    # What `r.iter_content` raises for the same things going wrong
+    try:
+        yield from r.raw.stream(chunk_size, decode_content=False)
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    except ReadTimeoutError as e:
+        raise requests.ConnectionError(e) from e
+    except SSLError as e:
+        raise requests.exceptions.SSLError(e) from e
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return client().post(url, **kwargs)
+
+
+# Captured on import, so that installing the guard twice doesn't stack caches
+_system_getaddrinfo = socket.getaddrinfo
+_resolver: Optional[resolver.CachingResolver] = None
+
+
+def _guarding() -> bool:
+    return _resolver is not None and not _spooky_threadlocal_data.unsafe_requests
+
+
+def extra_spooky_monkey_patch_to_block_local_traffic(
+    ttl_seconds: float = resolver.DEFAULT_TTL_SECONDS,
+) -> resolver.CachingResolver:
+    """
+    Sorry / not sorry
+
+    Lookups go through a caching resolver, and only the globally-routable addresses are handed
+    back, so those are the only ones a connection can be made to. The cache holds the unfiltered
+    answers, so requests inside `allow_local_addresses()` still see everything. As a backstop,
+    every new connection checks the address it actually connected to (see `_check_peer`).
+    """
+    global _resolver
+    _resolver = resolver.CachingResolver(_system_getaddrinfo, ttl_seconds=ttl_seconds)
+    caching_getaddrinfo = _resolver.getaddrinfo
 
     def new_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0) -> Any:
-        results = local_getaddrinfo(host, port, family=family, type=type, proto=proto, flags=flags)
+        results = caching_getaddrinfo(host, port, family=family, type=type, proto=proto, flags=flags)
         if _spooky_threadlocal_data.unsafe_requests:
             return results
         else:
-            return [r for r in results if _addrinfo_represents_global_ip(r)]
+            return [r for r in results if resolver.addrinfo_is_global(r)]
 
     socket.getaddrinfo = new_getaddrinfo
+    return _resolver
+
+
+def is_allowed_destination(url: str) -> bool:
+    """
+    Whether we'd be let through to `url` from here: it's http(s), and if the guard's installed, its
+    host resolves to a global address. Connecting is still checked as usual; this is for deciding
+    whether to go somewhere at all, e.g. a redirect we remembered from an earlier run.
+    """
+    parsed = parse.urlsplit(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return False
+    if not _guarding():
+        return True
+    try:
+        # Goes through the guard's resolver, which leaves out everything that isn't global
+        return bool(socket.getaddrinfo(parsed.hostname, parsed.port or 80, type=socket.SOCK_STREAM))
+    except (OSError, UnicodeError, ValueError):
+        return False
+
+
+def is_rejected_destination(url: str) -> bool:
+    """
+    Whether the guard would turn us away from `url` every time: its host resolves, but not to any
+    global address. A lookup that fails says nothing either way (it might be a DNS outage), so it's False.
+    """
+    if not _guarding():
+        return False
+    assert _resolver is not None
+    try:
+        parsed = parse.urlsplit(url)
+        # The resolver's answers aren't filtered, unlike the guard's
+        results = _resolver.getaddrinfo(parsed.hostname, parsed.port or 80, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError, ValueError):
+        return False
+    return bool(results) and not any(resolver.addrinfo_is_global(result) for result in results)
+
+
+def resolver_stats() -> Optional[resolver.ResolverStats]:
+    """How much the guard's DNS cache saved, or None if the guard isn't installed"""
+    return _resolver.stats() if _resolver is not None else None
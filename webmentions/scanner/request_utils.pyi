@@ -1,11 +1,16 @@
-from typing import ContextManager
+from typing import Any, ContextManager, Iterator, NamedTuple, Optional
 
 import bs4
 import requests
 
+from webmentions.scanner import html_backend, resolver
+
 
 class WrappedResponse(requests.Response):
-    def __init__(self, response: requests.Response) -> None: ...
+    def __init__(self, response: requests.Response, html_backend: Optional[str] = None) -> None: ...
+
+    @property
+    def document(self) -> html_backend.HtmlDocument: ...
 
     @property
     def parsed_html(self) -> bs4.BeautifulSoup: ...
@@ -18,7 +23,111 @@ class WrappedResponse(requests.Response):
     _response: requests.Response
 
 
-def extra_spooky_monkey_patch_to_block_local_traffic() -> None: ...
+class ClientStats(NamedTuple):
+    requests_sent: int
+    connections_opened: int
+
+    @property
+    def connections_reused(self) -> int: ...
+
+
+DEFAULT_POOL_CONNECTIONS: int
+DEFAULT_POOL_MAXSIZE: int
+ACCEPT_ENCODING: str
+URLLIB3: str
+HTTP2: str
+HTTP_BACKENDS: tuple[str, ...]
+
+
+class Timeouts(NamedTuple):
+    connect_seconds: float
+    read_seconds: float
+    deadline_seconds: float
+
+
+DEFAULT_TIMEOUTS: Timeouts
+
+
+def set_timeouts(timeouts: Timeouts) -> None: ...
+
+
+def deadline_from_now() -> float: ...
+
+
+class DeadlineExceeded(requests.Timeout):
+    url: str
+    deadline_seconds: float
+
+    def __init__(self, url: str, deadline_seconds: float) -> None: ...
+
+
+class HttpClient:
+    backend: str
+
+    def __init__(self, pool_connections: int = ..., pool_maxsize: int = ..., backend: str = ...) -> None: ...
+
+    def request(self, method: str, url: str, deadline: Optional[float] = ..., **kwargs: Any) -> requests.Response: ...
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response: ...
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response: ...
+
+    def stats(self) -> ClientStats: ...
+
+    def close(self) -> None: ...
+
+
+def client() -> HttpClient: ...
+
+
+def configure_client(pool_connections: int = ..., pool_maxsize: int = ..., backend: str = ...) -> HttpClient: ...
+
+
+def get(url: str, **kwargs: Any) -> requests.Response: ...
+
+
+def post(url: str, **kwargs: Any) -> requests.Response: ...
+
+
+FEED: str
+ARTICLE: str
+TARGET_PAGE: str
+SITEMAP: str
+DEFAULT_BYTE_CAPS: dict[str, int]
+
+
+class ResponseTooLarge(IOError):
+    url: str
+    max_bytes: int
+
+    def __init__(self, url: str, max_bytes: int) -> None: ...
+
+
+def set_byte_cap(content_class: str, max_bytes: int) -> None: ...
+
+
+def fetch(url: str, content_class: str, **kwargs: Any) -> requests.Response: ...
+
+
+def read_capped(r: requests.Response, content_class: str) -> requests.Response: ...
+
+
+def read_body(r: requests.Response, max_bytes: int) -> bytes: ...
+
+
+def iter_body(r: requests.Response, chunk_size: int) -> Iterator[bytes]: ...
+
+
+def extra_spooky_monkey_patch_to_block_local_traffic(ttl_seconds: float = ...) -> resolver.CachingResolver: ...
+
+
+def is_allowed_destination(url: str) -> bool: ...
+
+
+def is_rejected_destination(url: str) -> bool: ...
+
+
+def resolver_stats() -> Optional[resolver.ResolverStats]: ...
 
 
 def allow_local_addresses() -> ContextManager: ...
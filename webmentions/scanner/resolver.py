@@ -0,0 +1,135 @@
+"""
+DNS for the local-traffic guard (see `request_utils.extra_spooky_monkey_patch_to_block_local_traffic`):
+a TTL-bounded cache in front of the system resolver, and memoized checks of whether an IP is
+globally routable.
+"""
+import functools
+import ipaddress
+import socket
+import threading
+import time
+from typing import Any, Callable, NamedTuple, Union
+
+# The system resolver doesn't tell us the record's TTL, so this is an upper bound on how stale an
+# answer can get. Answers only ever get *more* conservative with age: anything handed out is
+# re-checked by the guard on every call, and a cached answer can't be rebound to a local address.
+DEFAULT_TTL_SECONDS = 5 * 60
+# Hosts that don't resolve tend to get linked over and over, so remember that for a little while
+DEFAULT_NEGATIVE_TTL_SECONDS = 30
+DEFAULT_MAX_ENTRIES = 10_000
+
+# socket.getaddrinfo's result type
+AddrInfo = tuple[Any, Any, int, str, Any]
+GetAddrInfo = Callable[..., list[AddrInfo]]
+
+
+@functools.lru_cache(maxsize=64 * 1024)
+def is_global_ip(ip: str) -> bool:
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+def addrinfo_is_global(addrinfo: AddrInfo) -> bool:
+    (family, type, proto, canonname, sockaddr) = addrinfo
+    if family not in (socket.AF_INET, socket.AF_INET6):
+        # ipv4/v6 only, no shenanigans please
+        return False
+
+    # For IPv4, this is a 2-tuple with IP/port
+    # For IPv6, this is a 4-tuple with IP/port/flowinfo/scope_id apparently
+    ip, *_ = sockaddr
+    return is_global_ip(ip)
+
+
+class ResolverStats(NamedTuple):
+    lookups: int
+    # Answered from the cache rather than the system resolver
+    lookups_saved: int
+    # Decisions about whether an IP is global that were answered from the memo
+    ip_checks_saved: int
+
+
+class _Entry(NamedTuple):
+    expires_at: float
+    result: Union[list[AddrInfo], socket.gaierror]
+
+
+class CachingResolver:
+    """A thread-safe, TTL-bounded cache in front of `getaddrinfo`."""
+
+    def __init__(
+        self,
+        resolve: GetAddrInfo,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        negative_ttl_seconds: float = DEFAULT_NEGATIVE_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._resolve = resolve
+        self._ttl_seconds = ttl_seconds
+        self._negative_ttl_seconds = negative_ttl_seconds
+        self._max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[Any, ...], _Entry] = {}
+        self._lookups = 0
+        self._cache_hits = 0
+        self._ip_checks_at_start = is_global_ip.cache_info().hits
+
+    def getaddrinfo(
+        self, host: Any, port: Any, family: int = 0, type: int = 0, proto: int = 0, flags: int = 0,
+    ) -> list[AddrInfo]:
+        key = (host, port, family, type, proto, flags)
+        now = self._clock()
+        with self._lock:
+            self._lookups += 1
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._cache_hits += 1
+                return _result(entry)
+
+        try:
+            result: Union[list[AddrInfo], socket.gaierror] = self._resolve(
+                host, port, family=family, type=type, proto=proto, flags=flags,
+            )
+            ttl = self._ttl_seconds
+        except socket.gaierror as e:
+            result = e
+            ttl = self._negative_ttl_seconds
+
+        entry = _Entry(expires_at=now + ttl, result=result)
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self._max_entries:
+                self._evict(now)
+            self._entries[key] = entry
+        return _result(entry)
+
+    def _evict(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= self._max_entries:
+            # Still full: drop the oldest, which is first because dicts keep insertion order
+            del self._entries[next(iter(self._entries))]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> ResolverStats:
+        with self._lock:
+            return ResolverStats(
+                lookups=self._lookups,
+                lookups_saved=self._cache_hits,
+                ip_checks_saved=is_global_ip.cache_info().hits - self._ip_checks_at_start,
+            )
+
+
+def _result(entry: _Entry) -> list[AddrInfo]:
+    if isinstance(entry.result, socket.gaierror):
+        # A fresh one each time, so that tracebacks don't pile up on the cached exception
+        raise socket.gaierror(*entry.result.args)
+    # A copy, so that callers can't change what everyone else gets
+    return list(entry.result)
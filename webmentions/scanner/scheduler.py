@@ -0,0 +1,253 @@
+"""
+Sharing out fetches between hosts fairly: each host gets its own queue, the queues take turns,
+no host gets more than its share of connections at once, and hosts that ask for a Crawl-delay in
+their robots.txt get it.
+"""
+import asyncio
+import collections
+import contextlib
+import threading
+import time
+from typing import AsyncIterator, Callable, NamedTuple, Optional
+from urllib import parse
+
+import requests
+
+from webmentions import config
+from webmentions.scanner import request_utils
+from webmentions.scanner.coalesce import SingleFlight
+
+# Crawl-delay is whatever the site's owner felt like typing; this is the most we'll put up with, so
+# that one host can't hold up a scan indefinitely.
+DEFAULT_MAX_CRAWL_DELAY_SECONDS = 10.0
+
+
+class HostStats(NamedTuple):
+    requests: int
+    # The most requests that were ever waiting for this host at once
+    max_queue_depth: int
+    wait_seconds: float
+    crawl_delay: float
+
+
+class _Host:
+    __slots__ = (
+        'waiters', 'active', 'last_start', 'last_turn', 'crawl_delay', 'requests', 'max_queue_depth', 'wait_seconds',
+    )
+
+    def __init__(self) -> None:
+        self.waiters: collections.deque[asyncio.Future[None]] = collections.deque()
+        self.active = 0
+        self.last_start: Optional[float] = None
+        # When it last got a slot, counted in slots handed out; -1 for never
+        self.last_turn = -1
+        self.crawl_delay = 0.0
+        self.requests = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+
+    def next_start(self) -> float:
+        if self.last_start is None:
+            return 0.0
+        return self.last_start + self.crawl_delay
+
+
+class HostScheduler:
+    """
+    Hands out slots to fetch from a host. Hosts with something waiting take turns (the next slot goes
+    to whichever has gone longest without one), so a page full of links to one site doesn't starve
+    everything else of connections.
+
+    Lives in one event loop at a time, but can be reused for later runs in other loops.
+    """
+
+    def __init__(
+        self, concurrency: int, per_host_concurrency: int, clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        assert concurrency >= 1
+        assert per_host_concurrency >= 1
+        self._concurrency = concurrency
+        self._per_host_concurrency = per_host_concurrency
+        self._clock = clock
+        self._hosts: dict[str, _Host] = {}
+        # Hosts with waiters, in the order they started waiting; a dict as an ordered set
+        self._ready: dict[str, None] = {}
+        self._active = 0
+        self._turns = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def set_crawl_delay(self, host: str, seconds: float) -> None:
+        self._host(host).crawl_delay = seconds
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host: str) -> AsyncIterator[None]:
+        state = self._host(host)
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        state.max_queue_depth = max(state.max_queue_depth, len(state.waiters))
+        self._ready.setdefault(host, None)
+        queued_at = self._clock()
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Got the slot just as we were cancelled, so someone else should have it
+                self._release(state)
+            raise
+        state.wait_seconds += self._clock() - queued_at
+        try:
+            yield
+        finally:
+            self._release(state)
+
+    def _host(self, host: str) -> _Host:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _Host()
+        return state
+
+    def _release(self, state: _Host) -> None:
+        state.active -= 1
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        now = self._clock()
+        retry_at: Optional[float] = None
+        while self._active < self._concurrency:
+            chosen: Optional[_Host] = None
+            for host in list(self._ready):
+                state = self._hosts[host]
+                while state.waiters and state.waiters[0].done():
+                    # Cancelled while waiting
+                    state.waiters.popleft()
+                if not state.waiters:
+                    del self._ready[host]
+                    continue
+                if state.active >= self._per_host_concurrency:
+                    continue
+                if state.next_start() > now:
+                    retry_at = min(retry_at, state.next_start()) if retry_at is not None else state.next_start()
+                    continue
+                # Whoever's gone longest without a turn; ties go to whoever started waiting first
+                if chosen is None or state.last_turn < chosen.last_turn:
+                    chosen = state
+            if chosen is None:
+                break
+
+            chosen.waiters.popleft().set_result(None)
+            chosen.active += 1
+            chosen.requests += 1
+            chosen.last_start = now
+            self._turns += 1
+            chosen.last_turn = self._turns
+            self._active += 1
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if retry_at is not None:
+            self._timer = asyncio.get_running_loop().call_later(retry_at - now, self._dispatch)
+
+    def stats(self) -> dict[str, HostStats]:
+        return {
+            host: HostStats(
+                requests=state.requests,
+                max_queue_depth=state.max_queue_depth,
+                wait_seconds=state.wait_seconds,
+                crawl_delay=state.crawl_delay,
+            )
+            for host, state in self._hosts.items()
+        }
+
+
+def parse_crawl_delay(robots_txt: str, user_agent: str) -> Optional[float]:
+    """
+    The Crawl-delay in the group of rules that applies to `user_agent`, matched the same way as
+    urllib.robotparser does it. That ignores fractional delays, which plenty of sites use, hence this.
+    """
+    product = user_agent.split('/')[0].lower()
+    groups: list[tuple[list[str], Optional[float]]] = []
+    agents: list[str] = []
+    delay: Optional[float] = None
+    in_rules = False
+    for line in robots_txt.splitlines():
+        field, _, value = line.split('#', 1)[0].partition(':')
+        field = field.strip().lower()
+        value = value.strip()
+        if field == 'user-agent':
+            if in_rules:
+                groups.append((agents, delay))
+                agents, delay, in_rules = [], None, False
+            agents.append(value.lower())
+        elif field == 'crawl-delay':
+            in_rules = True
+            try:
+                delay = max(0.0, float(value))
+            except ValueError:
+                pass
+        elif field in ('allow', 'disallow'):
+            in_rules = True
+    if agents:
+        groups.append((agents, delay))
+
+    for group_agents, group_delay in groups:
+        if any(agent != '*' and agent in product for agent in group_agents):
+            return group_delay
+    for group_agents, group_delay in groups:
+        if '*' in group_agents:
+            return group_delay
+    return None
+
+
+def _origin(url: str) -> str:
+    parsed = parse.urlparse(url)
+    return f'{parsed.scheme}://{parsed.netloc.lower()}'
+
+
+class RobotsCache:
+    """
+    The Crawl-delay each host asks for in its robots.txt, which is fetched once per host (per scheme,
+    strictly) and remembered for as long as the cache is around. Thread-safe.
+    """
+
+    def __init__(
+        self, user_agent: str = config.USER_AGENT, max_crawl_delay: float = DEFAULT_MAX_CRAWL_DELAY_SECONDS,
+    ) -> None:
+        self._user_agent = user_agent
+        self._max_crawl_delay = max_crawl_delay
+        self._single_flight: SingleFlight[float] = SingleFlight(normalize=_origin)
+        self._lock = threading.Lock()
+        self._known: dict[str, float] = {}
+
+    def known_crawl_delay(self, url: str) -> Optional[float]:
+        """The host's Crawl-delay if we've already got its robots.txt, without fetching anything"""
+        with self._lock:
+            return self._known.get(_origin(url))
+
+    def crawl_delay(self, url: str) -> float:
+        return self._single_flight.call(self._fetch_crawl_delay, url)
+
+    def _fetch_crawl_delay(self, url: str) -> float:
+        origin = _origin(url)
+        delay = min(self._max_crawl_delay, self._read_crawl_delay(origin))
+        with self._lock:
+            self._known[origin] = delay
+        return delay
+
+    def _read_crawl_delay(self, origin: str) -> float:
+        try:
+            r = request_utils.fetch(f'{origin}/robots.txt', request_utils.TARGET_PAGE)
+        except (requests.RequestException, IOError):
+            # No robots.txt we can read means no rules, same as a 404
+            return 0.0
+        if not r.ok:
+            return 0.0
+
+        return parse_crawl_delay(r.text, self._user_agent) or 0.0
+
+    @property
+    def hosts_fetched(self) -> int:
+        with self._lock:
+            return len(self._known)
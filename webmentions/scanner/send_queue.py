@@ -0,0 +1,401 @@
+import concurrent.futures
+import email.utils
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, NamedTuple, Optional
+from urllib import parse
+
+import requests
+
+from webmentions import config
+from webmentions.scanner.ledger import SentMentionLedger, STATUS_SENT
+from webmentions.scanner.mention_detector import MentionCapabilities
+from webmentions.scanner.mention_sender import (
+    MentionCandidate, RemoteError, SendError, mention_endpoint, send_mention,
+)
+
+DEFAULT_QUEUE_PATH = os.path.join(config.CACHE_DIR, 'send_queue.sqlite3')
+DEFAULT_SEND_WORKERS = 4
+# Per receiver host: a steady rate, plus a small burst on top
+DEFAULT_ENDPOINT_RATE = 1.0
+DEFAULT_ENDPOINT_BURST = 3
+# How long `drain` will hang around for retries that aren't due yet before leaving them for next time
+DEFAULT_MAX_WAIT_SECONDS = 60.0
+# How long a claimed mention is left to whoever claimed it before someone else can have it: plenty for one
+# send (see `request_utils.set_timeouts`), short enough that a crashed sender's mentions aren't stuck for long
+DEFAULT_SEND_LEASE_SECONDS = 5 * 60.0
+
+MAX_ATTEMPTS = 8
+BASE_BACKOFF_SECONDS = 30.0
+MAX_BACKOFF_SECONDS = 6 * 60 * 60.0
+
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# See http://www.hixie.ch/specs/pingback/pingback#TOC3. 0x0010 (source doesn't exist) is in here
+# because the receiver may have raced the post going live.
+RETRYABLE_FAULT_CODES = frozenset({
+    -1,  # not a fault at all: we couldn't read the response, see mention_sender.INDETERMINATE_ERROR
+    0x0000,  # a generic fault, for receivers that can't say what went wrong
+    0x0010,  # the source URI does not exist
+    0x0032,  # the receiver couldn't talk to an upstream server
+})
+ALREADY_REGISTERED_FAULT_CODE = 48
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    webmention_url TEXT,
+    pingback_url TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    updated_at REAL NOT NULL,
+    lease_token TEXT,
+    lease_expires_at REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS queue_one_unsent_per_pair ON queue (source, target)
+    WHERE status IN ('pending', 'sending');
+CREATE INDEX IF NOT EXISTS queue_due ON queue (status, next_attempt_at);
+"""
+
+
+class Outcome(NamedTuple):
+    sent: bool
+    retryable: bool
+    # Seconds, if the receiver told us when to come back
+    retry_after: Optional[float] = None
+    error: Optional[str] = None
+
+
+SENT = Outcome(sent=True, retryable=False)
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - (now if now is not None else time.time()), 0.0)
+
+
+def classify(error: Exception) -> Outcome:
+    if isinstance(error, SendError):
+        return Outcome(
+            sent=False,
+            retryable=error.status_code in RETRYABLE_STATUS_CODES,
+            retry_after=parse_retry_after(error.retry_after),
+            error=str(error),
+        )
+    if isinstance(error, RemoteError):
+        if error.code == ALREADY_REGISTERED_FAULT_CODE:
+            return SENT
+        return Outcome(sent=False, retryable=error.code in RETRYABLE_FAULT_CODES, error=str(error))
+    if isinstance(error, (requests.RequestException, IOError)):
+        # Connection trouble, timeouts and the like
+        return Outcome(sent=False, retryable=True, error=repr(error))
+    return Outcome(sent=False, retryable=False, error=repr(error))
+
+
+def backoff_seconds(attempts: int) -> float:
+    """
+    Exponential with equal jitter: somewhere between half the backoff and all of it, so that retries for
+    one receiver don't all land at once, but none comes back much sooner than it should.
+    """
+    ceiling = min(BASE_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), MAX_BACKOFF_SECONDS)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self._rate = rate
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token if there's one to take and returns 0, or returns how long until there will be."""
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+
+class EndpointRateLimiter:
+    """One token bucket per receiver, keyed by host since that's what ends up getting overloaded."""
+
+    def __init__(self, rate: float = DEFAULT_ENDPOINT_RATE, burst: int = DEFAULT_ENDPOINT_BURST) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._lock = threading.Lock()
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def take(self, endpoint: str) -> float:
+        """See `TokenBucket.take`"""
+        host = parse.urlparse(endpoint).netloc.lower()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self._rate, self._burst)
+            return bucket.take()
+
+
+class QueuedMention(NamedTuple):
+    id: int
+    candidate: MentionCandidate
+    attempts: int
+    # Different every time the mention is claimed, like `work_queue.Lease.token`
+    token: str
+
+
+class SendQueue:
+    """
+    Mentions waiting to be sent, kept in SQLite so that nothing's lost if we crash or a receiver is
+    down for a while. A mention is queued at most once per (source, target) until it's been sent.
+
+    Mentions are claimed with a lease, the same way `work_queue.SqliteWorkQueue` hands out units, so
+    several processes can send from the same file: a mention that's being sent stays with whoever
+    claimed it until the lease runs out (because they crashed, say), and only then goes to someone else.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, lease_seconds: float = DEFAULT_SEND_LEASE_SECONDS) -> None:
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(queue)')}
+        if 'lease_token' not in columns:
+            # From before mentions were leased; anything left being sent in one of these has no lease, so
+            # it's up for grabs straight away
+            self._db.execute('ALTER TABLE queue ADD COLUMN lease_token TEXT')
+            self._db.execute('ALTER TABLE queue ADD COLUMN lease_expires_at REAL')
+
+    def enqueue(self, candidate: MentionCandidate) -> bool:
+        """Returns False if the mention was already waiting to be (or being) sent."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO queue (source, target, webmention_url, pingback_url, status, next_attempt_at, '
+                'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    candidate.mentioner_url, candidate.mentioned_url, candidate.capabilities.webmention_url,
+                    candidate.capabilities.pingback_url, STATUS_PENDING, now, now,
+                ),
+            )
+            return cursor.rowcount > 0
+
+    def claim(self, limit: int) -> list[QueuedMention]:
+        """
+        Leases up to `limit` mentions: ones that are due, and ones whose last lease ran out before they
+        were sent (or not).
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        claimable = (
+            '(status = ? AND next_attempt_at <= ?) OR (status = ? AND IFNULL(lease_expires_at, 0) <= ?)'
+        )
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, source, target, webmention_url, pingback_url, attempts FROM queue '
+                f'WHERE {claimable} ORDER BY next_attempt_at LIMIT ?',
+                (STATUS_PENDING, now, STATUS_SENDING, now, limit),
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                # Only if nobody else (in another process) got there between the SELECT and now
+                cursor = self._db.execute(
+                    'UPDATE queue SET status = ?, lease_token = ?, lease_expires_at = ?, updated_at = ? '
+                    f'WHERE id = ? AND ({claimable})',
+                    (STATUS_SENDING, token, now + self._lease_seconds, now, row[0], STATUS_PENDING, now,
+                     STATUS_SENDING, now),
+                )
+                if cursor.rowcount:
+                    claimed.append(row)
+        return [
+            QueuedMention(
+                id=row[0],
+                candidate=MentionCandidate(
+                    mentioner_url=row[1],
+                    mentioned_url=row[2],
+                    capabilities=MentionCapabilities(webmention_url=row[3], pingback_url=row[4]),
+                ),
+                attempts=row[5],
+                token=token,
+            )
+            for row in claimed
+        ]
+
+    # complete, retry and fail return False if the lease had run out and someone else has the mention now
+
+    def complete(self, item: QueuedMention) -> bool:
+        return self._release(item, STATUS_SENT, error=None)
+
+    def retry(self, item: QueuedMention, error: Optional[str], delay_seconds: float, attempted: bool = True) -> bool:
+        """Puts the mention back for later. If it wasn't `attempted` (it never got sent), that doesn't count."""
+        return self._release(
+            item, STATUS_PENDING, error, next_attempt_at=time.time() + delay_seconds, attempted=attempted,
+        )
+
+    def fail(self, item: QueuedMention, error: Optional[str]) -> bool:
+        return self._release(item, STATUS_FAILED, error)
+
+    def _release(
+        self,
+        item: QueuedMention,
+        status: str,
+        error: Optional[str],
+        next_attempt_at: Optional[float] = None,
+        attempted: bool = True,
+    ) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                'UPDATE queue SET status = ?, attempts = ?, last_error = CASE WHEN ? THEN ? ELSE last_error END, '
+                'next_attempt_at = IFNULL(?, next_attempt_at), lease_token = NULL, updated_at = ? '
+                'WHERE id = ? AND status = ? AND lease_token = ?',
+                (status, item.attempts + attempted, attempted, error, next_attempt_at, time.time(), item.id,
+                 STATUS_SENDING, item.token),
+            )
+            return cursor.rowcount > 0
+
+    def next_due_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT MIN(next_attempt_at) FROM queue WHERE status = ?', (STATUS_PENDING,)
+            ).fetchone()
+        return float(row[0]) if row[0] is not None else None
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM queue GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class DrainStats(NamedTuple):
+    sent: int
+    retried: int
+    failed: int
+
+
+OnResult = Callable[[QueuedMention, Outcome], None]
+
+
+class SendWorkerPool:
+    """Sends queued mentions from a pool of threads, with backoff and per-receiver rate limits."""
+
+    def __init__(
+        self,
+        queue: SendQueue,
+        workers: int = DEFAULT_SEND_WORKERS,
+        rate_limiter: Optional[EndpointRateLimiter] = None,
+        ledger: Optional[SentMentionLedger] = None,
+        send: Callable[[MentionCandidate], None] = send_mention,
+        on_result: Optional[OnResult] = None,
+        max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS,
+    ) -> None:
+        self.queue = queue
+        self._max_wait_seconds = max_wait_seconds
+        self._workers = workers
+        self._rate_limiter = rate_limiter or EndpointRateLimiter()
+        self._ledger = ledger
+        self._send = send
+        self._on_result = on_result
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._retried = 0
+        self._failed = 0
+
+    def drain(self) -> DrainStats:
+        """
+        Sends everything that's due, and keeps going for retries that come due within
+        `max_wait_seconds`. Anything further out is left in the queue for the next drain.
+
+        Workers are topped up as sends finish, rather than a batch at a time, so one slow receiver
+        doesn't hold up everyone else's mentions.
+        """
+        max_in_flight = self._workers * 2
+        in_flight: set[concurrent.futures.Future[None]] = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+            while True:
+                if len(in_flight) < max_in_flight:
+                    for item in self.queue.claim(limit=max_in_flight - len(in_flight)):
+                        in_flight.add(executor.submit(self._send_one, item))
+                next_due_at = self.queue.next_due_at()
+                if not in_flight:
+                    if next_due_at is None:
+                        break
+                    wait = next_due_at - time.time()
+                    if wait > self._max_wait_seconds:
+                        break
+                    time.sleep(max(wait, 0))
+                    continue
+
+                # Back round when a send finishes, or when there's room and the next retry comes due
+                full = len(in_flight) >= max_in_flight
+                timeout = None if full or next_due_at is None else max(next_due_at - time.time(), 0)
+                _, in_flight = concurrent.futures.wait(
+                    in_flight, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+
+        with self._lock:
+            return DrainStats(sent=self._sent, retried=self._retried, failed=self._failed)
+
+    def _send_one(self, item: QueuedMention) -> None:
+        endpoint = mention_endpoint(item.candidate)
+        assert endpoint
+        delay = self._rate_limiter.take(endpoint)
+        if delay > 0:
+            # Back in the queue until the receiver's ready for more, rather than tying up a worker meanwhile
+            self.queue.retry(item, None, delay, attempted=False)
+            return
+
+        try:
+            self._send(item.candidate)
+            outcome = SENT
+        except Exception as e:
+            outcome = classify(e)
+
+        retrying = not outcome.sent and outcome.retryable and item.attempts + 1 < MAX_ATTEMPTS
+        if outcome.sent:
+            self.queue.complete(item)
+            if self._ledger is not None:
+                self._ledger.record_send(item.candidate, endpoint, STATUS_SENT)
+        elif retrying:
+            delay_seconds = max(outcome.retry_after or 0.0, backoff_seconds(item.attempts + 1))
+            self.queue.retry(item, outcome.error, delay_seconds)
+        else:
+            self.queue.fail(item, outcome.error)
+            if self._ledger is not None:
+                self._ledger.record_send(item.candidate, endpoint, f'failed: {outcome.error}')
+
+        with self._lock:
+            if outcome.sent:
+                self._sent += 1
+            elif retrying:
+                self._retried += 1
+            else:
+                self._failed += 1
+        if self._on_result is not None:
+            self._on_result(item, outcome)
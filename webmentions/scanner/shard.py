@@ -0,0 +1,423 @@
+"""
+Splitting a crawl between any number of scanner processes, on one machine or several, through a
+shared `WorkQueue`. Sites, articles and the links in them are separate units of work, so the
+processes share out a single big site as well as they do a list of small ones.
+
+    python -m webmentions.scanner.shard --input sites.txt --work-queue-path /shared/crawl.sqlite3
+    python -m webmentions.scanner.shard --work-queue-path /shared/crawl.sqlite3
+
+The first adds the sites and works on them; the second (run as many times, anywhere, as you like)
+just helps. They all stop once there's nothing left to do, and then each sends the mentions it
+found (see `send_queue.SendQueue`: shards that share a --queue-path share out the sending too).
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+from urllib import parse
+
+from webmentions.scanner import main as scanner
+from webmentions.scanner.batch import read_site_urls
+from webmentions.scanner.crawler import (
+    DEFAULT_CONCURRENCY, DEFAULT_PER_HOST_CONCURRENCY, FindLinks, ListArticles, list_feed_articles,
+    removed_link_capabilities, should_look_up_crawl_delay,
+)
+from webmentions.scanner.feed import RssItem
+from webmentions.scanner.ledger import SentMentionLedger
+from webmentions.scanner.mention_detector import (
+    NO_CAPABILITIES, ResolveCapabilities, stream_page_check_mention_capabilities,
+)
+from webmentions.scanner.mention_sender import MentionCandidate
+from webmentions.scanner.request_utils import extra_spooky_monkey_patch_to_block_local_traffic
+from webmentions.scanner.scheduler import HostScheduler, RobotsCache
+from webmentions.scanner.site_state import SiteStateStore
+from webmentions.scanner.work_queue import (
+    DEFAULT_LEASE_SECONDS, DEFAULT_WORK_QUEUE_PATH, Heartbeat, Lease, NewUnit, SqliteWorkQueue, WorkQueue,
+)
+
+KIND_SITE = 'site'
+KIND_ARTICLE = 'article'
+KIND_TARGET = 'target'
+# Finishing what's been started before starting anything new keeps the queue (and the time until
+# the first mentions are found) short
+_PRIORITIES = {KIND_SITE: 0, KIND_ARTICLE: 1, KIND_TARGET: 2}
+# How long an idle worker waits before looking at the queue again: other processes don't tell us
+# when they've added something
+IDLE_POLL_SECONDS = 0.25
+
+OnCandidate = Callable[[MentionCandidate], None]
+
+
+def site_unit(site_url: str) -> NewUnit:
+    return NewUnit(KIND_SITE, site_url, priority=_PRIORITIES[KIND_SITE])
+
+
+def article_unit(site_url: str, article: RssItem) -> NewUnit:
+    return NewUnit(
+        KIND_ARTICLE, article.absolute_url, json.dumps([site_url, *article]), priority=_PRIORITIES[KIND_ARTICLE],
+    )
+
+
+def target_unit(article_url: str, link: str, removed: bool = False) -> NewUnit:
+    # The same link in two articles is two candidates, so it's two units; the capability cache and
+    # SingleFlight stop it being two lookups (mostly)
+    payload = json.dumps([article_url, link, removed])
+    return NewUnit(KIND_TARGET, payload, payload, priority=_PRIORITIES[KIND_TARGET])
+
+
+def default_worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class ShardStats(NamedTuple):
+    sites: int
+    articles: int
+    targets: int
+    candidates: int
+    # Units that raised, and will be retried (by someone) unless they've run out of attempts
+    errors: int
+    # Units we finished after our lease on them had run out, so someone else may have done them too
+    leases_lost: int
+
+
+class _ThreadSlots:
+    """
+    `HostScheduler.slot` for plain threads: the scheduler lives in an event loop on a thread of its own,
+    and threads wait there for their turn.
+    """
+
+    def __init__(self, scheduler: HostScheduler) -> None:
+        self._scheduler = scheduler
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='host-scheduler', daemon=True)
+
+    @contextlib.contextmanager
+    def slot(self, host: str) -> Iterator[None]:
+        got_slot: concurrent.futures.Future[None] = concurrent.futures.Future()
+        done = asyncio.Event()
+        held = asyncio.run_coroutine_threadsafe(self._hold(host, got_slot, done), self._loop)
+        got_slot.result()
+        try:
+            yield
+        finally:
+            self._loop.call_soon_threadsafe(done.set)
+            held.result()
+
+    async def _hold(self, host: str, got_slot: 'concurrent.futures.Future[None]', done: asyncio.Event) -> None:
+        async with self._scheduler.slot(host):
+            got_slot.set_result(None)
+            await done.wait()
+
+    def set_crawl_delay(self, host: str, seconds: float) -> None:
+        self._loop.call_soon_threadsafe(self._scheduler.set_crawl_delay, host, seconds)
+
+    def __enter__(self) -> '_ThreadSlots':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class ShardWorker:
+    """
+    Works through a `WorkQueue` from a pool of threads, until nothing's left in it or leased to
+    anyone. Candidates go to `on_candidate` as they're found; as with `Crawler`, a `state` makes
+    the scan incremental and a `ledger` narrows candidates down to links that changed.
+
+    Each unit's follow-ups (a site's articles, an article's links) are queued as the unit is
+    completed, so once an article's unit is done, its links are safely in the queue and it can be
+    marked as processed. Each link goes in the `ledger` once it's been checked.
+
+    Target lookups are shared out between hosts by a `HostScheduler`, as in `Crawler`, and with a
+    `robots` they get the Crawl-delay that linked hosts ask for. Both only hold within the process:
+    every shard keeps its own.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        on_candidate: OnCandidate,
+        find_links: Optional[FindLinks] = None,
+        resolve_capabilities: ResolveCapabilities = stream_page_check_mention_capabilities,
+        list_articles: Optional[ListArticles] = None,
+        state: Optional[SiteStateStore] = None,
+        ledger: Optional[SentMentionLedger] = None,
+        threads: int = DEFAULT_CONCURRENCY,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        name: Optional[str] = None,
+        scheduler: Optional[HostScheduler] = None,
+        robots: Optional[RobotsCache] = None,
+    ) -> None:
+        assert threads >= 1
+        self._queue = queue
+        self._on_candidate = on_candidate
+        self._find_links: FindLinks = find_links or (lambda article: scanner.find_article_links(article, state))
+        self._resolve_capabilities = resolve_capabilities
+        self._list_articles: ListArticles = list_articles or list_feed_articles
+        self._state = state
+        self._ledger = ledger
+        self._threads = threads
+        self._lease_seconds = lease_seconds
+        self.name = name or default_worker_name()
+        self._scheduler = scheduler or HostScheduler(threads, min(threads, DEFAULT_PER_HOST_CONCURRENCY))
+        self._robots = robots
+        self._slots: Optional[_ThreadSlots] = None
+        self._hosts_linked: set[str] = set()
+        self._lock = threading.Lock()
+        self._counts = {KIND_SITE: 0, KIND_ARTICLE: 0, KIND_TARGET: 0}
+        self._candidates = 0
+        self._errors = 0
+        self._leases_lost = 0
+        # Set whenever one of our threads queues something, so that our idle threads needn't wait to poll
+        self._queued_more = threading.Event()
+
+    def run(self) -> ShardStats:
+        with _ThreadSlots(self._scheduler) as self._slots, Heartbeat(self._queue, self._lease_seconds) as heartbeat:
+            threads = [
+                threading.Thread(target=self._run_thread, args=(heartbeat,), name=f'shard-{i}', daemon=True)
+                for i in range(self._threads)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return self.stats()
+
+    def stats(self) -> ShardStats:
+        with self._lock:
+            return ShardStats(
+                sites=self._counts[KIND_SITE], articles=self._counts[KIND_ARTICLE], targets=self._counts[KIND_TARGET],
+                candidates=self._candidates, errors=self._errors, leases_lost=self._leases_lost,
+            )
+
+    def _run_thread(self, heartbeat: Heartbeat) -> None:
+        while True:
+            # Cleared before looking, so that anything queued after we look wakes us back up
+            self._queued_more.clear()
+            claimed = self._queue.claim(self.name, limit=1, lease_seconds=self._lease_seconds)
+            if not claimed:
+                if not self._queue.outstanding():
+                    return
+                # Someone's still working on something, which might turn into more work, or they
+                # might have crashed, in which case their lease will run out; or something that
+                # failed is waiting to be retried
+                next_expiry = self._queue.next_expiry()
+                wait = IDLE_POLL_SECONDS if next_expiry is None else next_expiry - time.time()
+                self._queued_more.wait(min(max(wait, 0), IDLE_POLL_SECONDS))
+                continue
+
+            lease = claimed[0]
+            heartbeat.hold(lease)
+            try:
+                self._work_on(lease)
+            finally:
+                heartbeat.drop(lease)
+
+    def _work_on(self, lease: Lease) -> None:
+        try:
+            if lease.kind == KIND_SITE:
+                self._complete(lease, self._list_site(lease.key))
+                if self._state is not None:
+                    # The feed's articles are all queued, so it's safe to remember that it hasn't changed
+                    self._state.commit_validators(lease.key)
+                    feed_url = self._state.feed_url(lease.key)
+                    if feed_url is not None:
+                        self._state.commit_validators(feed_url)
+            elif lease.kind == KIND_ARTICLE:
+                site_url, *fields = json.loads(lease.payload)
+                self._process_article(lease, site_url, RssItem(*fields))
+            elif lease.kind == KIND_TARGET:
+                article_url, link, removed = json.loads(lease.payload)
+                self._check_target(article_url, link, removed)
+                self._complete(lease)
+            else:
+                self._queue.fail(lease, f'Unknown kind of unit: {lease.kind}', retry=False)
+                return
+        except Exception as e:
+            # Retried later; whatever's given up on in the end is reported once, in `main`'s summary
+            with self._lock:
+                self._errors += 1
+            self._queue.fail(lease, repr(e), retry=True)
+            return
+
+        with self._lock:
+            self._counts[lease.kind] += 1
+
+    def _complete(self, lease: Lease, follow_ups: Iterable[NewUnit] = ()) -> None:
+        follow_ups = list(follow_ups)
+        if not self._queue.complete(lease, follow_ups):
+            with self._lock:
+                self._leases_lost += 1
+        if follow_ups:
+            self._queued_more.set()
+
+    def _list_site(self, site_url: str) -> Iterable[NewUnit]:
+        for article in self._list_articles(site_url, self._state):
+            if self._state is None or not self._state.is_processed(site_url, article):
+                yield article_unit(site_url, article)
+
+    def _process_article(self, lease: Lease, site_url: str, article: RssItem) -> None:
+        print(f'checking {article}')
+        links = self._find_links(article)
+        to_check = links or []
+        removed: list[str] = []
+        if self._ledger is not None and links is not None:
+            diff = self._ledger.diff_links(article.absolute_url, links)
+            to_check = diff.added
+            removed = diff.removed
+
+        # The ledger hears about each link once its unit is done (see `_check_target`)
+        self._complete(lease, [
+            *(target_unit(article.absolute_url, link) for link in to_check),
+            *(target_unit(article.absolute_url, link, removed=True) for link in removed),
+        ])
+        if self._state is not None:
+            self._state.mark_processed(site_url, article)
+
+    def _check_target(self, article_url: str, link: str, removed: bool) -> None:
+        try:
+            self._check_link(article_url, link, removed)
+        except Exception:
+            if self._state is not None:
+                # In case this was its last try: the article gets looked at again next scan
+                self._state.forget_article(article_url)
+            raise
+        if self._ledger is None:
+            return
+        # Only once it's been checked, so that a link that never is still shows up as added (or removed) next time
+        if removed:
+            self._ledger.update_link_set(article_url, removed=[link])
+        else:
+            self._ledger.update_link_set(article_url, added=[link])
+
+    def _check_link(self, article_url: str, link: str, removed: bool) -> None:
+        assert self._slots is not None
+        host = _host_of(link)
+        self._honour_crawl_delay(article_url, link, self._slots)
+        with self._slots.slot(host):
+            capabilities = self._resolve_capabilities(link)
+        if removed:
+            capabilities = removed_link_capabilities(capabilities)
+        if capabilities == NO_CAPABILITIES:
+            return
+        self._on_candidate(MentionCandidate(mentioner_url=article_url, mentioned_url=link, capabilities=capabilities))
+        with self._lock:
+            self._candidates += 1
+
+    def _honour_crawl_delay(self, article_url: str, link: str, slots: _ThreadSlots) -> None:
+        """Threads after the same robots.txt take turns at the host's slots, rather than sharing one fetch"""
+        robots = self._robots
+        if robots is None:
+            return
+        host = _host_of(link)
+        with self._lock:
+            look_up = should_look_up_crawl_delay(host, article_url, self._hosts_linked)
+        if not look_up or robots.known_crawl_delay(link) is not None:
+            # Already looked up, and the scheduler told
+            return
+        with slots.slot(host):
+            delay = robots.crawl_delay(link)
+        slots.set_crawl_delay(host, delay)
+
+
+def _host_of(url: str) -> str:
+    return parse.urlparse(url).netloc.lower()
+
+
+def report_candidate(candidate: MentionCandidate) -> None:
+    """What a dry run does with candidates: the same as `scan`"""
+    if candidate.capabilities.webmention_url is not None:
+        print(f'🥕 Found a webmention for {candidate.mentioned_url}! -> "{candidate.capabilities.webmention_url}"')
+    if candidate.capabilities.pingback_url is not None:
+        print(f'🥬 Found a pingback for {candidate.mentioned_url}! -> "{candidate.capabilities.pingback_url}"')
+
+
+def main() -> None:
+    extra_spooky_monkey_patch_to_block_local_traffic()
+
+    parser = argparse.ArgumentParser(
+        prog='Sharded scanner',
+        description='Scans sites together with any other shard processes that share the work queue',
+    )
+    parser.add_argument(
+        '--input', type=argparse.FileType('r'),
+        help='File with one site URL per line to add to the queue (- for stdin); without it, just help out',
+    )
+    parser.add_argument(
+        '--work-queue-path', default=DEFAULT_WORK_QUEUE_PATH, help='The queue file that all the shards share',
+    )
+    parser.add_argument(
+        '--network-filesystem', action='store_true',
+        help='The queue file is shared between machines over the network, so WAL is out',
+    )
+    parser.add_argument(
+        '--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS,
+        help="How long before a unit that's stopped being heartbeated (because its shard died) is handed out again",
+    )
+    parser.add_argument('--name', default=default_worker_name(), help='What to call this shard in the queue')
+    scanner.add_scan_arguments(parser)
+    args = parser.parse_args()
+
+    scanner.configure_from_args(args)
+    queue = SqliteWorkQueue(args.work_queue_path, network_filesystem=args.network_filesystem)
+    with scanner.collect_metrics(args), scanner.open_stores(args) as stores:
+        if args.input is not None:
+            if not queue.outstanding():
+                # Nothing's in progress, so this is a new crawl rather than more sites for a running one
+                queue.purge_finished()
+            site_urls = list(read_site_urls(args.input))
+            if stores.state is not None and args.full_rescan:
+                for site_url in site_urls:
+                    stores.state.forget_site(site_url)
+            added = queue.add(site_unit(site_url) for site_url in site_urls)
+            print(f'🗂️ Added {added} sites to the queue')
+
+        ledger = stores.ledger if args.real else None
+
+        def on_candidate(candidate: MentionCandidate) -> None:
+            if not args.real:
+                report_candidate(candidate)
+            elif stores.send_queue is not None:
+                stores.send_queue.enqueue(candidate)
+            else:
+                scanner.send_and_record(candidate, ledger)
+
+        resolve_capabilities, single_flight = scanner.build_capability_resolver(
+            stores.cache, args.full_page_discovery, args.seen_error_rate,
+        )
+        worker = ShardWorker(
+            queue, on_candidate, resolve_capabilities=resolve_capabilities,
+            list_articles=scanner.article_lister(args), state=stores.state, ledger=ledger,
+            threads=args.concurrency, lease_seconds=args.lease_seconds, name=args.name,
+            robots=scanner.build_robots(args),
+        )
+        stats = worker.run()
+        print(
+            f'🧩 {worker.name} did {stats.sites} sites, {stats.articles} articles and {stats.targets} links, '
+            f'and found {stats.candidates} candidates ({stats.errors} errors, {stats.leases_lost} leases lost)'
+        )
+        print(f'♻️ Saved {single_flight.saved} of {single_flight.calls} target lookups')
+        for kind, key, error in queue.failures():
+            print(f'❌ Gave up on {kind} {key}: {error}')
+
+        sender = scanner.build_sender(args, stores) if args.real else None
+        if sender is not None:
+            drain_stats = sender.drain()
+            print(
+                f'📬 Sent {drain_stats.sent} mentions, {drain_stats.retried} to retry later, '
+                f'{drain_stats.failed} failed'
+            )
+    queue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Mapping, NamedTuple, Optional
+
+from webmentions import config
+from webmentions.scanner.feed import RssItem
+
+DEFAULT_STATE_PATH = os.path.join(config.CACHE_DIR, 'site_state.sqlite3')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS feeds (
+    site_url TEXT PRIMARY KEY,
+    feed_url TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed_entries (
+    site_url TEXT NOT NULL,
+    entry_url TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    processed_at REAL NOT NULL,
+    PRIMARY KEY (site_url, entry_url)
+);
+"""
+
+
+class Validators(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+NO_VALIDATORS = Validators(etag=None, last_modified=None)
+
+
+def entry_fingerprint(item: RssItem) -> str:
+    # Feeds that bother to say when an entry was updated let us notice edits without fetching it
+    return item.updated or ''
+
+
+class SiteStateStore:
+    """
+    Remembers what we've already seen of a site between runs, so that re-scanning an unchanged site
+    is cheap: HTTP validators (ETag/Last-Modified) for pages and feeds, where each site's feed lives,
+    and which feed entries have already been processed.
+
+    Validators from this run are held back until the work that depends on them is finished (see
+    `commit_validators`): otherwise a crash halfway through an article would mean that the next
+    run gets a 304 for it and never looks at it again.
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH) -> None:
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+        self._pending_validators: dict[str, Validators] = {}
+
+    def validators(self, url: str) -> Validators:
+        with self._lock:
+            row = self._db.execute('SELECT etag, last_modified FROM validators WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return NO_VALIDATORS
+        return Validators(etag=row[0], last_modified=row[1])
+
+    def record_validators(self, url: str, headers: Mapping[str, str]) -> None:
+        """Stages the validators from a response, to be saved by `commit_validators`."""
+        validators = Validators(etag=headers.get('ETag'), last_modified=headers.get('Last-Modified'))
+        if validators == NO_VALIDATORS:
+            return
+        with self._lock:
+            self._pending_validators[url] = validators
+
+    def commit_validators(self, url: Optional[str] = None) -> None:
+        """Saves the staged validators for `url`, or all of them if no URL is given."""
+        with self._lock:
+            if url is None:
+                pending = list(self._pending_validators.items())
+                self._pending_validators.clear()
+            elif url in self._pending_validators:
+                pending = [(url, self._pending_validators.pop(url))]
+            else:
+                return
+            self._db.executemany(
+                'INSERT OR REPLACE INTO validators (url, etag, last_modified) VALUES (?, ?, ?)',
+                [(url, v.etag, v.last_modified) for url, v in pending],
+            )
+
+    def discard_validators(self, url: str) -> None:
+        """Forgets the validators staged for `url`, e.g. because we didn't get through all of what it said."""
+        with self._lock:
+            self._pending_validators.pop(url, None)
+
+    def feed_url(self, site_url: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute('SELECT feed_url FROM feeds WHERE site_url = ?', (site_url,)).fetchone()
+        return row[0] if row else None
+
+    def save_feed_url(self, site_url: str, feed_url: str) -> None:
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO feeds (site_url, feed_url) VALUES (?, ?)', (site_url, feed_url)
+            )
+
+    def is_processed(self, site_url: str, item: RssItem) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fingerprint FROM processed_entries WHERE site_url = ? AND entry_url = ?',
+                (site_url, item.absolute_url),
+            ).fetchone()
+        return row is not None and row[0] == entry_fingerprint(item)
+
+    def mark_processed(self, site_url: str, item: RssItem) -> None:
+        self.commit_validators(item.absolute_url)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO processed_entries (site_url, entry_url, fingerprint, processed_at) '
+                'VALUES (?, ?, ?, ?)',
+                (site_url, item.absolute_url, entry_fingerprint(item), time.time()),
+            )
+
+    def processed_count(self, site_url: str) -> int:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT COUNT(*) FROM processed_entries WHERE site_url = ?', (site_url,)
+            ).fetchone()
+        return int(row[0])
+
+    def forget_article(self, entry_url: str) -> None:
+        """Forgets that an article was processed, and its validators, so that the next scan looks at it again."""
+        with self._lock:
+            self._pending_validators.pop(entry_url, None)
+            self._db.execute('DELETE FROM processed_entries WHERE entry_url = ?', (entry_url,))
+            self._db.execute('DELETE FROM validators WHERE url = ?', (entry_url,))
+
+    def forget_site(self, site_url: str) -> None:
+        """Forgets everything about a site, so that the next scan starts from scratch."""
+        with self._lock:
+            self._db.execute(
+                'DELETE FROM validators WHERE url = ? OR url IN (SELECT feed_url FROM feeds WHERE site_url = ?) '
+                'OR url IN (SELECT entry_url FROM processed_entries WHERE site_url = ?)',
+                (site_url, site_url, site_url),
+            )
+            self._db.execute('DELETE FROM processed_entries WHERE site_url = ?', (site_url,))
+            self._db.execute('DELETE FROM feeds WHERE site_url = ?', (site_url,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,198 @@
+"""
+Every article on a site, not just the ones still in its feed, for backfilling: read from the
+sitemaps listed in robots.txt (or /sitemap.xml, if it doesn't list any), following sitemap indexes.
+
+https://www.sitemaps.org/protocol.html
+"""
+import gzip
+import io
+from typing import Generator, Iterator, Optional, TYPE_CHECKING, Union
+from urllib import parse
+
+from lxml import etree
+
+from webmentions import util
+from webmentions.scanner import metrics, request_utils
+from webmentions.scanner.feed import RssItem
+from webmentions.scanner.urls import DEFAULT_SEEN_CAPACITY, seen_set
+
+if TYPE_CHECKING:
+    from webmentions.scanner.site_state import SiteStateStore
+
+# Indexes of indexes aren't allowed, but some generators nest them anyway
+MAX_SITEMAP_DEPTH = 3
+# Per site; at the protocol's 50,000 URLs per sitemap, that's a lot of blog
+MAX_SITEMAPS = 1000
+
+_DEFAULT_SITEMAP_PATH = '/sitemap.xml'
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def list_sitemap_articles(
+    site_url: str, state: Optional['SiteStateStore'] = None, seen_error_rate: float = 0.0,
+) -> Iterator[RssItem]:
+    """
+    The pages in the site's sitemaps, streamed as they're parsed. Only pages on the site's own host
+    come out, each one once, with the sitemap's <lastmod> (if any) as when it was last updated.
+    With a `seen_error_rate`, duplicates are weeded out with a Bloom filter, which loses that
+    fraction of pages in exchange for not holding on to every URL.
+
+    Sitemaps are always fetched in full (never conditionally), so that a backfill that's resumed
+    sees every page again and can skip the ones it's done (see `SiteStateStore.is_processed`).
+    """
+    host = parse.urlparse(site_url).netloc.lower()
+    sitemap_urls = sitemap_urls_from_robots(site_url) or [parse.urljoin(site_url, _DEFAULT_SITEMAP_PATH)]
+    seen_sitemaps: set[str] = set()
+    seen_pages = seen_set(seen_error_rate, DEFAULT_SEEN_CAPACITY)
+    seen_pages.add(site_url)
+    for sitemap_url in sitemap_urls:
+        for item in _walk_sitemap(sitemap_url, host, seen_sitemaps, depth=0):
+            if parse.urlparse(item.absolute_url).netloc.lower() != host or not seen_pages.add(item.absolute_url):
+                continue
+            yield item
+
+
+def sitemap_urls_from_robots(site_url: str) -> list[str]:
+    robots_url = parse.urljoin(site_url, '/robots.txt')
+    try:
+        with request_utils.allow_local_addresses(), metrics.stage(metrics.FEED_FETCH, robots_url) as record:
+            r = request_utils.fetch(robots_url, request_utils.ARTICLE)
+            record.status = r.status_code
+            record.bytes = len(r.content)
+    except request_utils.ResponseTooLarge as e:
+        print(f'robots.txt is too big to read: {e}')
+        return []
+    if not r.ok:
+        return []
+    return parse_robots_sitemaps(robots_url, r.text)
+
+
+def parse_robots_sitemaps(robots_url: str, robots_txt: str) -> list[str]:
+    urls = []
+    for line in robots_txt.splitlines():
+        field, _, value = line.split('#', 1)[0].partition(':')
+        # Sitemap lines aren't part of any user-agent group, and the field name is case-insensitive
+        if field.strip().lower() == 'sitemap' and value.strip():
+            url = parse.urljoin(robots_url, value.strip())
+            if url not in urls:
+                urls.append(url)
+    return urls
+
+
+def _walk_sitemap(sitemap_url: str, host: str, seen_sitemaps: set[str], depth: int) -> Iterator[RssItem]:
+    if sitemap_url in seen_sitemaps or len(seen_sitemaps) >= MAX_SITEMAPS:
+        return
+    seen_sitemaps.add(sitemap_url)
+
+    body = _fetch_sitemap(sitemap_url, host)
+    if body is None:
+        return
+    child_sitemaps: list[str] = []
+    # Pages come out as they're parsed; nested sitemaps get fetched once this one's done with
+    yield from metrics.timed_iter(metrics.FEED_PARSE, _parse_sitemap(sitemap_url, body, child_sitemaps), sitemap_url)
+    if depth >= MAX_SITEMAP_DEPTH:
+        return
+    for child_url in child_sitemaps:
+        yield from _walk_sitemap(child_url, host, seen_sitemaps, depth + 1)
+
+
+def _fetch_sitemap(sitemap_url: str, host: str) -> Optional[bytes]:
+    # The site's own sitemaps get the same trust as its homepage; robots.txt can point elsewhere, though
+    trusted = parse.urlparse(sitemap_url).netloc.lower() == host
+    try:
+        with metrics.stage(metrics.FEED_FETCH, sitemap_url) as record:
+            if trusted:
+                with request_utils.allow_local_addresses():
+                    r = request_utils.fetch(sitemap_url, request_utils.SITEMAP)
+            else:
+                r = request_utils.fetch(sitemap_url, request_utils.SITEMAP)
+            record.status = r.status_code
+            record.bytes = len(r.content)
+    except request_utils.ResponseTooLarge as e:
+        # TODO(ux): let user know
+        print(f'Sitemap is too big to read: {e}')
+        return None
+    if not r.ok:
+        # TODO(ux): let user know, this is an error in their site
+        print(f"Couldn't fetch sitemap {sitemap_url}")
+        return None
+    return r.content
+
+
+class _CappedReader:
+    """Reads a (gzipped) sitemap, refusing to decompress more of it than a sitemap's allowed to be"""
+
+    def __init__(self, url: str, compressed: bytes, max_bytes: int) -> None:
+        self._url = url
+        self._file = gzip.GzipFile(fileobj=io.BytesIO(compressed))
+        self._remaining = max_bytes
+        self._max_bytes = max_bytes
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining + 1:
+            size = self._remaining + 1
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        if self._remaining < 0:
+            raise request_utils.ResponseTooLarge(self._url, self._max_bytes)
+        return data
+
+
+def _parse_sitemap(
+    sitemap_url: str, body: bytes, child_sitemaps: list[str],
+) -> Generator[RssItem, None, None]:
+    source: Union[_CappedReader, io.BytesIO]
+    if body.startswith(_GZIP_MAGIC):
+        # foo.xml.gz, served as-is rather than with a Content-Encoding that requests would undo for us
+        source = _CappedReader(sitemap_url, body, request_utils.DEFAULT_BYTE_CAPS[request_utils.SITEMAP])
+    else:
+        source = io.BytesIO(body.lstrip())
+
+    yielded_any = False
+    try:
+        # Matching on the local name, because plenty of sitemaps get the namespace wrong or leave it out
+        events = etree.iterparse(
+            source, events=('end',), tag=('{*}url', '{*}sitemap'),
+            resolve_entities=False, no_network=True, huge_tree=False,
+        )
+        for _, element in events:
+            loc = _child_text(element, 'loc')
+            lastmod = _child_text(element, 'lastmod')
+            is_index_entry = etree.QName(element).localname == 'sitemap'
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+            if not loc:
+                continue
+            url = parse.urljoin(sitemap_url, loc)
+            if is_index_entry:
+                child_sitemaps.append(url)
+            elif util.is_absolute_link(url):
+                yielded_any = True
+                yield RssItem(title=url, absolute_url=url, updated=lastmod)
+    except etree.XMLSyntaxError:
+        if yielded_any or not isinstance(source, io.BytesIO):
+            # TODO(reliability): recover the rest of a truncated sitemap
+            print(f'Sitemap {sitemap_url} is broken partway through')
+            return
+        # The protocol also allows plain text, one URL per line
+        yield from _parse_text_sitemap(body)
+    except request_utils.ResponseTooLarge as e:
+        print(f'Sitemap is too big to read: {e}')
+    except (OSError, EOFError):
+        # Only the gzip ones get here
+        print(f'Sitemap {sitemap_url} is not valid gzip')
+
+
+def _parse_text_sitemap(body: bytes) -> Iterator[RssItem]:
+    for line in body.decode('utf-8', errors='replace').splitlines():
+        url = line.strip()
+        if parse.urlparse(url).scheme in ('http', 'https'):
+            yield RssItem(title=url, absolute_url=url)
+
+
+def _child_text(element: etree._Element, localname: str) -> Optional[str]:
+    for child in element:
+        if isinstance(child.tag, str) and etree.QName(child).localname == localname:
+            return child.text.strip() if child.text and child.text.strip() else None
+    return None
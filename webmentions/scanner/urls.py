@@ -0,0 +1,127 @@
+"""
+Keeping the URLs a big scan accumulates cheap to hold: one copy of each string, and (optionally) a
+Bloom filter instead of a set for remembering which ones we've seen.
+"""
+import hashlib
+import math
+import sys
+from typing import Callable, Protocol
+
+from webmentions import util
+
+DEFAULT_SEEN_CAPACITY = 1_000_000
+
+
+def intern_url(url: str) -> str:
+    """
+    The one shared copy of `url`. Popular targets are linked from hundreds of articles, and every
+    article's parse makes its own string for them otherwise.
+    """
+    return sys.intern(url)
+
+
+class SeenSet(Protocol):
+    def add(self, url: str) -> bool:
+        """Remembers `url`, and returns whether it's new"""
+        ...
+
+    def __contains__(self, url: object) -> bool:
+        ...
+
+
+class ExactSeenSet:
+    """A set of normalised URLs: never wrong, but it holds on to every one of them."""
+
+    def __init__(self, normalize: Callable[[str], str] = util.normalize_url) -> None:
+        self._normalize = normalize
+        self._urls: set[str] = set()
+
+    def add(self, url: str) -> bool:
+        key = sys.intern(self._normalize(url))
+        if key in self._urls:
+            return False
+        self._urls.add(key)
+        return True
+
+    def __contains__(self, url: object) -> bool:
+        return isinstance(url, str) and self._normalize(url) in self._urls
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+
+class BloomSeenSet:
+    """
+    A Bloom filter over normalised URLs, sized so that once `capacity` URLs have been added, a URL
+    that hasn't been has `error_rate` odds of looking like it has. It never forgets one that has.
+
+    A million URLs at 0.1% is about 1.8MB, against well over a hundred for a set of them. Past
+    `capacity` the error rate climbs, though it keeps working.
+    """
+
+    def __init__(
+        self,
+        error_rate: float,
+        capacity: int = DEFAULT_SEEN_CAPACITY,
+        normalize: Callable[[str], str] = util.normalize_url,
+    ) -> None:
+        if not 0 < error_rate < 1:
+            raise ValueError(f'error_rate must be between 0 and 1, got {error_rate}')
+        if capacity < 1:
+            raise ValueError(f'capacity must be positive, got {capacity}')
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self._normalize = normalize
+        # The textbook optimal sizes for a Bloom filter
+        self._bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._bits / capacity * math.log(2)))
+        self._array = bytearray((self._bits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, url: str) -> list[int]:
+        digest = hashlib.blake2b(self._normalize(url).encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        # Two hashes are as good as k (Kirsch & Mitzenmacher), so only hash once
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self._bits for i in range(self._hashes)]
+
+    def add(self, url: str) -> bool:
+        array = self._array
+        new = False
+        for position in self._positions(url):
+            mask = 1 << (position & 7)
+            if not array[position >> 3] & mask:
+                new = True
+                array[position >> 3] |= mask
+        self._count += new
+        return new
+
+    def __contains__(self, url: object) -> bool:
+        if not isinstance(url, str):
+            return False
+        array = self._array
+        return all(array[position >> 3] & (1 << (position & 7)) for position in self._positions(url))
+
+    def __len__(self) -> int:
+        """Roughly how many URLs have been added (false positives don't count)"""
+        return self._count
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._array)
+
+
+def seen_set(
+    error_rate: float = 0.0,
+    capacity: int = DEFAULT_SEEN_CAPACITY,
+    normalize: Callable[[str], str] = util.normalize_url,
+) -> SeenSet:
+    """An exact seen-set, or a Bloom filter if some false positives are acceptable"""
+    if error_rate <= 0:
+        return ExactSeenSet(normalize)
+    return BloomSeenSet(error_rate, capacity, normalize)
+
+
+def already_normalized(url: str) -> str:
+    """For seen-sets that are only ever given URLs that have been through `util.normalize_url`"""
+    return url
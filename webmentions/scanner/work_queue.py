@@ -0,0 +1,317 @@
+"""
+A queue of units of work that any number of worker processes can pull from, on one machine or
+several. A worker claims units with a lease, keeps the lease alive with heartbeats (see
+`Heartbeat`) while it works on them, and completes them when it's done. If the worker crashes, the
+lease runs out and the unit goes to whoever claims next.
+
+`SqliteWorkQueue` keeps the queue in a file that the workers share. Anything else that can do the
+same (a database server, say) can stand in for it by implementing `WorkQueue`.
+"""
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Iterable, Iterator, NamedTuple, Optional, Protocol, Sequence
+
+from webmentions import config
+
+DEFAULT_WORK_QUEUE_PATH = os.path.join(config.CACHE_DIR, 'work_queue.sqlite3')
+DEFAULT_LEASE_SECONDS = 60.0
+# A unit that's been claimed this many times without being finished is probably what keeps
+# crashing the workers that claim it
+MAX_CLAIMS = 5
+# How long a unit that failed waits before it can be claimed again, doubling with each attempt: long
+# enough for a site that's having a bad minute to come back
+DEFAULT_RETRY_DELAY_SECONDS = 10.0
+# How long other processes get to finish a write before we give up waiting for the file lock
+_BUSY_TIMEOUT_SECONDS = 30.0
+
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_token TEXT,
+    lease_expires_at REAL,
+    last_error TEXT,
+    next_attempt_at REAL,
+    updated_at REAL NOT NULL,
+    UNIQUE (kind, key)
+);
+CREATE INDEX IF NOT EXISTS units_claimable ON units (status, priority DESC, id);
+CREATE INDEX IF NOT EXISTS units_leased ON units (status, lease_expires_at);
+"""
+
+
+class NewUnit(NamedTuple):
+    kind: str
+    # Units are queued once per (kind, key) per crawl
+    key: str
+    payload: str = ''
+    # Higher goes first
+    priority: int = 0
+
+
+class Lease(NamedTuple):
+    id: int
+    kind: str
+    key: str
+    payload: str
+    # Different every time the unit is claimed, so that a worker whose lease ran out can't finish
+    # the unit out from under whoever claimed it next
+    token: str
+    # Including this one
+    attempts: int
+
+
+class WorkQueue(Protocol):
+    def add(self, units: Iterable[NewUnit]) -> int:
+        """Queues whichever of `units` haven't been already, and returns how many that was"""
+        ...
+
+    def claim(self, worker: str, limit: int, lease_seconds: float) -> list[Lease]:
+        """Leases up to `limit` units to `worker`: pending ones, and ones whose last lease ran out"""
+        ...
+
+    def renew(self, leases: Sequence[Lease], lease_seconds: float) -> list[Lease]:
+        """Extends `leases`, and returns the ones that were still ours to extend"""
+        ...
+
+    def complete(self, lease: Lease, follow_ups: Iterable[NewUnit] = ()) -> bool:
+        """
+        Marks the unit done and queues `follow_ups` in one go, so that a crash can't lose them.
+        Returns False if the lease had already been lost (the follow-ups are queued regardless).
+        """
+        ...
+
+    def fail(self, lease: Lease, error: str, retry: bool) -> bool:
+        """
+        Puts the unit back in the queue to be tried again after a while if `retry` (and it hasn't been
+        tried too often), or gives up on it. Returns False if the lease had already been lost.
+        """
+        ...
+
+    def next_expiry(self) -> Optional[float]:
+        """When the first lease that's out now runs out, if any are"""
+        ...
+
+    def counts(self) -> dict[str, int]:
+        ...
+
+    def outstanding(self) -> int:
+        """How many units are waiting or being worked on"""
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class SqliteWorkQueue:
+    """
+    A `WorkQueue` in SQLite. Every worker opens the same file; SQLite's file locking keeps claims
+    from overlapping.
+
+    With `network_filesystem`, the file can live on a filesystem that several machines mount,
+    which means doing without WAL (it needs shared memory between the processes). That's slower,
+    and only as safe as the filesystem's locking: NFS's is famously unreliable.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_WORK_QUEUE_PATH,
+        network_filesystem: bool = False,
+        max_claims: int = MAX_CLAIMS,
+        retry_delay_seconds: float = DEFAULT_RETRY_DELAY_SECONDS,
+    ) -> None:
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._max_claims = max_claims
+        self._retry_delay_seconds = retry_delay_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=_BUSY_TIMEOUT_SECONDS, check_same_thread=False, isolation_level=None,
+        )
+        if network_filesystem:
+            self._db.execute('PRAGMA journal_mode = DELETE')
+        else:
+            self._db.execute('PRAGMA journal_mode = WAL')
+            self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.executescript(_SCHEMA)
+        # Unlike the other queues, leases that were out when we went down aren't reset here: they
+        # might belong to other workers that are still going
+
+    def add(self, units: Iterable[NewUnit]) -> int:
+        with self._lock:
+            return self._insert(units, time.time())
+
+    def _insert(self, units: Iterable[NewUnit], now: float) -> int:
+        before = self._db.total_changes
+        self._db.executemany(
+            'INSERT OR IGNORE INTO units (kind, key, payload, priority, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+            ((unit.kind, unit.key, unit.payload, unit.priority, STATUS_PENDING, now) for unit in units),
+        )
+        return self._db.total_changes - before
+
+    def claim(self, worker: str, limit: int, lease_seconds: float) -> list[Lease]:
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock, self._transaction():
+            # Whoever had these went quiet once too often
+            self._db.execute(
+                'UPDATE units SET status = ?, last_error = ?, updated_at = ? '
+                'WHERE status = ? AND lease_expires_at <= ? AND attempts >= ?',
+                (STATUS_FAILED, 'lease ran out too many times', now, STATUS_LEASED, now, self._max_claims),
+            )
+            rows = self._db.execute(
+                'SELECT id, kind, key, payload, attempts FROM units '
+                'WHERE (status = ? AND IFNULL(next_attempt_at, 0) <= ?) OR (status = ? AND lease_expires_at <= ?) '
+                'ORDER BY priority DESC, id LIMIT ?',
+                (STATUS_PENDING, now, STATUS_LEASED, now, limit),
+            ).fetchall()
+            self._db.executemany(
+                'UPDATE units SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_token = ?, '
+                'lease_expires_at = ?, updated_at = ? WHERE id = ?',
+                [(STATUS_LEASED, worker, token, now + lease_seconds, now, row[0]) for row in rows],
+            )
+        return [
+            Lease(id=row[0], kind=row[1], key=row[2], payload=row[3], token=token, attempts=row[4] + 1)
+            for row in rows
+        ]
+
+    def renew(self, leases: Sequence[Lease], lease_seconds: float) -> list[Lease]:
+        now = time.time()
+        renewed = []
+        with self._lock, self._transaction():
+            for lease in leases:
+                cursor = self._db.execute(
+                    'UPDATE units SET lease_expires_at = ?, updated_at = ? '
+                    'WHERE id = ? AND status = ? AND lease_token = ?',
+                    (now + lease_seconds, now, lease.id, STATUS_LEASED, lease.token),
+                )
+                if cursor.rowcount:
+                    renewed.append(lease)
+        return renewed
+
+    def complete(self, lease: Lease, follow_ups: Iterable[NewUnit] = ()) -> bool:
+        now = time.time()
+        with self._lock, self._transaction():
+            self._insert(follow_ups, now)
+            cursor = self._db.execute(
+                'UPDATE units SET status = ?, lease_token = NULL, last_error = NULL, updated_at = ? '
+                'WHERE id = ? AND status = ? AND lease_token = ?',
+                (STATUS_DONE, now, lease.id, STATUS_LEASED, lease.token),
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, lease: Lease, error: str, retry: bool) -> bool:
+        now = time.time()
+        status = STATUS_PENDING if retry and lease.attempts < self._max_claims else STATUS_FAILED
+        next_attempt_at = now + self._retry_delay_seconds * 2 ** (lease.attempts - 1)
+        with self._lock:
+            cursor = self._db.execute(
+                'UPDATE units SET status = ?, lease_token = NULL, last_error = ?, next_attempt_at = ?, updated_at = ? '
+                'WHERE id = ? AND status = ? AND lease_token = ?',
+                (status, error, next_attempt_at, now, lease.id, STATUS_LEASED, lease.token),
+            )
+            return cursor.rowcount > 0
+
+    def next_expiry(self) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT MIN(lease_expires_at) FROM units WHERE status = ?', (STATUS_LEASED,)
+            ).fetchone()
+        return float(row[0]) if row[0] is not None else None
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM units GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def outstanding(self) -> int:
+        counts = self.counts()
+        return counts.get(STATUS_PENDING, 0) + counts.get(STATUS_LEASED, 0)
+
+    def failures(self) -> list[tuple[str, str, Optional[str]]]:
+        """The kind, key and last error of every unit that was given up on"""
+        with self._lock:
+            return self._db.execute(
+                'SELECT kind, key, last_error FROM units WHERE status = ? ORDER BY id', (STATUS_FAILED,)
+            ).fetchall()
+
+    def purge_finished(self) -> None:
+        """Forgets the units of earlier crawls, so that the next one does them again"""
+        with self._lock:
+            self._db.execute('DELETE FROM units WHERE status IN (?, ?)', (STATUS_DONE, STATUS_FAILED))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # BEGIN IMMEDIATE takes the write lock up front, so that two processes can't both read the
+        # same pending units before either marks them as leased
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+
+class Heartbeat:
+    """
+    Renews the leases a worker is holding every `lease_seconds / 3` from a background thread, so
+    that slow units (a huge sitemap, say) don't get handed to someone else while they're still
+    being worked on, and a worker that dies stops renewing them.
+    """
+
+    def __init__(self, queue: WorkQueue, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> None:
+        self._queue = queue
+        self._lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._held: dict[int, Lease] = {}
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='heartbeat', daemon=True)
+
+    def hold(self, lease: Lease) -> None:
+        with self._lock:
+            self._held[lease.id] = lease
+
+    def drop(self, lease: Lease) -> None:
+        with self._lock:
+            self._held.pop(lease.id, None)
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self._lease_seconds / 3):
+            with self._lock:
+                held = list(self._held.values())
+            if not held:
+                continue
+            renewed = {lease.id for lease in self._queue.renew(held, self._lease_seconds)}
+            with self._lock:
+                # Someone else has these now, so there's no point trying again
+                for lease in held:
+                    if lease.id not in renewed:
+                        self._held.pop(lease.id, None)
+
+    def __enter__(self) -> 'Heartbeat':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._stopping.set()
+        self._thread.join()
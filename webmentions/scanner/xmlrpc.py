@@ -0,0 +1,130 @@
+"""
+Just enough XML-RPC for pingbacks: serializing a `pingback.ping` call and decoding the response.
+
+http://www.hixie.ch/specs/pingback/pingback
+http://xmlrpc.com/spec.md
+"""
+import re
+from typing import Iterable, NamedTuple, Optional, Union, cast
+
+from lxml import etree
+
+# Pingback responses are a one-line string or a fault; anything this big isn't one
+DEFAULT_MAX_RESPONSE_BYTES = 64 * 1024
+
+# Laid out exactly as lxml pretty-prints it, which is what we used to send
+_PINGBACK_REQUEST_TEMPLATE = """<?xml version='1.0' encoding='utf-8'?>
+<methodCall>
+  <methodName>pingback.ping</methodName>
+  <params>
+    <param>
+      <value>
+        <string>{source}</string>
+      </value>
+    </param>
+    <param>
+      <value>
+        <string>{target}</string>
+      </value>
+    </param>
+  </params>
+</methodCall>
+"""
+
+# Same escaping as lxml does for text content
+_TEXT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;'})
+_NOT_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# No DTDs, no entity expansion, no network: responses come from arbitrary hosts
+_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, load_dtd=False, huge_tree=False)
+
+_FAULT_MEMBERS = etree.XPath('/methodResponse/fault/value/struct/member')
+_FIRST_PARAM_VALUE = etree.XPath('/methodResponse/params/param[1]/value')
+
+
+class Fault(NamedTuple):
+    code: int
+    message: str
+
+
+class Success(NamedTuple):
+    # The first param, if it was a string. For pingbacks it's purely informational.
+    value: Optional[str]
+
+
+class MalformedResponse(Exception):
+    """The response wasn't a well-formed XML-RPC methodResponse (or was too big to be one)"""
+
+
+def encode_pingback_request(source_uri: str, target_uri: str) -> str:
+    return _PINGBACK_REQUEST_TEMPLATE.format(
+        source=_escape_text(source_uri), target=_escape_text(target_uri),
+    )
+
+
+def _escape_text(value: str) -> str:
+    if _NOT_XML_CHARS.search(value):
+        # lxml refuses to serialize these too; they can't appear in an XML 1.0 document at all
+        raise ValueError(f'Not representable in XML: {value!r}')
+    return value.translate(_TEXT_ESCAPES)
+
+
+def decode_response(body: bytes, max_bytes: int = DEFAULT_MAX_RESPONSE_BYTES) -> Union[Success, Fault]:
+    if len(body) > max_bytes:
+        raise MalformedResponse(f'Response is over {max_bytes} bytes')
+    try:
+        # Plenty of servers emit whitespace before the XML declaration, which lxml won't accept
+        root = etree.fromstring(body.lstrip(), _PARSER)
+    except etree.XMLSyntaxError as e:
+        raise MalformedResponse(str(e)) from e
+    if root.tag != 'methodResponse':
+        raise MalformedResponse(f'Expected a methodResponse, got {root.tag!r}')
+
+    members = _select(_FAULT_MEMBERS, root)
+    if members:
+        return _decode_fault(members)
+
+    values = _select(_FIRST_PARAM_VALUE, root)
+    if not values:
+        if root.find('fault') is not None:
+            raise MalformedResponse('Fault without a struct')
+        return Success(value=None)
+    return Success(value=_string_value(values[0]))
+
+
+def _decode_fault(members: Iterable[etree._Element]) -> Fault:
+    fields: dict[str, etree._Element] = {}
+    for member in members:
+        name = member.findtext('name')
+        value = member.find('value')
+        if name is not None and value is not None:
+            fields[name.strip()] = value
+
+    code_value = fields.get('faultCode')
+    code_text = None
+    if code_value is not None:
+        code_text = code_value.findtext('int')
+        if code_text is None:
+            code_text = code_value.findtext('i4')
+    message = _string_value(fields['faultString']) if 'faultString' in fields else None
+    if code_text is None or message is None:
+        raise MalformedResponse('Fault is missing faultCode or faultString')
+    try:
+        code = int(code_text.strip())
+    except ValueError as e:
+        raise MalformedResponse(f'faultCode is not an int: {code_text!r}') from e
+    return Fault(code=code, message=message)
+
+
+def _string_value(value: etree._Element) -> Optional[str]:
+    string = value.find('string')
+    if string is not None:
+        return string.text or ''
+    if len(value) == 0:
+        # A <value> with no type inside is a string, per the spec
+        return value.text or ''
+    return None
+
+
+def _select(xpath: etree.XPath, root: etree._Element) -> list[etree._Element]:
+    return cast(list[etree._Element], xpath(root))
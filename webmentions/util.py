@@ -1,3 +1,4 @@
+import re
 from urllib import parse
 
 
@@ -8,3 +9,75 @@ def is_absolute_link(url: str) -> bool:
 def is_only_fragment(url: str) -> bool:
     *stuff, fragment = parse.urlparse(url)
     return bool(not any(s for s in stuff) and fragment)
+
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_PERCENT_ESCAPE = re.compile('%([0-9a-fA-F]{2})')
+# RFC 3986 section 2.3: escaping these doesn't change what the URL means
+_UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalises a URL for the purposes of deciding whether two links point at the same thing: the
+    scheme and host are case-insensitive, default ports and fragments don't matter, and neither do
+    dot segments in the path or how (or whether) unreserved characters are percent-escaped.
+
+    Links that don't parse (a port that isn't a number, say) are normalised as far as they can be,
+    rather than raising: they come straight out of other people's pages.
+    """
+    try:
+        parsed = parse.urlsplit(url)
+    except ValueError:
+        # e.g. an unclosed IPv6 literal
+        return url
+    scheme = parsed.scheme.lower()
+    try:
+        port = parsed.port
+    except ValueError:
+        netloc = parsed.netloc.lower()
+    else:
+        netloc = (parsed.hostname or '').lower()
+        if ':' in netloc:
+            # IPv6 literal
+            netloc = f'[{netloc}]'
+        if port is not None and port != _DEFAULT_PORTS.get(scheme):
+            netloc = f'{netloc}:{port}'
+        if parsed.username or parsed.password:
+            userinfo = parsed.username or ''
+            if parsed.password:
+                userinfo = f'{userinfo}:{parsed.password}'
+            netloc = f'{userinfo}@{netloc}'
+    path = _remove_dot_segments(_normalize_escapes(parsed.path)) or '/'
+    return parse.urlunsplit((scheme, netloc, path, _normalize_escapes(parsed.query), ''))
+
+
+def _normalize_escapes(value: str) -> str:
+    if '%' not in value:
+        return value
+
+    def normalize(match: re.Match[str]) -> str:
+        char = chr(int(match.group(1), 16))
+        return char if char in _UNRESERVED else f'%{match.group(1).upper()}'
+
+    return _PERCENT_ESCAPE.sub(normalize, value)
+
+
+def _remove_dot_segments(path: str) -> str:
+    """RFC 3986 section 5.2.4, more or less"""
+    if '.' not in path:
+        return path
+    segments = path.split('/')
+    output: list[str] = []
+    for segment in segments:
+        if segment == '.':
+            continue
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+            continue
+        output.append(segment)
+    if segments[-1] in ('.', '..'):
+        # /a/b/.. is the directory /a/, not the file /a
+        output.append('')
+    return '/'.join(output)